@@ -25,6 +25,8 @@ class Airport:
     #     this is a tuple containing the longitude and latitude of
     #     the airport's coordinates on the world map.
 
+    __slots__ = ("name", "_airport_id", "_map_location")
+
     name: str
     _airport_id: str
     _map_location: Tuple[float, float]
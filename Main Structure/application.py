@@ -1,12 +1,20 @@
 """Applications for creating customers, flight segments, airports and trips"""
 import csv
 import datetime
-from typing import Dict, List, Tuple
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from airport import Airport
 from customer import Customer
+from dataset import LazySegments, book_itinerary, load_lazy, \
+    parse_itinerary, resolve_itinerary
+from fares import FareEngine
 from flight import Trip, FlightSegment
-from visualizer import Visualizer
+from geometry import Route, build_routes
+from journal import BookingJournal
+from parsing import read_rows, stream_rows
+from symbols import SYMBOLS
+import instrument
 
 # AIRPORT_LOCATIONS: global mapping of an airport's IATA with their respective
 #                    longitude and latitude positions.
@@ -14,17 +22,45 @@ from visualizer import Visualizer
 # create_airports(), but you are welcome to use it as you see fit.
 AIRPORT_LOCATIONS = {}
 
+# ROUTES: global cache of the great-circle geometry of every (departure,
+#         arrival) IATA pair flown, shared by all FlightSegments on that route.
+#         Populated by create_flight_segments(), from AIRPORT_LOCATIONS.
+ROUTES: Dict[Tuple[str, str], Route] = {}
+
+# DATA_DIR: the directory holding the datasets.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "..", "data")
+
+# DATASETS: the segment and trip files of each dataset shipped in DATA_DIR.
+DATASETS = {"small": ("segments_small.csv", "trips_small.csv"),
+            "full": ("segments.csv", "trips.csv")}
+
 # DEFAULT_BASE_COST: Default rate per km for the base cost of a flight segment.
 DEFAULT_BASE_COST = 0.1225
 
+# LAZY_ENV_VAR: setting this environment variable makes the application only
+#               index the trips file at startup, building each customer's
+#               trips the first time they are needed.
+LAZY_ENV_VAR = "PYTHON_AIR_LAZY"
+
+# JOURNAL_ENV_VAR: setting this environment variable to a directory keeps a
+#                  BookingJournal there: at startup, the bookings are then
+#                  recovered from its last checkpoint and the events logged
+#                  after it, rather than loaded from the trips file.
+JOURNAL_ENV_VAR = "PYTHON_AIR_JOURNAL"
+
 
 def import_data(file_airports: str, file_customers: str, file_segments: str,
-                file_trips: str) -> Tuple[
+                file_trips: str, workers: int = 1) -> Tuple[
         List[List[str]], List[List[str]], List[List[str]], List[List[str]]]:
     """ Opens all the data files <data/filename.csv> which stores the CSV data,
         and returns a tuple of lists of lists of strings. This contains the 
         read in data, line-by-line, (airports, customers, flights, trips).
 
+        If <workers> is more than 1, the (large) segment and trip files are
+        parsed by that many processes, each given a byte range of the file,
+        with the same result.
+
         Precondition: the dataset file must be in CSV format.
     """
 
@@ -32,8 +68,12 @@ def import_data(file_airports: str, file_customers: str, file_segments: str,
 
     airport_data = csv.reader(open(file_airports))
     customer_data = csv.reader(open(file_customers))
-    flight_data = csv.reader(open(file_segments))
-    trip_data = csv.reader(open(file_trips))
+    if workers > 1:
+        flight_data = read_rows(file_segments, workers)
+        trip_data = read_rows(file_trips, workers)
+    else:
+        flight_data = csv.reader(open(file_segments))
+        trip_data = csv.reader(open(file_trips))
 
     for row in airport_data:
         airport_log.append(row)
@@ -50,7 +90,7 @@ def import_data(file_airports: str, file_customers: str, file_segments: str,
     return airport_log, flight_log, customer_log, trip_log
 
 
-def create_customers(log: List[List[str]]) -> Dict[int, Customer]:
+def create_customers(log: Iterable[List[str]]) -> Dict[int, Customer]:
     """ Returns a dictionary of Customer IDs and their Customer instances, 
     based on the customers from the input dataset from the <log>.
 
@@ -64,19 +104,46 @@ def create_customers(log: List[List[str]]) -> Dict[int, Customer]:
     return customers_dic
 
 
-def create_flight_segments(log: List[List[str]]) \
+def flight_segment(fid: str, dep_code: str, arr_code: str,
+                   dep_dt: datetime.datetime, arr_dt: datetime.datetime,
+                   dist: float) -> FlightSegment:
+    """ Returns a new FlightSegment with the given fields, the
+    DEFAULT_BASE_COST, and the geometry of its route in ROUTES, which is
+    built first if it is not there yet. An <arr_dt> before the <dep_dt> is
+    an overnight flight, arriving at that time on the next day.
+    """
+    if arr_dt < dep_dt:
+        arr_dt += datetime.timedelta(days=1)
+    route = ROUTES.get((dep_code, arr_code))
+    if route is None:
+        ROUTES.update(build_routes(AIRPORT_LOCATIONS, [(dep_code, arr_code)]))
+        route = ROUTES[(dep_code, arr_code)]
+    return FlightSegment(fid, dep_dt, arr_dt, DEFAULT_BASE_COST, dist,
+                         dep_code, arr_code, route.long_lat, route.arc)
+
+
+def create_flight_segments(log: Iterable[List[str]]) \
         -> Dict[datetime.date, List[FlightSegment]]:
     """ Returns a dictionary storing all FlightSegments, indexed by their
     departure date, based on the input dataset stored in the <log>.
 
+    The coordinates of each segment are resolved from AIRPORT_LOCATIONS, so
+    the airports must be created first. All segments on the same route share
+    that route's cached geometry in ROUTES.
+
+    The rows are read in a single pass, so the <log> may stream them from
+    a file; the route of each segment is built the first time it is met.
+
     Precondition:
-    - The <log> list contains the input data in the correct format.
+    - The <log> contains the input data in the correct format.
     """
+    # Flight IDs, IATA codes and lengths repeat every day, so each segment
+    # holds the copy interned in SYMBOLS rather than its own.
     d = {}
     for row in log:
-        fid = row[0]
-        dep_code = row[1]
-        arr_code = row[2]
+        fid = SYMBOLS.intern(row[0])
+        dep_code = SYMBOLS.intern(row[1])
+        arr_code = SYMBOLS.intern(row[2])
         date_parts = list(map(int, row[3].split(":")))
         dep_time_parts = list(map(int, row[4].split(":")))
         arr_time_parts = list(map(int, row[5].split(":")))
@@ -85,10 +152,8 @@ def create_flight_segments(log: List[List[str]]) \
                                    dep_time_parts[0], dep_time_parts[1])
         arr_dt = datetime.datetime(year, month, day,
                                    arr_time_parts[0], arr_time_parts[1])
-        dist = float(row[6])
-        coords = ((0.0, 0.0), (0.0, 0.0))
-        seg = FlightSegment(fid, dep_dt, arr_dt,
-                            DEFAULT_BASE_COST, dist, dep_code, arr_code, coords)
+        dist = SYMBOLS.intern(float(row[6]))
+        seg = flight_segment(fid, dep_code, arr_code, dep_dt, arr_dt, dist)
         dep_date = dep_dt.date()
         if dep_date not in d:
             d[dep_date] = []
@@ -96,29 +161,33 @@ def create_flight_segments(log: List[List[str]]) \
     return d
 
 
-def create_airports(log: List[List[str]]) -> List[Airport]:
+def create_airports(log: Iterable[List[str]]) -> List[Airport]:
     """ Return a list of Airports with all applicable data, based
-    on the input dataset stored in the <log>.
+    on the input dataset stored in the <log>. Each airport's location is
+    also recorded in AIRPORT_LOCATIONS, under its IATA.
 
     Precondition:
     - The <log> list contains the input data in the correct format.
     """
     airs = []
     for i in log:
-        iata = i[0]
+        iata = SYMBOLS.intern(i[0])
         name = i[1]
         loc = (float(i[2]), float(i[3]))
         air = Airport(iata, name, loc)
-        AIRPORT_LOCATIONS[iata] = air
+        AIRPORT_LOCATIONS[iata] = loc
         airs.append(air)
     return airs
 
 
-def load_trips(log: List[List[str]], customer_dict: Dict[int, Customer],
-               flight_segments: Dict[datetime.date, List[FlightSegment]]) \
-        -> List[Trip]:
+def load_trips(log: Iterable[List[str]], customer_dict: Dict[int, Customer],
+               flight_segments: Dict[datetime.date, List[FlightSegment]],
+               fare_engine: Optional[FareEngine] = None) -> List[Trip]:
     """ Creates the Trip objects and makes the bookings.
 
+    Every trip is priced by the <fare_engine> (a new one if none is given),
+    in a single pass once all the trips are booked.
+
     Preconditions:
     - The <log> list contains the input data in the correct format.
     - the customers are already correctly stored in the <customer_dict>,
@@ -126,52 +195,101 @@ def load_trips(log: List[List[str]], customer_dict: Dict[int, Customer],
     - the flight segments are already correctly stored in the 
     <flight_segments>, indexed by their departure date
     """
+    fares = FareEngine() if fare_engine is None else fare_engine
     d = []
     for j in log:
         res_id = j[0]
-        cus_id = int(j[1])
+        cus_id = SYMBOLS.intern(int(j[1]))
         year, month, day = map(int, j[2].split("-"))
-        trip_date = datetime.date(year, month, day)
-        raw_segment_str = j[3]
-        cleaned = raw_segment_str.strip("[]")
-        entries = cleaned.split("),(")
-        segments = []
-        for i in entries:
-            i = i.strip("()").replace("'", "").replace('"', '')
-            parts = i.split(",")
-            if len(parts) < 2:
-                continue
-            dep_air = parts[0].strip()
-            seat_type = parts[1].strip()
-            for seg in flight_segments.get(trip_date, []):
-                if seg.get_dep() == dep_air:
-                    segments.append((seg, seat_type))
-                    break
-        if segments:
-            trip = customer_dict[cus_id].book_trip(res_id, segments, trip_date)
+        trip_date = SYMBOLS.intern(datetime.date(year, month, day))
+        segments = resolve_itinerary(parse_itinerary(j[3:]),
+                                     flight_segments.get(trip_date, []))
+        # A trip is only booked if every one of its seats could be.
+        if segments and book_itinerary(cus_id, segments):
+            customer = customer_dict[cus_id]
+            trip = customer.book_trip(res_id, segments, trip_date,
+                                      deferred=True)
+            fares.add_trip(customer, trip, segments)
             d.append(trip)
+    fares.price()
     return d
 
 
+def recover_trips(log: Iterable[List[str]], customer_dict: Dict[int, Customer],
+                  flight_segments: Dict[datetime.date, List[FlightSegment]],
+                  journal: BookingJournal,
+                  fare_engine: Optional[FareEngine] = None) -> List[Trip]:
+    """ Returns the Trips booked, recovering them through the <journal> if
+    it holds any bookings, or loading them from the <log> with load_trips
+    if it does not (e.g. on the first start). The journal is then
+    checkpointed, so the next start only replays the events logged after
+    this one. Trips are priced with the <fare_engine>, if given.
+
+    Preconditions:
+    - as for load_trips, with no trips loaded or seats booked yet.
+    """
+    if journal.has_bookings():
+        journal.recover(flight_segments, customer_dict, fare_engine)
+        trips = [trip for cus in customer_dict.values()
+                 for trip in cus.get_trips()]
+    else:
+        trips = load_trips(log, customer_dict, flight_segments, fare_engine)
+    journal.checkpoint(flight_segments, customer_dict)
+    return trips
+
+
 if __name__ == '__main__':
     print("\n---------------------------------------------")
     print("Reading in all data! Processing...")
     print("---------------------------------------------\n")
 
-    # input_data = import_data('data/airports.csv', 'data/customers.csv',
-    #     'data/segments.csv', 'data/trips.csv')
-    input_data = import_data('../data/airports.csv', 'data/customers.csv',
-                             'data/segments_small.csv', 'data/trips_small.csv')
-
-    airports = create_airports(input_data[0])
+    # data_files = ('../data/airports.csv', '../data/customers.csv',
+    #               '../data/segments.csv', '../data/trips.csv')
+    data_files = ('../data/airports.csv', '../data/customers.csv',
+                  '../data/segments_small.csv', '../data/trips_small.csv')
+    lazy = bool(os.environ.get(LAZY_ENV_VAR))
+    # Recovering from a journal needs every trip built, so it is not lazy.
+    journal_dir = os.environ.get(JOURNAL_ENV_VAR)
+    journal = BookingJournal(journal_dir) if journal_dir else None
+    lazy = lazy and journal is None
+    # In lazy mode the trips file is only indexed, not read in. The others
+    # are read row by row as they are loaded, rather than all at once, so
+    # the memory of the rows read is reused instead of left behind.
+    input_data = (stream_rows(data_files[0]), stream_rows(data_files[2]),
+                  stream_rows(data_files[1]),
+                  stream_rows(os.devnull if lazy else data_files[3]))
+
+    if os.environ.get(instrument.ENV_VAR):
+        instrument.enable()
+
+    with instrument.span("load.create_airports"):
+        airports = create_airports(input_data[0])
     print("Airports Created! Still Processing...")
-    flights = create_flight_segments(input_data[1])
+    with instrument.span("load.create_flight_segments"):
+        flights = create_flight_segments(input_data[1])
     print("Flight Segments Created! Still Processing...")
-    customers = create_customers(input_data[2])
-    print("Customers Created! Still Processing...")
-    print("Loading trips can take a while...")
-    trips = load_trips(input_data[3], customers, flights)
-    print("Trips Created! Opening Visualizer...\n")
+    if lazy:
+        with instrument.span("load.load_lazy"):
+            customers, index = load_lazy(data_files[3], input_data[2],
+                                         flights)
+        print("Customers Created and Trips Indexed! Opening Visualizer...\n")
+        trip_count = len(index)
+        all_flights = LazySegments(index)
+    else:
+        with instrument.span("load.create_customers"):
+            customers = create_customers(input_data[2])
+        print("Customers Created! Still Processing...")
+        print("Loading trips can take a while...")
+        if journal is None:
+            with instrument.span("load.load_trips"):
+                trips = load_trips(input_data[3], customers, flights)
+        else:
+            with instrument.span("load.recover_trips"):
+                trips = recover_trips(input_data[3], customers, flights,
+                                      journal)
+        print("Trips Created! Opening Visualizer...\n")
+        trip_count = len(trips)
+        all_flights = [seg for tp in trips for seg in tp.get_flight_segments()]
 
     flights_len = 0
     for ky in flights:
@@ -183,32 +301,38 @@ if __name__ == '__main__':
     print("Total airports in the dataset:", len(airports))
     print("Total flight segments in the dataset:", flights_len)
     print("Total customers in the dataset:", len(customers))
-    print("Total trips in the dataset:", len(trips))
+    print("Total trips in the dataset:", trip_count)
     print("---------------------------------------------\n")
 
-    all_flights = [seg for tp in trips for seg in tp.get_flight_segments()]
     all_customers = [customers[cid] for cid in customers]
 
+    # The GUI libraries are only imported once the GUI is needed.
+    from visualizer import Visualizer
+
     V = Visualizer()
-    V.draw(all_flights)
+    # Until a filter asks for trips, a lazy dataset only draws those loaded.
+    V.draw(all_flights.loaded() if lazy else all_flights)
 
     while not V.has_quit():
 
-        flights = V.handle_window_events(all_customers, all_flights)
-
-        all_flights = []
+        all_flights = V.handle_window_events(all_customers, all_flights)
 
-        for flt in flights:
-            all_flights.append(flt)
+        V.draw(all_flights.loaded() if isinstance(all_flights, LazySegments)
+               else all_flights)
 
-        V.draw(all_flights)
+    if journal is not None:
+        journal.close()
+    if instrument.is_enabled():
+        instrument.dump()
 
     import python_ta
 
     python_ta.check_all(config={
         'allowed-import-modules': [
             'python_ta', 'typing', 'csv', 'datetime', 'doctest',
-            'visualizer', 'customer', 'flight', 'airport'
+            'visualizer', 'customer', 'flight', 'airport', 'geometry',
+            'fares', 'instrument', 'os', 'dataset', 'symbols', 'parsing',
+            'journal'
         ],
         'max-nested-blocks': 6,
         'allowed-io': [
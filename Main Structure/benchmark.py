@@ -0,0 +1,458 @@
+"""Benchmarks for the loading, filtering, booking and rendering hot paths"""
+import argparse
+import datetime
+import gc
+import json
+import math
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import application
+from filter import CustomerFilter, DateFilter, DurationFilter, \
+    LocationFilter, TripFilter
+from airport import Airport
+from customer import Customer
+from flight import FlightSegment, Trip
+from parsing import stream_rows
+from symbols import SYMBOLS
+from timeline import Timeline, minute_of
+
+# DATA_DIR: the directory holding the datasets.
+DATA_DIR = application.DATA_DIR
+
+# BASELINE_FILE: the default file the baseline results are kept in.
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "benchmarks", "baseline.json")
+
+# DATASETS: the segment and trip files of each dataset benchmarked.
+DATASETS = application.DATASETS
+
+# THRESHOLD: by default, a benchmark regresses if its median time grows by
+#            more than this fraction of its baseline median.
+THRESHOLD = 0.10
+
+# A benchmark is (name, setup, run): setup builds fresh input, untimed, and
+# run is the timed work done on it.
+Benchmark = Tuple[str, Callable[[], Any], Callable[[Any], Any]]
+
+
+def measure(setup: Callable[[], Any], run: Callable[[Any], Any],
+            repeat: int) -> Dict[str, float]:
+    """ Times <run> on fresh input from <setup>, <repeat> times, then once
+        more while tracing memory. Returns the median and 95th percentile
+        times, in seconds, and the peak memory allocated by one run, in
+        bytes.
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times.sort()
+    return {"median": statistics.median(times),
+            "p95": times[max(0, math.ceil(0.95 * len(times)) - 1)],
+            "peak_alloc": peak, "runs": repeat}
+
+
+def load_benchmarks(dataset: str) -> List[Benchmark]:
+    """ Returns the benchmarks of each create_* function and load_trips, on
+        the given <dataset>.
+    """
+    seg_file, trip_file = DATASETS[dataset]
+    logs = application.import_data(
+        os.path.join(DATA_DIR, "airports.csv"),
+        os.path.join(DATA_DIR, "customers.csv"),
+        os.path.join(DATA_DIR, seg_file), os.path.join(DATA_DIR, trip_file))
+    application.create_airports(logs[0])
+
+    def fresh_segments() -> List[List[str]]:
+        """ Clears the route cache, so segments are built from scratch. """
+        application.ROUTES.clear()
+        return logs[1]
+
+    def fresh_model() -> Tuple:
+        """ Returns new customers and segments, with nothing booked. """
+        return (application.create_customers(logs[2]),
+                application.create_flight_segments(logs[1]))
+
+    return [
+        ("create_airports", lambda: logs[0], application.create_airports),
+        ("create_customers", lambda: logs[2], application.create_customers),
+        ("create_flight_segments", fresh_segments,
+         application.create_flight_segments),
+        ("load_trips", fresh_model,
+         lambda model: application.load_trips(logs[3], model[0], model[1])),
+    ]
+
+
+def filter_benchmarks(dataset: str) -> List[Benchmark]:
+    """ Returns the benchmarks of every filter, applied to the segments of all
+        trips of the given <dataset> with a representative filter string.
+    """
+    seg_file, trip_file = DATASETS[dataset]
+    logs = application.import_data(
+        os.path.join(DATA_DIR, "airports.csv"),
+        os.path.join(DATA_DIR, "customers.csv"),
+        os.path.join(DATA_DIR, seg_file), os.path.join(DATA_DIR, trip_file))
+    application.create_airports(logs[0])
+    customers = application.create_customers(logs[2])
+    trips = application.load_trips(
+        logs[3], customers, application.create_flight_segments(logs[1]))
+    segments = [seg for trip in trips for seg in trip.get_flight_segments()]
+    everyone = list(customers.values())
+    cases = [(CustomerFilter(), str(trips[0].customer_id)),
+             (LocationFilter(), "YYZ"),
+             (DurationFilter(), "L300"),
+             (DurationFilter(), "G600"),
+             (DateFilter(), "2019-01-01/2019-01-31"),
+             (TripFilter(), trips[-1].get_reservation_id())]
+    return [("{}({})".format(type(f).__name__, s), lambda: segments,
+             lambda data, f=f, s=s: f.apply(everyone, data, s))
+            for f, s in cases]
+
+
+def booking_benchmarks(operations: int = 50000) -> List[Benchmark]:
+    """ Returns a benchmark of <operations> seat bookings and cancellations,
+        churning over a day's worth of flight segments.
+    """
+    dep = datetime.datetime(2019, 1, 1, 9, 0)
+    arr = datetime.datetime(2019, 1, 1, 17, 0)
+
+    def fresh_segments() -> List[FlightSegment]:
+        """ Returns new, empty flight segments. """
+        return [FlightSegment("BM-{:03d}".format(i), dep, arr, 0.1225, 1000.0,
+                              "YYZ", "CDG", ((0.0, 0.0), (0.0, 0.0)))
+                for i in range(200)]
+
+    def churn(segments: List[FlightSegment]) -> None:
+        """ Books seats for many customers, cancelling every other one. """
+        for i in range(operations // 2):
+            seg = segments[i % len(segments)]
+            seg.book_seat(i, "Economy" if i % 7 else "Business")
+            if i % 2:
+                segments[(i - 1) % len(segments)].cancel_seat(i - 1)
+
+    return [("book_seat/cancel_seat churn", fresh_segments, churn)]
+
+
+def render_benchmarks(dataset: str) -> List[Benchmark]:
+    """ Returns the benchmarks of Map.render_objects drawing the segments
+        of all trips of the given <dataset> onto an off-screen surface, and
+        of Map.render_heatmap building their heatmap and drawing it once
+        built.
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    from visualizer import Map, SCREEN_SIZE
+
+    pygame.init()
+    seg_file, trip_file = DATASETS[dataset]
+    logs = application.import_data(
+        os.path.join(DATA_DIR, "airports.csv"),
+        os.path.join(DATA_DIR, "customers.csv"),
+        os.path.join(DATA_DIR, seg_file), os.path.join(DATA_DIR, trip_file))
+    application.create_airports(logs[0])
+    trips = application.load_trips(
+        logs[3], application.create_customers(logs[2]),
+        application.create_flight_segments(logs[1]))
+    segments = [seg for trip in trips for seg in trip.get_flight_segments()]
+    surface = pygame.Surface(SCREEN_SIZE)
+
+    def fresh_map() -> Map:
+        """ Returns a new Map, with nothing projected yet. """
+        return Map(SCREEN_SIZE)
+
+    def heated_map() -> Map:
+        """ Returns a new Map, with its heatmap already built. """
+        m = Map(SCREEN_SIZE)
+        m.render_heatmap(segments, surface)
+        return m
+
+    return [("Map.render_objects", fresh_map,
+             lambda m: m.render_objects(segments, surface)),
+            ("Map.render_heatmap build", fresh_map,
+             lambda m: m.render_heatmap(segments, surface)),
+            ("Map.render_heatmap frame", heated_map,
+             lambda m: m.render_heatmap(segments, surface))]
+
+
+def timeline_benchmarks(dataset: str) -> List[Benchmark]:
+    """ Returns the benchmarks of building the Timeline of every flight
+        segment of the given <dataset>, and of playing a day of it back a
+        minute at a time, as the visualizer's playback does frame by frame.
+    """
+    seg_file = DATASETS[dataset][0]
+    logs = application.import_data(
+        os.path.join(DATA_DIR, "airports.csv"), os.devnull,
+        os.path.join(DATA_DIR, seg_file), os.devnull)
+    application.create_airports(logs[0])
+    segments = [seg for day in application.create_flight_segments(
+        logs[1]).values() for seg in day]
+    timeline = Timeline(segments)
+    # The busiest day, by departures
+    days = {}
+    for seg in segments:
+        day = seg.get_times()[0].date()
+        days[day] = days.get(day, 0) + 1
+    busiest = max(days, key=days.get)
+    first = minute_of(datetime.datetime.combine(busiest, datetime.time()))
+
+    def fresh_timeline() -> Timeline:
+        """ Returns the timeline, at the start of the busiest day. """
+        timeline.seek(first)
+        return timeline
+
+    def play_day(t: Timeline) -> None:
+        """ Draws nothing, but finds the segments of every frame. """
+        for minute in range(first, first + 24 * 60):
+            t.seek(minute)
+
+    return [("Timeline build", lambda: segments, Timeline),
+            ("Timeline day playback", fresh_timeline, play_day)]
+
+
+def bytes_per_object(make: Callable[[], object], count: int = 10000) -> float:
+    """ Returns the bytes allocated per object, on average, by making <count>
+        objects with <make> and keeping them all, i.e. those taken by each
+        object, its attributes' storage and any container it creates, but
+        not by the values <make> passes in.
+    """
+    gc.collect()
+    tracemalloc.start()
+    objects = [make() for _ in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - sys.getsizeof(objects)
+    tracemalloc.stop()
+    return size / count
+
+
+def memory_report(dataset: str) -> Dict[str, int]:
+    """ Loads the <dataset> while tracing memory, and returns the bytes still
+        allocated once the files read in are freed (i.e. those held by its
+        airports, customers, flight segments and trips), with the number of
+        each and of the symbols interned, and the bytes taken by one of each
+        (as bytes_per_object).
+
+        Symbols interned by an earlier load are not counted again, so this
+        is best run first.
+    """
+    seg_file, trip_file = DATASETS[dataset]
+    application.ROUTES.clear()
+    gc.collect()
+    tracemalloc.start()
+    logs = application.import_data(
+        os.path.join(DATA_DIR, "airports.csv"),
+        os.path.join(DATA_DIR, "customers.csv"),
+        os.path.join(DATA_DIR, seg_file), os.path.join(DATA_DIR, trip_file))
+    airports = application.create_airports(logs[0])
+    customers = application.create_customers(logs[2])
+    segments = application.create_flight_segments(logs[1])
+    trips = application.load_trips(logs[3], customers, segments)
+    del logs
+    gc.collect()
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    air, trip = airports[0], trips[0]
+    seg, cust = trip.get_flight_segments()[0], customers[trip.customer_id]
+    dep, arr = seg.get_times()
+    makers = {
+        "Airport": lambda: Airport(air.get_airport_id(), air.name,
+                                   air.get_location()),
+        "Customer": lambda: Customer(cust.get_id(), cust.name, cust.age,
+                                     cust.nationality),
+        "FlightSegment": lambda: FlightSegment(
+            seg.get_fid(), dep, arr, seg.get_base_fare_cost(),
+            seg.get_length(), seg.get_dep(), seg.get_arr(),
+            seg.get_long_lat(), seg.get_arc()),
+        "Trip": lambda: Trip(trip.get_reservation_id(), trip.customer_id,
+                             trip.trip_departure,
+                             trip.get_flight_segments())}
+    report = {"heap": heap, "airports": len(airports),
+              "customers": len(customers),
+              "segments": sum(len(day) for day in segments.values()),
+              "trips": len(trips), "symbols": len(SYMBOLS)}
+    for name, make in makers.items():
+        report[name] = round(bytes_per_object(make))
+    return report
+
+
+def resident_memory() -> Optional[int]:
+    """ Returns the resident memory of this process, in bytes, or None if it
+        cannot be read (i.e. off Linux).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _resident_load(dataset: str, streamed: bool) -> Optional[int]:
+    """ Loads the <dataset>, reading each file row by row as it is loaded if
+        <streamed>, or all of them first with import_data if not, and
+        returns the resident memory of this process afterwards.
+    """
+    seg_file, trip_file = DATASETS[dataset]
+    paths = [os.path.join(DATA_DIR, name)
+             for name in ("airports.csv", seg_file, "customers.csv",
+                          trip_file)]
+    if streamed:
+        logs = [stream_rows(path) for path in paths]
+    else:
+        logs = list(application.import_data(paths[0], paths[2], paths[1],
+                                            paths[3]))
+    application.create_airports(logs[0])
+    segments = application.create_flight_segments(logs[1])
+    customers = application.create_customers(logs[2])
+    application.load_trips(logs[3], customers, segments)
+    del logs
+    gc.collect()
+    return resident_memory()
+
+
+def resident_report(dataset: str) -> Dict[str, Optional[int]]:
+    """ Returns the resident memory, in bytes, of a new process that has
+        loaded the <dataset>: with every file read in first ("read_first"),
+        and streamed row by row as application.py does ("streamed"), with
+        that of an idle process ("idle").
+    """
+    report = {}
+    context = multiprocessing.get_context("spawn")
+    for name, task in (("idle", (resident_memory,)),
+                       ("read_first", (_resident_load, dataset, False)),
+                       ("streamed", (_resident_load, dataset, True))):
+        # Each is measured in a new process, so none sees another's memory.
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            report[name] = pool.submit(*task).result()
+    return report
+
+
+def run_suite(datasets: List[str], repeat: int,
+              render: bool = True) -> Dict[str, Dict]:
+    """ Runs every benchmark on each of the <datasets>, <repeat> times, and
+        returns their results, indexed by benchmark name. The rendering
+        benchmark (which needs pygame) is only run if <render> is True.
+    """
+    results = {}
+    suites = []
+    for dataset in datasets:
+        suites.append((dataset, load_benchmarks(dataset)))
+        suites.append((dataset, filter_benchmarks(dataset)))
+        suites.append((dataset, timeline_benchmarks(dataset)))
+        if render:
+            suites.append((dataset, render_benchmarks(dataset)))
+    suites.append(("-", booking_benchmarks()))
+    for dataset, benchmarks in suites:
+        for name, setup, run in benchmarks:
+            key = name if dataset == "-" else "{} [{}]".format(name, dataset)
+            results[key] = measure(setup, run, repeat)
+            print_result(key, results[key])
+    return results
+
+
+def print_result(name: str, result: Dict[str, float]) -> None:
+    """ Prints one line with the <result> of the benchmark <name>. """
+
+    print("{:<48} median {:>9.2f}ms  p95 {:>9.2f}ms  peak {:>9.1f}KiB".format(
+        name, result["median"] * 1000, result["p95"] * 1000,
+        result["peak_alloc"] / 1024))
+
+
+def regressions(results: Dict[str, Dict], baseline: Dict[str, Dict],
+                threshold: float) -> List[str]:
+    """ Returns a description of every benchmark in <results> whose median
+        time is more than <threshold> (a fraction) above its <baseline>.
+
+    >>> regressions({"a": {"median": 1.2}, "b": {"median": 1.0}},
+    ...             {"a": {"median": 1.0}, "b": {"median": 1.0}}, 0.1)
+    ['a: 1000.00ms -> 1200.00ms (+20%)']
+    """
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["median"], result["median"]
+        if after > before * (1 + threshold):
+            found.append("{}: {:.2f}ms -> {:.2f}ms (+{:.0f}%)".format(
+                name, before * 1000, after * 1000,
+                (after / before - 1) * 100))
+    return found
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ Runs the benchmark suite with the command line arguments <argv>, and
+        returns the exit status: 1 if any benchmark regressed, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dataset", choices=sorted(DATASETS),
+                        action="append",
+                        help="dataset to benchmark (default: both)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE_FILE,
+                        help="JSON file of the baseline results")
+    parser.add_argument("--save", action="store_true",
+                        help="save these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="allowed slowdown, as a fraction of the baseline")
+    parser.add_argument("--no-render", action="store_true",
+                        help="skip the rendering benchmark")
+    parser.add_argument("--memory", action="store_true",
+                        help="only report the memory held by each dataset "
+                             "once loaded")
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        for dataset in args.dataset or ["full"]:
+            report = memory_report(dataset)
+            print("model heap [{}]: {:.1f}MiB for {} airports, {} customers, "
+                  "{} flight segments, {} trips and {} symbols".format(
+                      dataset, report["heap"] / 2 ** 20,
+                      report["airports"], report["customers"],
+                      report["segments"], report["trips"],
+                      report["symbols"]))
+            for name in ("Airport", "Customer", "FlightSegment", "Trip"):
+                print("  {:<16} {:>5} bytes per object".format(
+                    name, report[name]))
+            resident = resident_report(dataset)
+            if None not in resident.values():
+                print("resident memory once loaded [{}]: {:.0f}MiB with the "
+                      "files read in first, {:.0f}MiB streamed ({:.0f}MiB "
+                      "idle)".format(dataset, resident["read_first"] / 2 ** 20,
+                                     resident["streamed"] / 2 ** 20,
+                                     resident["idle"] / 2 ** 20))
+        return 0
+
+    results = run_suite(args.dataset or ["small", "full"], args.repeat,
+                        not args.no_render)
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Baseline saved to", args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline at", args.baseline, "- run with --save first.")
+        return 0
+    with open(args.baseline) as f:
+        found = regressions(results, json.load(f), args.threshold)
+    for line in found:
+        print("REGRESSION", line)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""Defines the BookingService, which books seats safely from many threads"""
+from __future__ import annotations
+
+import datetime
+import random
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from customer import Customer
+from fares import FareEngine
+from flight import AIRPLANE_CAPACITY, FlightSegment, Trip
+from journal import BookingJournal
+import instrument
+
+# LOCK_STRIPES: the number of locks shared by all flight segments (and, the
+#               same number again, by all customers) of a BookingService.
+LOCK_STRIPES = 512
+
+
+class BookingService:
+    """ Books and cancels seats and trips on behalf of many threads at once.
+
+    FlightSegment.book_seat and cancel_seat check the seats available and then
+    update them, so two threads booking the last seat of a class could both
+    succeed. Every update made through this service is done while holding
+    the lock of each segment involved, so the seats available on a segment
+    never drop below 0.
+
+    Segments (and customers) share a fixed number of locks, picked by their
+    identity, so bookings on different segments rarely wait for one another.
+    When several locks are needed they are always taken in the same order
+    (segments first, then the customer), so concurrent multi-segment bookings
+    cannot deadlock.
+
+    >>> from application import flight_segment
+    >>> day = datetime.datetime(2019, 1, 1, 9)
+    >>> a1, b2 = [flight_segment(fid, dep, arr, day, day, 3350.0)
+    ...           for fid, dep, arr in (("A1", "YYZ", "YVR"),
+    ...                                 ("B2", "YVR", "SFO"))]
+    >>> service = BookingService()
+    >>> for cid in range(AIRPLANE_CAPACITY["Business"]):
+    ...     _ = service.book_seat(b2, cid, "Business")
+    >>> ann = Customer(100, "Ann", 30, "Canadian")
+    >>> service.book_trip(ann, "R1", [(a1, "Economy"), (b2, "Business")],
+    ...                   day.date()) is None
+    True
+    >>> a1.seat_availability == AIRPLANE_CAPACITY, a1.get_manifest()
+    (True, [])
+
+    Threads contending for the last seat book exactly one trip:
+
+    >>> for cid in range(AIRPLANE_CAPACITY["Economy"] - 1):
+    ...     _ = service.book_seat(a1, cid, "Economy")
+    >>> start = threading.Barrier(8)
+    >>> trips = []
+    >>> def book(cid):
+    ...     start.wait()
+    ...     trips.append(service.book_trip(
+    ...         Customer(cid, "Bob", 40, "Canadian"), "R" + str(cid),
+    ...         [(a1, "Economy")], day.date()))
+    >>> threads = [threading.Thread(target=book, args=(cid,))
+    ...            for cid in range(200, 208)]
+    >>> for thread in threads:
+    ...     thread.start()
+    >>> for thread in threads:
+    ...     thread.join()
+    >>> sum(trip is not None for trip in trips), a1.seat_availability
+    (1, {'Economy': 0, 'Business': 22})
+
+    === Public Attributes ===
+    journal:
+        the journal every successful booking and cancellation is logged to,
+        while its locks are still held, or None.
+    fares:
+        the FareEngine every trip booked is priced with, or None to price
+        trips as Customer.book_trip does.
+    """
+    # === Private Attributes ===
+    # _segment_locks:
+    #     the locks guarding the seats and manifests of flight segments.
+    # _customer_locks:
+    #     the locks guarding the trips, costs and miles of customers.
+
+    journal: Optional[BookingJournal]
+    fares: Optional[FareEngine]
+    _segment_locks: List[threading.Lock]
+    _customer_locks: List[threading.Lock]
+
+    def __init__(self, stripes: int = LOCK_STRIPES,
+                 journal: Optional[BookingJournal] = None,
+                 fares: Optional[FareEngine] = None) -> None:
+        """ Initialize a BookingService with <stripes> locks for segments,
+            logging to the <journal> and pricing with the <fares> if they
+            are given.
+        """
+
+        self.journal = journal
+        self.fares = fares
+        self._segment_locks = [threading.Lock() for _ in range(stripes)]
+        self._customer_locks = [threading.Lock() for _ in range(stripes)]
+
+    def book_seat(self, segment: FlightSegment, cid: int,
+                  seat_type: str) -> bool:
+        """ Books a seat of the given <seat_type> on <segment> for the
+            customer <cid>, as FlightSegment.book_seat does. Returns True if
+            that customer holds a seat of that type afterwards.
+        """
+        with instrument.span("booking.book_seat"), \
+                self._segment_lock(segment):
+            before = segment.check_seat_class(cid)
+            segment.book_seat(cid, seat_type)
+            booked = segment.check_seat_class(cid) == seat_type
+            if booked and before != seat_type and self.journal is not None:
+                self.journal.log_book_seat(segment, cid, seat_type)
+            return booked
+
+    def cancel_seat(self, segment: FlightSegment, cid: int) -> None:
+        """ Cancels the seat booked on <segment> by the customer <cid>, if any.
+        """
+        with instrument.span("booking.cancel_seat"), \
+                self._segment_lock(segment):
+            if segment.check_seat_class(cid) is not None:
+                segment.cancel_seat(cid)
+                if self.journal is not None:
+                    self.journal.log_cancel_seat(segment, cid)
+
+    def book_trip(self, customer: Customer, reservation_id: str,
+                  segments: List[Tuple[FlightSegment, str]],
+                  trip_date: datetime.date) -> Optional[Trip]:
+        """ Books a seat on every one of the (FlightSegment, seat_type) pairs
+            in <segments> for <customer>, then books their Trip and returns
+            it.
+
+            The booking is all-or-nothing: if any of the seats is not
+            available, nothing is booked and None is returned.
+        """
+        cid = customer.get_id()
+        locks = self._segment_locks_for([seg for seg, _ in segments])
+        with instrument.span("booking.book_trip"):
+            for lock in locks:
+                lock.acquire()
+            try:
+                for seg, seat_type in segments:
+                    if (seg.check_seat_class(cid) != seat_type
+                            and seg.seat_availability[seat_type] <= 0):
+                        return None
+                for seg, seat_type in segments:
+                    seg.book_seat(cid, seat_type)
+                with self._customer_lock(cid):
+                    if self.fares is None:
+                        trip = customer.book_trip(reservation_id, segments,
+                                                  trip_date)
+                    else:
+                        trip = self.fares.book_trip(customer, reservation_id,
+                                                    segments, trip_date)
+                    if self.journal is not None:
+                        self.journal.log_book_trip(trip, segments)
+                    return trip
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+
+    def cancel_trip(self, customer: Customer, trip: Trip,
+                    segments: List[Tuple[FlightSegment, str]]) -> None:
+        """ Cancels the <trip> booked by <customer> on the (FlightSegment,
+            seat_type) pairs in <segments>, releasing all of its seats.
+
+            Precondition: the <trip> must be a valid Trip that this customer
+                          has booked.
+        """
+        locks = self._segment_locks_for([seg for seg, _ in segments])
+        with instrument.span("booking.cancel_trip"):
+            for lock in locks:
+                lock.acquire()
+            try:
+                with self._customer_lock(customer.get_id()):
+                    customer.cancel_trip(trip, segments)
+                    if self.journal is not None:
+                        self.journal.log_cancel_trip(trip, segments)
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+
+    def _segment_lock(self, segment: FlightSegment) -> threading.Lock:
+        """ Returns the lock guarding <segment>. """
+
+        return self._segment_locks[hash(segment) % len(self._segment_locks)]
+
+    def _customer_lock(self, cid: int) -> threading.Lock:
+        """ Returns the lock guarding the customer <cid>. """
+
+        return self._customer_locks[cid % len(self._customer_locks)]
+
+    def _segment_locks_for(self, segments: Sequence[FlightSegment]) \
+            -> List[threading.Lock]:
+        """ Returns the distinct locks guarding <segments>, in the order they
+            must be acquired.
+        """
+        stripes = sorted({hash(seg) % len(self._segment_locks)
+                          for seg in segments})
+        return [self._segment_locks[i] for i in stripes]
+
+
+def check_inventory(segments: Sequence[FlightSegment]) -> bool:
+    """ Returns True if, on every one of <segments>, no class has a negative
+        number of seats available, and the seats available plus the seats
+        on the manifest add up to the capacity of each class.
+    """
+    for seg in segments:
+        for seat_type, capacity in seg.seat_capacity.items():
+            available = seg.seat_availability[seat_type]
+            booked = sum(1 for _, seat in seg.get_manifest()
+                         if seat == seat_type)
+            if available < 0 or available + booked != capacity:
+                return False
+    return True
+
+
+def _sample_segments(count: int) -> List[FlightSegment]:
+    """ Returns <count> new, empty flight segments for stress testing. """
+
+    dep = datetime.datetime(2019, 1, 1, 9, 0)
+    arr = datetime.datetime(2019, 1, 1, 17, 0)
+    return [FlightSegment("ST-{:03d}".format(i), dep, arr, 0.1225, 1000.0,
+                          "YYZ", "CDG", ((0.0, 0.0), (0.0, 0.0)))
+            for i in range(count)]
+
+
+def stress_test(threads: int = 32, segment_count: int = 4,
+                trips_per_thread: int = 200, seed: int = 0) -> bool:
+    """ Books and cancels multi-segment trips on a few flight segments from
+        <threads> threads at once, until the segments are oversubscribed.
+        Returns True if no seat was booked twice or lost.
+    """
+    service = BookingService()
+    segments = _sample_segments(segment_count)
+    customers = {}
+    start = threading.Barrier(threads)
+
+    def worker(n: int) -> None:
+        """ Books (and cancels some) trips as the <n>-th thread. """
+        rng = random.Random(seed * 1000 + n)
+        start.wait()
+        for i in range(trips_per_thread):
+            cid = n * trips_per_thread + i
+            customer = Customer(cid, "Stress Tester", 30, "Canadian")
+            customers[cid] = customer
+            legs = [(seg, rng.choice(list(AIRPLANE_CAPACITY)))
+                    for seg in rng.sample(segments, rng.randint(1, 3))]
+            trip = service.book_trip(customer, str(cid), legs,
+                                     datetime.date(2019, 1, 1))
+            if trip is not None and rng.random() < 0.3:
+                service.cancel_trip(customer, trip, legs)
+
+    pool = [threading.Thread(target=worker, args=(n,))
+            for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+    held = {}
+    for customer in customers.values():
+        for trip in customer.get_trips():
+            for seg in trip.get_flight_segments():
+                held[seg] = held.get(seg, 0) + 1
+    return check_inventory(segments) and all(
+        held.get(seg, 0) == len(seg.get_manifest()) for seg in segments)
+
+
+def throughput(threads: int, operations: int = 20000,
+               segment_count: int = 1000) -> float:
+    """ Returns the number of seat bookings and cancellations per second
+        made by <threads> threads sharing one BookingService, over
+        <segment_count> flight segments.
+    """
+    service = BookingService()
+    segments = _sample_segments(segment_count)
+    per_thread = operations // threads
+    start = threading.Barrier(threads + 1)
+
+    def worker(n: int) -> None:
+        """ Books and cancels seats as the <n>-th thread. """
+        rng = random.Random(n)
+        start.wait()
+        for i in range(per_thread // 2):
+            seg = segments[rng.randrange(segment_count)]
+            cid = n * per_thread + i
+            service.book_seat(seg, cid, "Economy")
+            service.cancel_seat(seg, cid)
+
+    pool = [threading.Thread(target=worker, args=(n,))
+            for n in range(threads)]
+    for t in pool:
+        t.start()
+    start.wait()
+    began = time.perf_counter()
+    for t in pool:
+        t.join()
+    return per_thread * threads / (time.perf_counter() - began)
+
+
+if __name__ == '__main__':
+    print("Stress test (32 threads):",
+          "passed" if stress_test() else "FAILED")
+    for num_threads in (1, 2, 4, 8, 16, 32):
+        print("{:>2} threads: {:>10.0f} ops/s".format(
+            num_threads, throughput(num_threads)))
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'datetime', 'random',
+            'threading', 'time', 'customer', 'fares', 'flight', 'journal',
+            'instrument', '__future__'
+        ],
+        'max-locals': 20
+    })
@@ -1,8 +1,10 @@
 """Defines Customer class"""
 from __future__ import annotations
 
-from datetime import datetime
-from typing import List, Tuple, Dict, Optional
+import datetime
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from typing import Iterator, List, Tuple, Dict, Optional, Union
 
 from flight import Trip, FlightSegment
 
@@ -32,6 +34,303 @@ FREQUENT_FLYER_MULTIPLIER = {"Economy": 1, "Business": 5}
 CLASS_MULTIPLIER = {"Economy": 1.0, "Business": 2.5}
 
 
+def status_for_miles(miles: int) -> Optional[str]:
+    """ Returns the highest frequent flyer status reached with <miles>
+        status miles, or None if no status has been reached yet.
+
+    >>> status_for_miles(35000)
+    'Elite-Light'
+    >>> status_for_miles(100) is None
+    True
+    """
+    reached = None
+    for status, (threshold, _) in FREQUENT_FLYER_STATUS.items():
+        if miles >= threshold and (
+                reached is None
+                or threshold > FREQUENT_FLYER_STATUS[reached][0]):
+            reached = status
+    return reached
+
+
+def discount_for_miles(miles: int) -> int:
+    """ Returns the percent discount (e.g. -10) given by the status reached
+        with <miles> status miles, or 0 if no status has been reached.
+
+    >>> discount_for_miles(16000)
+    -10
+    """
+    status = status_for_miles(miles)
+    return 0 if status is None else FREQUENT_FLYER_STATUS[status][1]
+
+
+def trip_fare(segments: List[Tuple[FlightSegment, str]],
+              discount: float) -> float:
+    """ Returns the cost of flying the (FlightSegment, seat_type) pairs in
+        <segments>, with the percent <discount> (e.g. -10) applied.
+
+        Each segment costs its length, times its base fare cost, times the
+        CLASS_MULTIPLIER of the seat type taken.
+    """
+    total = sum(seg.get_length() * seg.get_base_fare_cost()
+                * CLASS_MULTIPLIER[seat_type] for seg, seat_type in segments)
+    return total * (100 + discount) / 100
+
+
+def segment_miles(segment: FlightSegment, seat_type: str) -> int:
+    """ Returns the status miles earned by flying <segment> in <seat_type>:
+        its length times the FREQUENT_FLYER_MULTIPLIER of that seat type.
+    """
+    return round(segment.get_length() * FREQUENT_FLYER_MULTIPLIER[seat_type])
+
+
+class MilesLedger:
+    """ The ordered record of the status miles earned (or lost) by a
+        customer over time.
+
+        Each entry keeps the running total of miles, and the highest total
+        reached so far, so the miles and status at any point in time are
+        found by a binary search rather than replaying the entries.
+
+    >>> ledger = MilesLedger()
+    >>> ledger.record(datetime.date(2019, 1, 1), 20000)
+    20000
+    >>> ledger.record(datetime.date(2019, 2, 1), -5000)
+    15000
+    >>> ledger.miles_at(datetime.date(2019, 1, 15))
+    20000
+    >>> ledger.peak_at(datetime.date(2019, 3, 1))
+    20000
+    """
+    # === Private Attributes ===
+    # _dates:
+    #     the date of each entry, in non-decreasing order.
+    # _totals:
+    #     the running total of miles after each entry.
+    # _peaks:
+    #     the highest running total reached up to and including each entry.
+
+    _dates: List[datetime.date]
+    _totals: List[int]
+    _peaks: List[int]
+
+    def __init__(self) -> None:
+        """ Initialize an empty MilesLedger. """
+
+        self._dates = []
+        self._totals = []
+        self._peaks = []
+
+    def __len__(self) -> int:
+        """ Returns the number of entries in this ledger. """
+
+        return len(self._dates)
+
+    def record(self, when: datetime.date, miles: int) -> int:
+        """ Records <miles> earned (or lost, if negative) on <when>, and
+            returns the new total.
+
+            Entries are kept in date order: an entry dated before the latest
+            one is recorded on the latest entry's date instead.
+        """
+        total = self.total() + miles
+        if self._dates and when < self._dates[-1]:
+            when = self._dates[-1]
+        self._dates.append(when)
+        self._totals.append(total)
+        self._peaks.append(max(total, self.peak()))
+        return total
+
+    def extend(self, entries: List[Tuple[datetime.date, int]]) -> int:
+        """ Records each of the (date, miles) <entries> in order, as record
+            does, and returns the new total.
+
+        >>> ledger = MilesLedger()
+        >>> ledger.extend([(datetime.date(2019, 1, 2), 500),
+        ...                (datetime.date(2019, 1, 1), -200)])
+        300
+        >>> ledger.entries()[-1]
+        (datetime.date(2019, 1, 2), -200)
+        """
+        total, peak = self.total(), self.peak()
+        last = self._dates[-1] if self._dates else None
+        for when, miles in entries:
+            total += miles
+            peak = max(peak, total)
+            if last is not None and when < last:
+                when = last
+            last = when
+            self._dates.append(when)
+            self._totals.append(total)
+            self._peaks.append(peak)
+        return total
+
+    def total(self) -> int:
+        """ Returns the current total of miles. """
+
+        return self._totals[-1] if self._totals else 0
+
+    def peak(self) -> int:
+        """ Returns the highest total of miles ever reached. """
+
+        return self._peaks[-1] if self._peaks else 0
+
+    def miles_at(self, when: datetime.date) -> int:
+        """ Returns the total of miles at the end of the day <when>. """
+
+        i = bisect_right(self._dates, when)
+        return self._totals[i - 1] if i else 0
+
+    def peak_at(self, when: datetime.date) -> int:
+        """ Returns the highest total of miles reached by the end of the day
+            <when>.
+        """
+
+        i = bisect_right(self._dates, when)
+        return self._peaks[i - 1] if i else 0
+
+    def entries(self) -> List[Tuple[datetime.date, int]]:
+        """ Returns the (date, miles) of every entry, in order, so that
+            recording them into an empty ledger rebuilds this one, peaks
+            included.
+
+        >>> ledger = MilesLedger()
+        >>> ledger.record(datetime.date(2019, 1, 1), 500)
+        500
+        >>> ledger.record(datetime.date(2019, 1, 2), -200)
+        300
+        >>> [miles for _, miles in ledger.entries()]
+        [500, -200]
+        """
+        return [(when, total - before) for when, total, before in
+                zip(self._dates, self._totals, [0] + self._totals[:-1])]
+
+
+class TripBook(Sequence):
+    """ The trips booked by a customer, with their costs.
+
+    The trips are kept in order of departure date (trips leaving on the same
+    day in the order they were booked), so a TripBook is itself a read-only
+    sequence of them, and the trips of any period are found by a binary
+    search. They are also indexed by reservation ID, so a reservation is
+    found without looking at the rest.
+
+    >>> from datetime import date
+    >>> book = TripBook()
+    >>> for rid, day in [("A", 5), ("B", 1), ("C", 20), ("D", 5)]:
+    ...     book.add(Trip(rid, 1, date(2019, 3, day), []), 100.0)
+    >>> [t.reservation_id for t in book], book.latest().reservation_id
+    (['B', 'A', 'D', 'C'], 'C')
+    >>> [t.reservation_id for t in book.between(date(2019, 3, 2),
+    ...                                         date(2019, 3, 5))]
+    ['A', 'D']
+    >>> book.remove(book.find("A")), book.find("A") is None, len(book)
+    (100.0, True, 3)
+    """
+    # === Private Attributes ===
+    # _costs:
+    #     the cost of every trip, in the order they were booked.
+    # _dates:
+    #     the departure date of each trip of _ordered.
+    # _ordered:
+    #     every trip, in order of departure date, then of booking.
+    # _reservations:
+    #     the first booked trip holding each reservation ID.
+
+    __slots__ = ("_costs", "_dates", "_ordered", "_reservations")
+
+    _costs: Dict[Trip, float]
+    _dates: List[datetime.date]
+    _ordered: List[Trip]
+    _reservations: Dict[str, Trip]
+
+    def __init__(self) -> None:
+        """ Initialize an empty TripBook. """
+
+        self._costs = {}
+        self._dates = []
+        self._ordered = []
+        self._reservations = {}
+
+    def __len__(self) -> int:
+        return len(self._ordered)
+
+    def __getitem__(self, index: Union[int, slice]) \
+            -> Union[Trip, List[Trip]]:
+        return self._ordered[index]
+
+    def __iter__(self) -> Iterator[Trip]:
+        return iter(self._ordered)
+
+    def __contains__(self, trip: object) -> bool:
+        return trip in self._costs
+
+    def add(self, trip: Trip, cost: float) -> None:
+        """ Adds the booked <trip>, costing <cost>. """
+
+        self._costs[trip] = cost
+        i = bisect_right(self._dates, trip.trip_departure)
+        self._dates.insert(i, trip.trip_departure)
+        self._ordered.insert(i, trip)
+        self._reservations.setdefault(trip.reservation_id, trip)
+
+    def remove(self, trip: Trip) -> Optional[float]:
+        """ Removes the <trip> and returns its cost, or returns None if it is
+            not in this book.
+        """
+        if trip not in self._costs:
+            return None
+        i = bisect_left(self._dates, trip.trip_departure)
+        while self._ordered[i] is not trip:
+            i += 1
+        del self._dates[i]
+        del self._ordered[i]
+        cost = self._costs.pop(trip)
+        if self._reservations[trip.reservation_id] is trip:
+            # Another trip may hold the same reservation ID.
+            del self._reservations[trip.reservation_id]
+            for other in self._costs:
+                if other.reservation_id == trip.reservation_id:
+                    self._reservations[other.reservation_id] = other
+                    break
+        return cost
+
+    def cost(self, trip: Trip) -> Optional[float]:
+        """ Returns the cost of the <trip>, or None if it is not in this
+            book.
+        """
+        return self._costs.get(trip)
+
+    def set_cost(self, trip: Trip, cost: float) -> None:
+        """ Sets the cost of the <trip>, which is in this book, to <cost>. """
+
+        self._costs[trip] = cost
+
+    def booked(self) -> List[Trip]:
+        """ Returns the trips, in the order they were booked. """
+
+        return list(self._costs)
+
+    def find(self, reservation_id: str) -> Optional[Trip]:
+        """ Returns the trip holding <reservation_id>, or None if there is
+            none. If several do, the first booked is returned.
+        """
+        return self._reservations.get(reservation_id)
+
+    def between(self, start: datetime.date,
+                end: datetime.date) -> List[Trip]:
+        """ Returns the trips departing from <start> to <end>, inclusive, in
+            order of departure date.
+        """
+        return self._ordered[bisect_left(self._dates, start):
+                             bisect_right(self._dates, end)]
+
+    def latest(self) -> Optional[Trip]:
+        """ Returns the trip departing last, or None if there are none. If
+            several depart on that day, the last booked is returned.
+        """
+        return self._ordered[-1] if self._ordered else None
+
+
 class Customer:
     """ A Customer of Python Air.
 
@@ -60,18 +359,27 @@ class Customer:
     # _miles:
     #     this is the running tally of the customer's
     #     total qualifying miles for their status.
+    # _ledger:
+    #     this is the dated record of every change to the
+    #     customer's miles.
     # _trips:
-    #     this stores the dictionary of Trips and their
-    #     corresponding costs.
+    #     this stores the Trips and their corresponding
+    #     costs, in order of departure date.
+
+    # __weakref__ lets a SQLiteStore cache customers weakly.
+    __slots__ = ("name", "age", "nationality", "all_flight_costs",
+                 "_customer_id", "_trips", "_ff_status", "_miles", "_ledger",
+                 "__weakref__")
 
     name: str
     age: int
     nationality: str
     all_flight_costs: float
     _customer_id: int
-    _trips: Dict[Trip, float]
+    _trips: TripBook
     _ff_status: str
     _miles: int
+    _ledger: MilesLedger
 
     def __init__(self, cus_id: int, name: str, age: int, nat: str) -> None:
         """ A Customer of Python Air. """
@@ -80,9 +388,10 @@ class Customer:
         self.name = name
         self.nationality = nat
         self._customer_id = cus_id
-        self._trips = {}
+        self._trips = TripBook()
         self._ff_status = "Prestige"
         self._miles = 0
+        self._ledger = MilesLedger()
         self.all_flight_costs = 0
 
     def get_id(self) -> int:
@@ -91,7 +400,31 @@ class Customer:
 
     def get_trips(self) -> List[Trip]:
         """ Returns a list of Trips booked for this customer. """
-        return list(self._trips.keys())
+        return self._trips.booked()
+
+    def get_timeline(self) -> TripBook:
+        """ Returns this customer's Trips, in order of departure date, as a
+            read-only sequence. It is not a copy: it changes as trips are
+            booked and cancelled.
+        """
+        return self._trips
+
+    def get_trip(self, reservation_id: str) -> Optional[Trip]:
+        """ Returns this customer's Trip with <reservation_id>, otherwise
+            None.
+        """
+        return self._trips.find(reservation_id)
+
+    def get_trips_between(self, start: datetime.date,
+                          end: datetime.date) -> List[Trip]:
+        """ Returns this customer's Trips departing from <start> to <end>,
+            inclusive, in order of departure date.
+        """
+        return self._trips.between(start, end)
+
+    def get_latest_trip(self) -> Optional[Trip]:
+        """ Returns this customer's Trip departing last, otherwise None. """
+        return self._trips.latest()
 
     def get_total_flight_costs(self) -> float:
         """ Returns this customer's total flight costs. """
@@ -99,10 +432,7 @@ class Customer:
 
     def get_cost_of_trip(self, trip_lookup: Trip) -> Optional[float]:
         """ Returns the cost of that Trip, otherwise None. """
-        if self._trips.get(trip_lookup) is None:
-            return None
-        else:
-            return self._trips[trip_lookup]
+        return self._trips.cost(trip_lookup)
 
     def get_ff_status(self) -> str:
         """ Returns this customer's frequent flyer status. """
@@ -112,14 +442,74 @@ class Customer:
         """ Returns this customer's qualifying miles. """
         return self._miles
 
+    def get_peak_miles(self) -> int:
+        """ Returns the highest qualifying miles this customer has ever had,
+            which their status is earned by.
+        """
+        return self._ledger.peak()
+
+    def get_ff_status_at(self, when: datetime.date) -> str:
+        """ Returns this customer's frequent flyer status at the end of the
+            day <when>.
+        """
+        status = status_for_miles(self._ledger.peak_at(when))
+        return "Prestige" if status is None else status
+
+    def get_miles_at(self, when: datetime.date) -> int:
+        """ Returns this customer's qualifying miles at the end of the day
+            <when>.
+        """
+        return self._ledger.miles_at(when)
+
+    def get_miles_history(self) -> List[Tuple[datetime.date, int]]:
+        """ Returns every (date, miles) change to this customer's qualifying
+            miles, in order.
+        """
+        return self._ledger.entries()
+
+    def get_discount(self) -> int:
+        """ Returns the percent discount (e.g. -10) this customer's frequent
+            flyer status gives on their next trip, or 0 if the status miles of
+            their status have not been reached yet.
+        """
+        return discount_for_miles(self._ledger.peak())
+
+    def record_miles(self, when: datetime.date, miles: int) -> None:
+        """ Adds <miles> (which may be negative) earned on <when> to this
+            customer's qualifying miles, and updates their status.
+
+            A status, once reached, is never lost.
+        """
+        self._miles = self._ledger.record(when, miles)
+        status = status_for_miles(self._ledger.peak())
+        if status is not None:
+            self._ff_status = status
+
+    def record_all_miles(self,
+                         entries: List[Tuple[datetime.date, int]]) -> None:
+        """ Adds each of the (date, miles) <entries>, in order, to this
+            customer's qualifying miles, as record_miles does.
+        """
+        self._miles = self._ledger.extend(entries)
+        status = status_for_miles(self._ledger.peak())
+        if status is not None:
+            self._ff_status = status
+
     def book_trip(self, reservation_id: str,
                   segments: List[Tuple[FlightSegment, str]],
-                  trip_date: datetime.date) -> Trip:
+                  trip_date: datetime.date, deferred: bool = False) -> Trip:
         """ Books the customer's trip and returns a Trip.
 
             <segments> are a List of Tuples, containing a (FlightSegment,
             seat_type) pair.
 
+            The trip is priced with the discount of this customer's current
+            status, and the miles of each segment are then added to their
+            qualifying miles. If <deferred> is True, the trip is stored with
+            a cost of 0.0 and no miles instead, to be settled later through
+            set_cost_of_trip and record_miles (e.g. by a FareEngine pricing
+            many trips at once).
+
             Precondition: the customer is guaranteed to have a seat on each of
                           the <segments>.
         """
@@ -127,10 +517,24 @@ class Customer:
         for i in segments:
             d.append(i[0])
         trip = Trip(reservation_id, self._customer_id, trip_date, d)
-        cost = self.get_cost_of_trip(trip)
-        self._trips[trip] = cost
+        cost = 0.0 if deferred else trip_fare(segments, self.get_discount())
+        self._trips.add(trip, cost)
+        self.all_flight_costs += cost
+        if not deferred:
+            for seg, seat_type in segments:
+                self.record_miles(trip_date, segment_miles(seg, seat_type))
         return trip
 
+    def set_cost_of_trip(self, trip: Trip, cost: float) -> None:
+        """ Sets the cost of this customer's booked <trip> to <cost>, and
+            updates their total flight costs accordingly.
+
+            Precondition: the <trip> must be a valid Trip that this customer
+                          has booked.
+        """
+        self.all_flight_costs += cost - self._trips.cost(trip)
+        self._trips.set_cost(trip, cost)
+
     def cancel_trip(self, canceled_trip: Trip,
                     segments: List[Tuple[FlightSegment, str]]) -> None:
         """ Cancels this customer's Trip.
@@ -143,8 +547,12 @@ class Customer:
         """
         for i in segments:
             i[0].cancel_seat(self._customer_id)
-        if canceled_trip in self._trips:
-            del self._trips[canceled_trip]
+        cost = self._trips.remove(canceled_trip)
+        if cost is not None:
+            self.all_flight_costs -= cost
+            for seg, seat_type in segments:
+                self.record_miles(canceled_trip.trip_departure,
+                                  -segment_miles(seg, seat_type))
 
 
 if __name__ == '__main__':
@@ -157,7 +565,9 @@ if __name__ == '__main__':
             'doctest',
             'flight',
             '__future__',
-            'datetime'
+            'datetime',
+            'bisect',
+            'collections.abc'
         ],
-        'max-attributes': 8,
+        'max-attributes': 9,
     })
@@ -0,0 +1,530 @@
+"""Lazy, on-demand loading of the trips of a dataset, by customer or date"""
+from __future__ import annotations
+
+import csv
+import datetime
+import threading
+from collections.abc import Sequence
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Set, \
+    Tuple
+
+from customer import Customer, TripBook
+from fares import FareEngine
+from flight import FlightSegment, Trip
+from symbols import SYMBOLS
+
+
+def parse_itinerary(fields: List[str]) -> List[Tuple[str, str]]:
+    """ Returns the (IATA, seat_type) pairs of the itinerary stored in the
+    <fields> of a trip record, in order. The last pair is the trip's final
+    destination, with an empty seat_type.
+
+    The itinerary is split across several fields by the CSV reader, since it
+    contains commas, so all of its <fields> are joined back together first.
+    The IATA codes and seat types returned are interned in SYMBOLS.
+
+    >>> parse_itinerary(["[('SVO'", "'Economy')", "('FCO'", "'')]"])
+    [('SVO', 'Economy'), ('FCO', '')]
+    """
+    cleaned = ",".join(fields).strip("[]")
+    stops = []
+    for entry in cleaned.split("),("):
+        parts = entry.strip("()").replace("'", "").replace('"', '').split(",")
+        if len(parts) < 2:
+            continue
+        stops.append((SYMBOLS.intern(parts[0].strip()),
+                      SYMBOLS.intern(parts[1].strip())))
+    return stops
+
+
+def resolve_itinerary(stops: List[Tuple[str, str]],
+                      day_segments: List[FlightSegment]) \
+        -> List[Tuple[FlightSegment, str]]:
+    """ Returns the (FlightSegment, seat_type) pairs flown for the itinerary
+    <stops>, as returned by parse_itinerary, choosing among the
+    <day_segments> departing on the trip's date.
+    """
+    segments = []
+    for dep_air, seat_type in stops:
+        if not seat_type:
+            continue
+        for seg in day_segments:
+            if seg.get_dep() == dep_air:
+                segments.append((seg, seat_type))
+                break
+    return segments
+
+
+def book_itinerary(cid: int, segments: List[Tuple[FlightSegment, str]]) \
+        -> bool:
+    """ Books a seat on every one of the (FlightSegment, seat_type) pairs in
+    <segments> for the customer <cid>, and returns True. If any of them has
+    no seat of that type left, none are booked (seats the customer held
+    before are kept as they were) and False is returned.
+
+    >>> import datetime
+    >>> from flight import FlightSegment
+    >>> def seg():
+    ...     t = datetime.datetime(2019, 1, 1, 9)
+    ...     return FlightSegment("F", t, t, 0.1, 1.0, "YYZ", "YVR",
+    ...                          ((0.0, 0.0), (0.0, 0.0)))
+    >>> a, b = seg(), seg()
+    >>> b.seat_availability["Business"] = 0
+    >>> book_itinerary(1, [(a, "Economy"), (b, "Business")])
+    False
+    >>> a.get_manifest(), b.get_manifest()
+    ([], [])
+    >>> book_itinerary(1, [(a, "Economy"), (b, "Economy")])
+    True
+    """
+    held = [seg.check_seat_class(cid) for seg, _ in segments]
+    for seg, seat_type in segments:
+        seg.book_seat(cid, seat_type)
+    if all(seg.check_seat_class(cid) == seat_type
+           for seg, seat_type in segments):
+        return True
+    for (seg, _), before in zip(segments, held):
+        if before is None:
+            seg.cancel_seat(cid)
+        elif seg.check_seat_class(cid) != before:
+            seg.book_seat(cid, before)
+    return False
+
+
+class TripIndex:
+    """ A byte-offset index of a trips file, by customer, date and
+    reservation ID, from which Trips are built only when first needed.
+
+    Building the index reads the file once, but only splits off the first
+    three fields of each record; no Trip is created and no seat is booked.
+
+    A trip is loaded in two steps. Its seats are booked the first time its
+    flight segments are asked for: a query by date only books the records
+    dated in its range. It is priced, as a Trip of its customer, the first
+    time the customer's trips are asked for, and then every trip of that
+    customer is built together, in file order, since the discount of each
+    trip depends on the miles of that customer's earlier trips. Both steps
+    are cached.
+
+    Since seats are booked as trips are loaded, a segment that sells out
+    may be filled in a different order than by application.load_trips.
+
+    === Public Attributes ===
+    path:
+        the trips file indexed.
+    """
+    # === Private Attributes ===
+    # _customers:
+    #     every customer, indexed by their customer ID.
+    # _flight_segments:
+    #     every flight segment, indexed by its departure date.
+    # _fares:
+    #     the FareEngine pricing the trips as they are built.
+    # _offsets:
+    #     the byte offset of every trip record of each customer, in file
+    #     order, indexed by customer ID.
+    # _by_date:
+    #     the byte offset of every trip record on each date, in file order.
+    # _by_reservation:
+    #     the customer ID of each reservation ID, from its first record.
+    # _booked:
+    #     the (reservation ID, date, [(FlightSegment, seat_type), ...]) of
+    #     every trip record whose seats have been booked, or None if they
+    #     could not be, indexed by the byte offset of the record.
+    # _trips:
+    #     every trip built so far, indexed by the byte offset of its record.
+    # _loaded:
+    #     the IDs of the customers whose trips have been built.
+    # _building:
+    #     the IDs of the customers whose trips are being built.
+    # _lock:
+    #     guards the booking and building of trips, which filters may ask
+    #     for from several threads.
+
+    path: str
+    _customers: Dict[int, Customer]
+    _flight_segments: Dict[datetime.date, List[FlightSegment]]
+    _fares: FareEngine
+    _offsets: Dict[int, List[int]]
+    _by_date: Dict[datetime.date, List[int]]
+    _by_reservation: Dict[str, int]
+    _booked: Dict[int, Optional[Tuple[str, datetime.date,
+                                      List[Tuple[FlightSegment, str]]]]]
+    _trips: Dict[int, Trip]
+    _loaded: Set[int]
+    _building: Set[int]
+    _lock: threading.RLock
+
+    def __init__(self, path: str, customers: Dict[int, Customer],
+                 flight_segments: Dict[datetime.date, List[FlightSegment]],
+                 fare_engine: Optional[FareEngine] = None) -> None:
+        """ Initialize a TripIndex of the trips file at <path>, whose trips
+            are booked by the <customers> on the <flight_segments>, and priced
+            by the <fare_engine> (a new one if none is given).
+        """
+
+        self.path = path
+        self._customers = customers
+        self._flight_segments = flight_segments
+        self._fares = FareEngine() if fare_engine is None else fare_engine
+        self._offsets = {}
+        self._by_date = {}
+        self._by_reservation = {}
+        self._booked = {}
+        self._trips = {}
+        self._loaded = set()
+        self._building = set()
+        self._lock = threading.RLock()
+
+        dates = {}
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                fields = line.split(b",", 3)
+                if len(fields) == 4:
+                    cid = int(fields[1])
+                    if fields[2] not in dates:
+                        dates[fields[2]] = datetime.date(
+                            *map(int, fields[2].split(b"-")))
+                    when = dates[fields[2]]
+                    if cid not in self._offsets:
+                        self._offsets[cid] = []
+                    self._offsets[cid].append(offset)
+                    if when not in self._by_date:
+                        self._by_date[when] = []
+                    self._by_date[when].append(offset)
+                    self._by_reservation.setdefault(fields[0].decode(), cid)
+                offset += len(line)
+
+    def __len__(self) -> int:
+        """ Returns the number of trip records indexed. """
+
+        return sum(len(offsets) for offsets in self._offsets.values())
+
+    def count_loaded(self) -> int:
+        """ Returns the number of trips built so far. """
+
+        return len(self._trips)
+
+    def customer_of(self, reservation_id: str) -> Optional[int]:
+        """ Returns the ID of the customer who booked the trip <reservation_id>,
+            or None if there is no such trip, without building any trip.
+        """
+        return self._by_reservation.get(reservation_id)
+
+    def _book(self, f: IO[bytes], offset: int) -> None:
+        """ Books the seats of the trip record at <offset> in the trips file
+            <f>, open in binary mode as the offsets are byte offsets, unless
+            that has been done already. The lock must be held.
+        """
+        if offset in self._booked:
+            return
+        f.seek(offset)
+        row = next(csv.reader([f.readline().decode()]))
+        trip_date = SYMBOLS.intern(datetime.date(*map(int, row[2].split("-"))))
+        segments = resolve_itinerary(parse_itinerary(row[3:]),
+                                     self._flight_segments.get(trip_date, []))
+        if segments and book_itinerary(int(row[1]), segments):
+            self._booked[offset] = (row[0], trip_date, segments)
+        else:
+            self._booked[offset] = None
+
+    def load_customer(self, cid: int) -> None:
+        """ Builds, books and prices every trip of the customer <cid>, unless
+            that has been done already.
+        """
+        if cid in self._loaded or cid not in self._offsets:
+            return
+        with self._lock:
+            if cid in self._loaded or cid in self._building:
+                return
+            # Pricing reads the customer, which asks for their trips again.
+            self._building.add(cid)
+            try:
+                customer = self._customers[cid]
+                with open(self.path, "rb") as f:
+                    for offset in self._offsets[cid]:
+                        self._book(f, offset)
+                        booked = self._booked[offset]
+                        if booked is not None:
+                            reservation_id, trip_date, segments = booked
+                            trip = customer.book_trip(reservation_id, segments,
+                                                      trip_date, deferred=True)
+                            self._fares.add_trip(customer, trip, segments)
+                            self._trips[offset] = trip
+                self._fares.price()
+            finally:
+                self._building.discard(cid)
+            self._loaded.add(cid)
+
+    def trips_of(self, cid: int) -> List[Trip]:
+        """ Returns the trips of the customer <cid>, in file order. """
+
+        self.load_customer(cid)
+        return [self._trips[offset] for offset in self._offsets.get(cid, [])
+                if offset in self._trips]
+
+    def segments_between(self, start: datetime.date,
+                         end: datetime.date) -> List[FlightSegment]:
+        """ Returns the flight segments of the trips departing from <start> to
+            <end>, inclusive, in file order. Only the seats of those trips are
+            booked; no customer is loaded, and no trip is priced.
+        """
+        offsets = sorted(offset for when, on_date in self._by_date.items()
+                         if start <= when <= end for offset in on_date)
+        with self._lock:
+            with open(self.path, "rb") as f:
+                for offset in offsets:
+                    self._book(f, offset)
+            return [seg for offset in offsets
+                    if self._booked[offset] is not None
+                    for seg, _ in self._booked[offset][2]]
+
+    def trip(self, reservation_id: str) -> Optional[Trip]:
+        """ Returns the trip <reservation_id>, or None if there is no such
+            trip (or it could not be booked).
+        """
+        cid = self._by_reservation.get(reservation_id)
+        if cid is None:
+            return None
+        self.load_customer(cid)
+        return Customer.get_trip(self._customers[cid], reservation_id)
+
+    def loaded_segments(self) -> List[FlightSegment]:
+        """ Returns the flight segments of every trip booked so far, in file
+            order.
+        """
+        with self._lock:
+            return [seg for offset in sorted(self._booked)
+                    if self._booked[offset] is not None
+                    for seg, _ in self._booked[offset][2]]
+
+    def all_trips(self) -> List[Trip]:
+        """ Returns every trip, in file order, loading every customer. """
+
+        for cid in self._offsets:
+            self.load_customer(cid)
+        return [self._trips[offset] for offset in sorted(self._trips)]
+
+
+class LazyCustomer(Customer):
+    """ A Customer whose trips are built by a TripIndex the first time any
+    accessor needs them.
+
+    The all_flight_costs attribute is only up to date once the trips have
+    been loaded, e.g. through get_total_flight_costs.
+
+    === Public Attributes ===
+    index:
+        the TripIndex holding this customer's trips, or None if they are all
+        booked directly.
+    """
+
+    __slots__ = ("index",)
+
+    index: Optional[TripIndex]
+
+    def __init__(self, cus_id: int, name: str, age: int, nat: str,
+                 index: Optional[TripIndex] = None) -> None:
+        """ A Customer of Python Air, whose trips are in <index>. """
+
+        Customer.__init__(self, cus_id, name, age, nat)
+        self.index = index
+
+    def _load(self) -> None:
+        """ Builds this customer's trips, if not done already. """
+
+        if self.index is not None:
+            self.index.load_customer(self.get_id())
+
+    def holds_reservation(self, reservation_id: str) -> bool:
+        """ Returns True if this customer booked the trip <reservation_id>,
+            without building their trips if they have not been built yet.
+        """
+        if self.index is None:
+            return self.get_trip(reservation_id) is not None
+        return self.index.customer_of(reservation_id) == self.get_id()
+
+    def get_trips(self) -> List[Trip]:
+        """ Returns a list of Trips booked for this customer. """
+        self._load()
+        return Customer.get_trips(self)
+
+    def get_timeline(self) -> TripBook:
+        """ Returns this customer's Trips, in order of departure date. """
+        self._load()
+        return Customer.get_timeline(self)
+
+    def get_trip(self, reservation_id: str) -> Optional[Trip]:
+        """ Returns this customer's Trip with <reservation_id>, otherwise
+            None, only building their trips if they hold it.
+        """
+        if self.index is not None and \
+                self.index.customer_of(reservation_id) != self.get_id():
+            return None
+        self._load()
+        return Customer.get_trip(self, reservation_id)
+
+    def get_trips_between(self, start: datetime.date,
+                          end: datetime.date) -> List[Trip]:
+        """ Returns this customer's Trips departing from <start> to <end>,
+            inclusive, in order of departure date.
+        """
+        self._load()
+        return Customer.get_trips_between(self, start, end)
+
+    def get_latest_trip(self) -> Optional[Trip]:
+        """ Returns this customer's Trip departing last, otherwise None. """
+        self._load()
+        return Customer.get_latest_trip(self)
+
+    def get_total_flight_costs(self) -> float:
+        """ Returns this customer's total flight costs. """
+        self._load()
+        return Customer.get_total_flight_costs(self)
+
+    def get_cost_of_trip(self, trip_lookup: Trip) -> Optional[float]:
+        """ Returns the cost of that Trip, otherwise None. """
+        self._load()
+        return Customer.get_cost_of_trip(self, trip_lookup)
+
+    def get_ff_status(self) -> str:
+        """ Returns this customer's frequent flyer status. """
+        self._load()
+        return Customer.get_ff_status(self)
+
+    def get_miles(self) -> int:
+        """ Returns this customer's qualifying miles. """
+        self._load()
+        return Customer.get_miles(self)
+
+    def get_ff_status_at(self, when: datetime.date) -> str:
+        """ Returns this customer's frequent flyer status at the end of the
+            day <when>.
+        """
+        self._load()
+        return Customer.get_ff_status_at(self, when)
+
+    def get_miles_at(self, when: datetime.date) -> int:
+        """ Returns this customer's qualifying miles at the end of the day
+            <when>.
+        """
+        self._load()
+        return Customer.get_miles_at(self, when)
+
+    def get_miles_history(self) -> List[Tuple[datetime.date, int]]:
+        """ Returns every (date, miles) change to this customer's qualifying
+            miles, in order.
+        """
+        self._load()
+        return Customer.get_miles_history(self)
+
+    def get_discount(self) -> int:
+        """ Returns the percent discount this customer's frequent flyer status
+            gives on their next trip.
+        """
+        self._load()
+        return Customer.get_discount(self)
+
+
+class LazySegments(Sequence):
+    """ The flight segments of every trip in a TripIndex, in file order.
+
+    Iterating over, indexing or measuring this sequence loads every trip.
+    The filters that select by customer, date or reservation ID use
+    for_customer, between and for_reservation instead, which only load the
+    trips they need.
+    """
+    # === Private Attributes ===
+    # _index:
+    #     the TripIndex of the trips.
+    # _all:
+    #     the flight segments of every trip, once they have all been loaded.
+
+    _index: TripIndex
+    _all: Optional[List[FlightSegment]]
+
+    def __init__(self, index: TripIndex) -> None:
+        """ Initialize the flight segments of the trips in <index>. """
+
+        self._index = index
+        self._all = None
+
+    def _segments(self) -> List[FlightSegment]:
+        """ Returns the flight segments of every trip, loading them all. """
+
+        if self._all is None:
+            self._all = [seg for trip in self._index.all_trips()
+                         for seg in trip.get_flight_segments()]
+        return self._all
+
+    def __getitem__(self, i: int) -> FlightSegment:
+        return self._segments()[i]
+
+    def __len__(self) -> int:
+        return len(self._segments())
+
+    def __iter__(self) -> Iterator[FlightSegment]:
+        return iter(self._segments())
+
+    def loaded(self) -> List[FlightSegment]:
+        """ Returns the flight segments of the trips booked so far. """
+
+        if self._all is not None:
+            return self._all
+        return self._index.loaded_segments()
+
+    def for_customer(self, cid: int) -> List[FlightSegment]:
+        """ Returns the flight segments of the trips of the customer <cid>.
+        """
+        return [seg for trip in self._index.trips_of(cid)
+                for seg in trip.get_flight_segments()]
+
+    def between(self, start: datetime.date,
+                end: datetime.date) -> List[FlightSegment]:
+        """ Returns the flight segments of the trips departing from <start>
+            to <end>, inclusive.
+        """
+        return self._index.segments_between(start, end)
+
+    def for_reservation(self, reservation_id: str) \
+            -> Optional[List[FlightSegment]]:
+        """ Returns the flight segments of the trip <reservation_id>, or None
+            if there is no such trip.
+        """
+        trip = self._index.trip(reservation_id)
+        return None if trip is None else trip.get_flight_segments()
+
+
+def load_lazy(file_trips: str, customer_log: Iterable[List[str]],
+              flight_segments: Dict[datetime.date, List[FlightSegment]]) \
+        -> Tuple[Dict[int, LazyCustomer], TripIndex]:
+    """ Returns the customers of the <customer_log>, indexed by customer ID,
+    and the TripIndex of their trips in the file <file_trips>, booked on the
+    <flight_segments>. No trip is built until it is needed.
+
+    Precondition:
+    - The <customer_log> list contains the input data in the correct format.
+    """
+    customers = {}
+    for row in customer_log:
+        customer = LazyCustomer(int(row[0]), row[1], int(row[2]), row[3])
+        customers[customer.get_id()] = customer
+    index = TripIndex(file_trips, customers, flight_segments)
+    for customer in customers.values():
+        customer.index = index
+    return customers, index
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'csv', 'datetime', 'threading',
+            'collections', 'customer', 'fares', 'flight', 'symbols',
+            '__future__'
+        ],
+        'allowed-io': ['TripIndex.__init__', 'TripIndex.load_customer',
+                       'TripIndex.segments_between']
+    })
@@ -0,0 +1,183 @@
+"""Streams flight segments and trip summaries out as CSV or JSON Lines"""
+import csv
+import json
+import sys
+from typing import Dict, Iterable, Iterator, List, TextIO
+
+from customer import Customer
+from flight import FlightSegment, Trip
+
+# SEGMENT_FIELDS: the fields of every exported flight segment, in order.
+SEGMENT_FIELDS = ["flight_id", "date", "departure_time", "arrival_time",
+                  "departure", "arrival", "length", "manifest"]
+
+# TRIP_FIELDS: the fields of every exported trip summary, in order.
+TRIP_FIELDS = ["reservation_id", "customer_id", "date", "cost",
+               "total_trip_time", "in_flight_time", "layover_time",
+               "itinerary"]
+
+# DURATION_FIELDS: the fields of a trip summary that are durations, in
+#                  minutes, and so never negative.
+DURATION_FIELDS = ("total_trip_time", "in_flight_time", "layover_time")
+
+# FORMATS: the export formats, by name.
+FORMATS = ("csv", "jsonl", "table")
+
+# COLUMN_WIDTH: the narrowest column of a table; the last column is not
+#               padded.
+COLUMN_WIDTH = 10
+
+# BUFFER_SIZE: the size, in bytes, of the output buffer of an export file.
+BUFFER_SIZE = 1 << 20
+
+
+def segment_rows(segments: Iterable[FlightSegment]) -> Iterator[Dict]:
+    """ Yields a row (a dictionary keyed by SEGMENT_FIELDS) for each of the
+        <segments>, one at a time. Its manifest is a list of [customer ID,
+        seat type] pairs.
+    """
+    for seg in segments:
+        dep, arr = seg.get_times()
+        yield {"flight_id": seg.get_fid(), "date": dep.date().isoformat(),
+               "departure_time": dep.strftime("%H:%M"),
+               "arrival_time": arr.strftime("%H:%M"),
+               "departure": seg.get_dep(), "arrival": seg.get_arr(),
+               "length": seg.get_length(),
+               "manifest": [list(entry) for entry in seg.get_manifest()]}
+
+
+def trip_row(customer: Customer, trip: Trip) -> Dict:
+    """ Returns the summary row (a dictionary keyed by TRIP_FIELDS) of the
+        <trip> booked by <customer>. Its itinerary is the list of its flight
+        IDs.
+    """
+    row = {"reservation_id": trip.get_reservation_id(),
+           "customer_id": customer.get_id(),
+           "date": trip.trip_departure.isoformat(),
+           "itinerary": [seg.get_fid() for seg in trip.get_flight_segments()],
+           "cost": round(customer.get_cost_of_trip(trip), 2),
+           "total_trip_time": trip.get_total_trip_time(),
+           "in_flight_time": trip.get_in_flight_time(),
+           "layover_time": trip.get_layover_time()}
+    for field in DURATION_FIELDS:
+        if row[field] < 0:
+            raise ValueError("Negative {} in trip {}: {}".format(
+                field, row["reservation_id"], row[field]))
+    return row
+
+
+def trip_rows(customers: Iterable[Customer]) -> Iterator[Dict]:
+    """ Yields the summary row of every trip of the <customers>, one at a
+        time, customer by customer.
+    """
+    for customer in customers:
+        for trip in customer.get_trips():
+            yield trip_row(customer, trip)
+
+
+def _flatten(value: object) -> object:
+    """ Returns the CSV form of a row's <value>: lists are joined with ';',
+        and pairs within them with ':'.
+
+    >>> _flatten([[100001, 'Economy'], [100002, 'Business']])
+    '100001:Economy;100002:Business'
+    >>> _flatten(['PA-001', 'PA-002'])
+    'PA-001;PA-002'
+    """
+    if isinstance(value, list):
+        return ";".join(":".join(map(str, v)) if isinstance(v, list)
+                        else str(v) for v in value)
+    return value
+
+
+def write_csv(rows: Iterable[Dict], fields: List[str], out: TextIO) -> int:
+    """ Writes the <rows>, as CSV with a header of their <fields>, to <out>
+        as they are produced, and returns the number of rows written.
+    """
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow([_flatten(row[field]) for field in fields])
+        count += 1
+    return count
+
+
+def write_jsonl(rows: Iterable[Dict], out: TextIO) -> int:
+    """ Writes the <rows> as JSON Lines to <out>, as they are produced, and
+        returns the number of rows written.
+    """
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row))
+        out.write("\n")
+        count += 1
+    return count
+
+
+def write_table(rows: Iterable[Dict], fields: List[str], out: TextIO) -> int:
+    """ Writes the <rows> as a text table, with a header of their <fields>,
+        to <out> as they are produced, and returns the number of rows
+        written. Lists are flattened as in CSV.
+
+    >>> import io
+    >>> out = io.StringIO()
+    >>> write_table([{"a": 1, "b": ["x", "y"]}], ["a", "b"], out)
+    1
+    >>> print(out.getvalue(), end="")
+    a          b
+    ---------- ----------
+    1          x;y
+    """
+    widths = [max(len(field), COLUMN_WIDTH) for field in fields]
+    out.write(" ".join(field.ljust(w) for field, w in zip(fields, widths))
+              .rstrip() + "\n")
+    out.write(" ".join("-" * w for w in widths) + "\n")
+    count = 0
+    for row in rows:
+        out.write(" ".join(str(_flatten(row[field])).ljust(w)
+                           for field, w in zip(fields, widths)).rstrip())
+        out.write("\n")
+        count += 1
+    return count
+
+
+def _write(rows: Iterable[Dict], fields: List[str], out: TextIO,
+           fmt: str) -> int:
+    """ Writes the <rows> to <out> in the format <fmt>, and returns the
+        number of rows written.
+    """
+    if fmt == "csv":
+        return write_csv(rows, fields, out)
+    if fmt == "table":
+        return write_table(rows, fields, out)
+    return write_jsonl(rows, out)
+
+
+def export(rows: Iterable[Dict], fields: List[str], path: str,
+           fmt: str = "csv") -> int:
+    """ Writes the <rows> (with the given <fields>) to the file at <path>,
+        or to standard output if <path> is "-", in the format <fmt> ("csv",
+        "jsonl" or "table"). Returns the number of rows written.
+
+        Rows are written through a BUFFER_SIZE buffer as they are produced,
+        so only one is held in memory at a time.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown export format: " + fmt)
+    if path == "-":
+        return _write(rows, fields, sys.stdout, fmt)
+    with open(path, "w", buffering=BUFFER_SIZE, newline="") as out:
+        return _write(rows, fields, out, fmt)
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'csv', 'json', 'sys',
+            'customer', 'flight'
+        ],
+        'allowed-io': ['export']
+    })
@@ -0,0 +1,258 @@
+"""Defines the FareEngine, which prices Trips and accrues their miles in bulk"""
+from __future__ import annotations
+
+import datetime
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from customer import CLASS_MULTIPLIER, FREQUENT_FLYER_MULTIPLIER, Customer, \
+    discount_for_miles
+from flight import FlightSegment, Trip
+import instrument
+
+
+class FareEngine:
+    """ Prices the Trips booked by Customers, many at a time.
+
+    Trips are recorded with add_trip, and priced by price in a single pass
+    over columns of their flight segments' lengths, base fares and seat
+    classes. A trip costs the sum, over its segments, of the length times the
+    base fare times the class multiplier, with the discount of the customer's
+    status at booking time applied.
+
+    The same pass settles the status miles of each trip with its customer,
+    in booking order, so the discount of every trip reflects the miles of
+    the trips booked before it. A single trip booked with book_trip is
+    priced the same way, with this engine's tariff.
+
+    >>> from application import flight_segment
+    >>> day = datetime.datetime(2019, 1, 1, 9)
+    >>> seg = flight_segment("A1", "YYZ", "YVR", day, day, 3350.0)
+    >>> seg.get_length(), seg.get_base_fare_cost()
+    (3350.0, 0.1225)
+    >>> ann = Customer(1, "Ann", 30, "Canadian")
+    >>> engine = FareEngine(base_cost=0.1)
+    >>> for rid in ("R1", "R2", "R3"):
+    ...     trip = ann.book_trip(rid, [(seg, "Business")], day.date(),
+    ...                          deferred=True)
+    ...     engine.add_trip(ann, trip, [(seg, "Business")])
+    >>> engine.price()
+    >>> [round(engine.get_cost(i), 2) for i in range(3)]
+    [837.5, 753.75, 711.88]
+    >>> engine.reprice(class_multiplier={"Economy": 1.0, "Business": 2.0})
+    >>> engine.base_cost, [round(engine.get_cost(i), 2) for i in range(3)]
+    (0.1, [670.0, 603.0, 569.5])
+    >>> trip = engine.book_trip(ann, "R4", [(seg, "Economy")], day.date())
+    >>> ann.get_cost_of_trip(trip), ann.get_miles()
+    (268.0, 53600)
+
+    === Public Attributes ===
+    base_cost:
+        the rate per km used for every segment, or None to use each flight
+        segment's own base fare cost.
+    class_multiplier:
+        the cost multiplier of each type of seat.
+    """
+    # === Private Attributes ===
+    # _lengths:
+    #     the length of every segment booked, one row per booked segment.
+    # _bases:
+    #     the base fare cost of every segment booked.
+    # _classes:
+    #     the code in _class_names of the seat type of every segment booked.
+    # _class_names:
+    #     the seat types seen so far; their position is their code.
+    # _ends:
+    #     the row in the segment columns after each trip's last segment.
+    # _dates:
+    #     the date of each trip.
+    # _discounts:
+    #     the percent discount (e.g. -10) in effect when each trip was booked,
+    #     for every trip priced so far.
+    # _trips:
+    #     every trip recorded, together with the customer who booked it.
+    # _costs:
+    #     the cost of every trip priced so far.
+    # _lock:
+    #     held while trips are priced, so trips booked by many threads
+    #     through book_trip are recorded and settled one at a time.
+    #
+    # === Representation Invariants ===
+    #     - len(_lengths) == len(_bases) == len(_classes)
+    #     - len(_ends) == len(_dates) == len(_trips)
+    #     - len(_trips) >= len(_discounts) == len(_costs)
+
+    base_cost: Optional[float]
+    class_multiplier: Dict[str, float]
+    _lengths: array
+    _bases: array
+    _classes: array
+    _class_names: List[str]
+    _ends: array
+    _dates: List[datetime.date]
+    _discounts: array
+    _trips: List[Tuple[Customer, Trip]]
+    _costs: array
+    _lock: threading.Lock
+
+    def __init__(self, base_cost: Optional[float] = None,
+                 class_multiplier: Optional[Dict[str, float]] = None) -> None:
+        """ Initialize an empty FareEngine with the given tariff. The
+            CLASS_MULTIPLIER is used if no <class_multiplier> is given.
+        """
+
+        self.base_cost = base_cost
+        self.class_multiplier = (CLASS_MULTIPLIER.copy()
+                                 if class_multiplier is None
+                                 else class_multiplier)
+        self._lengths = array('d')
+        self._bases = array('d')
+        self._classes = array('B')
+        self._class_names = []
+        self._ends = array('q')
+        self._dates = []
+        self._discounts = array('d')
+        self._trips = []
+        self._costs = array('d')
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """ Returns the number of trips recorded in this FareEngine. """
+
+        return len(self._trips)
+
+    def add_trip(self, customer: Customer, trip: Trip,
+                 segments: List[Tuple[FlightSegment, str]]) -> None:
+        """ Records the <trip> booked by <customer> on the (FlightSegment,
+            seat_type) pairs in <segments>, to be priced by the next call to
+            price.
+
+            Precondition: the <trip> was booked by <customer> with
+                          deferred=True, so its cost and miles are unsettled.
+        """
+        for seg, seat_type in segments:
+            if seat_type not in self._class_names:
+                self._class_names.append(seat_type)
+            self._lengths.append(seg.get_length())
+            self._bases.append(seg.get_base_fare_cost())
+            self._classes.append(self._class_names.index(seat_type))
+        self._ends.append(len(self._lengths))
+        self._dates.append(trip.trip_departure)
+        self._trips.append((customer, trip))
+
+    def get_cost(self, index: int) -> float:
+        """ Returns the cost of the <index>-th trip recorded.
+
+            Precondition: that trip has been priced.
+        """
+
+        return self._costs[index]
+
+    def book_trip(self, customer: Customer, reservation_id: str,
+                  segments: List[Tuple[FlightSegment, str]],
+                  trip_date: datetime.date) -> Trip:
+        """ Books the trip of <customer> on the (FlightSegment, seat_type)
+            pairs in <segments>, as Customer.book_trip does, but priced with
+            this engine's tariff, and returns it.
+
+            Precondition: the customer is guaranteed to have a seat on each of
+                          the <segments>.
+        """
+        trip = customer.book_trip(reservation_id, segments, trip_date,
+                                  deferred=True)
+        with instrument.span("fares.book_trip"), self._lock:
+            self.add_trip(customer, trip, segments)
+            self._settle()
+        return trip
+
+    def price(self) -> None:
+        """ Prices every trip recorded since the last call, and settles its
+            cost and status miles with the customer who booked it.
+        """
+        with instrument.span("fares.price"), self._lock:
+            self._settle()
+
+    def _settle(self) -> None:
+        """ Settles the cost and status miles of the trips recorded since
+            the last call to price.
+        """
+        first = len(self._costs)
+        offset = self._ends[first - 1] if first > 0 else 0
+        mult = [FREQUENT_FLYER_MULTIPLIER[name] for name in self._class_names]
+        miles = [round(length * mult[cls]) for length, cls
+                 in zip(self._lengths[offset:], self._classes[offset:])]
+
+        # Grouped pass: the miles of each customer are kept as a running
+        # total (and peak) here, so each trip's discount comes from its
+        # customer's miles before it, and each ledger is written once.
+        peaks = {}
+        totals = {}
+        entries = {}
+        start = 0
+        for i in range(first, len(self._trips)):
+            end = self._ends[i] - offset
+            customer = self._trips[i][0]
+            if customer not in entries:
+                entries[customer] = []
+                totals[customer] = customer.get_miles()
+                peaks[customer] = customer.get_peak_miles()
+            self._discounts.append(discount_for_miles(peaks[customer]))
+            trip_miles = sum(miles[start:end])
+            entries[customer].append((self._dates[i], trip_miles))
+            totals[customer] += trip_miles
+            peaks[customer] = max(peaks[customer], totals[customer])
+            start = end
+        for customer, history in entries.items():
+            customer.record_all_miles(history)
+        self._price_from(first)
+
+    def reprice(self, base_cost: Optional[float] = None,
+                class_multiplier: Optional[Dict[str, float]] = None) -> None:
+        """ Changes the tariff to the given <base_cost> and
+            <class_multiplier>, then prices all the trips recorded again.
+            Either is left unchanged if it is None.
+        """
+        with instrument.span("fares.reprice"), self._lock:
+            if base_cost is not None:
+                self.base_cost = base_cost
+            if class_multiplier is not None:
+                self.class_multiplier = class_multiplier
+            self._price_from(0)
+
+    def _price_from(self, first: int) -> None:
+        """ Prices the trips recorded from the <first>-th onward, in one pass
+            over the segment columns, and sets their costs on their customers.
+        """
+        offset = self._ends[first - 1] if first > 0 else 0
+        mult = [self.class_multiplier[name] for name in self._class_names]
+        if self.base_cost is None:
+            fares = [length * base * mult[cls] for length, base, cls
+                     in zip(self._lengths[offset:], self._bases[offset:],
+                            self._classes[offset:])]
+        else:
+            rate = self.base_cost
+            fares = [length * rate * mult[cls] for length, cls
+                     in zip(self._lengths[offset:], self._classes[offset:])]
+
+        del self._costs[first:]
+        start = 0
+        for i in range(first, len(self._trips)):
+            end = self._ends[i] - offset
+            cost = sum(fares[start:end]) * (100 + self._discounts[i]) / 100
+            start = end
+            self._costs.append(cost)
+            customer, trip = self._trips[i]
+            if customer.get_cost_of_trip(trip) is not None:
+                customer.set_cost_of_trip(trip, cost)
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'array', 'datetime',
+            'threading', 'customer', 'flight', 'instrument', '__future__'
+        ]
+    })
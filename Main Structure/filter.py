@@ -1,5 +1,6 @@
 """Implement Filter classes"""
-from typing import List
+import datetime
+from typing import List, Optional, Tuple
 
 from customer import Customer
 from flight import FlightSegment
@@ -7,10 +8,43 @@ from flight import FlightSegment
 
 # from time import sleep
 
+def parse_date_range(filter_string: str) \
+        -> Optional[Tuple[Tuple[int, int, int], Tuple[int, int, int]]]:
+    """ Returns the ((year, month, day), (year, month, day)) bounds given by
+        a DateFilter <filter_string>, or None if it is invalid.
+
+    >>> parse_date_range("2019-01-01/2019-03-31")
+    ((2019, 1, 1), (2019, 3, 31))
+    >>> parse_date_range("2019-01-01") is None
+    True
+    """
+    if "/" in filter_string:
+        parts = filter_string.split("/")
+    elif "," in filter_string:
+        parts = filter_string.split(",")
+    else:
+        return None
+    if len(parts) != 2:
+        return None
+    try:
+        start = tuple(int(x) for x in parts[0].strip().split("-"))
+        end = tuple(int(x) for x in parts[1].strip().split("-"))
+    except ValueError:
+        return None
+    if len(start) != 3 or len(end) != 3:
+        return None
+    return start, end
+
+
 class Filter:
     """ A class for filtering flight segments based on some criterion.
 
         This is an abstract class. Only subclasses should be instantiated.
+
+        A <data> sequence that loads its segments lazily (a
+        dataset.LazySegments) can give a filter only the segments it needs,
+        through its for_customer, between and for_reservation methods; the
+        filters use those methods whenever <data> has them.
     """
 
     def __init__(self) -> None:
@@ -81,13 +115,19 @@ class CustomerFilter(Filter):
               1. return the original list <data>, and
               2. ensure your code does not crash.
         """
+        try:
+            cid = int(filter_string)
+        except ValueError:
+            return data
+        if all(c.get_id() != cid for c in customers):
+            return data
+        for_customer = getattr(data, "for_customer", None)
+        if for_customer is not None:
+            data = for_customer(cid)
         d = []
-        for c in customers:
-            if not c.get_id() == int(filter_string):
-                return data
-        for cid in data:
-            if cid.check_manifest(int(filter_string)):
-                d.append(cid)
+        for seg in data:
+            if seg.check_manifest(cid):
+                d.append(seg)
         return d
 
     def __str__(self) -> str:
@@ -118,7 +158,8 @@ class DurationFilter(Filter):
               1. return the original list <data>, and
               2. ensure your code does not crash.
         """
-        if filter_string[0] not in ('L', 'G'):
+        if len(filter_string) < 2 or filter_string[0] not in ('L', 'G') \
+                or not filter_string[1:].isdigit():
             return data
         d = []
         mins = int(filter_string[1:])
@@ -203,30 +244,25 @@ class DateFilter(Filter):
               1. return the original list <data>, and
               2. ensure your code does not crash.
         """
-        if "/" in filter_string:
-            parts = filter_string.split("/")
-        elif "," in filter_string:
-            parts = filter_string.split(",")
-        else:
-            return data
-        if len(parts) != 2:
-            return data
-        try:
-            start = [int(x) for x in parts[0].strip().split("-")]
-            end = [int(x) for x in parts[1].strip().split("-")]
-        except ValueError:
-            return data
-        if len(start) != 3 or len(end) != 3:
+        date_range = parse_date_range(filter_string)
+        if date_range is None:
             return data
+        start, end = date_range
+        between = getattr(data, "between", None)
+        if between is not None:
+            try:
+                data = between(datetime.date(*start), datetime.date(*end))
+            except ValueError:
+                pass
         result = []
         for i in data:
             dep, arr = i.get_times()
             dep_date = dep.date()
             arr_date = arr.date()
             start_valid = (dep_date.year, dep_date.month,
-                           dep_date.day) >= tuple(start)
+                           dep_date.day) >= start
             end_valid = (arr_date.year, arr_date.month,
-                         arr_date.day) <= tuple(end)
+                         arr_date.day) <= end
             if start_valid and end_valid:
                 result.append(i)
         return result
@@ -256,14 +292,18 @@ class TripFilter(Filter):
               1. return the original list <data>, and
               2. ensure your code does not crash.
         """
+        for_reservation = getattr(data, "for_reservation", None)
+        if for_reservation is not None:
+            found = for_reservation(filter_string)
+            return data if found is None else found
         result = []
         for cus in customers:
-            for trip in cus.get_trips():
-                if trip.get_reservation_id() == filter_string:
-                    for i in trip.get_flight_segments():
-                        if i in data:
-                            result.append(i)
-                    return result
+            trip = cus.get_trip(filter_string)
+            if trip is not None:
+                for i in trip.get_flight_segments():
+                    if i in data:
+                        result.append(i)
+                return result
         return data
 
     def __str__(self) -> str:
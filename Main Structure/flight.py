@@ -2,9 +2,15 @@
 from __future__ import annotations
 
 import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
 
-# Global Airplane Seat Type capacity
+from symbols import SYMBOLS
+
+if TYPE_CHECKING:
+    from traffic import TrafficStats
+
+# Global Airplane Seat Type capacity, shared by every FlightSegment as its
+# seat_capacity, so it must not be modified.
 AIRPLANE_CAPACITY = {"Economy": 150, "Business": 22}
 
 
@@ -14,7 +20,8 @@ class FlightSegment:
     === Public Attributes ===
     seat_capacity:
         the class of seat and total number of seats available on a specific
-        segment.
+        segment. It is AIRPLANE_CAPACITY, shared by every segment, so it
+        must not be modified.
     seat_availability:
         the class of seat and number of seats still available on a specific
         segment.
@@ -31,7 +38,8 @@ class FlightSegment:
     #     a tuple containing the departure and arrival time of a segment.
     # _manifest:
     #      a list of tuples containing all customers' ID and type of flight
-    #      class that they've taken (e.g. economy).
+    #      class that they've taken (e.g. economy). The seat types are
+    #      interned in SYMBOLS; the tuples, one per customer, are not.
     # _base_fare_cost:
     #     the base cost of the fare (e.g., $0.1225/km).
     # _flight_duration:
@@ -47,12 +55,25 @@ class FlightSegment:
     # _long_lat:
     #     a tuple of tuples, containing the longitude and latitude of the
     #     departure and arrival destinations.
+    # _arc:
+    #     a polyline of (longitude, latitude) points along the great circle
+    #     from the departure to the arrival destination.
+    # _traffic:
+    #     the TrafficStats told of every seat booked or cancelled on this
+    #     segment, if any.
     #
     # === Representation Invariants ===
     #     -  _flight_length >= 0
     #     -  _dep_loc and _arr_loc must be exactly three characters [A-Z]
     #        and are assumed to be valid and distinct IATA airport codes.
 
+    # Tens of thousands of segments are live at once, so they have no
+    # __dict__; __weakref__ lets a SQLiteStore cache them weakly.
+    __slots__ = ("seat_capacity", "seat_availability", "_flight_id", "_time",
+                 "_base_cost", "_flight_duration", "_flight_length",
+                 "_dep_loc", "_arr_loc", "_long_lat", "_arc", "_manifest",
+                 "_traffic", "__weakref__")
+
     seat_capacity: Dict[str, int]  # str: class, int: seats_available
     seat_availability: Dict[str, int]  # str: class, int: seats_available
     _flight_id: str
@@ -63,7 +84,9 @@ class FlightSegment:
     _dep_loc: str
     _arr_loc: str
     _long_lat: Tuple[Tuple[float, float], Tuple[float, float]]
+    _arc: Tuple[Tuple[float, float], ...]
     _manifest: List[Tuple[int, str]]  # (customer_id, seat_type)
+    _traffic: Optional[TrafficStats]
 
     def __init__(
             self,
@@ -74,10 +97,14 @@ class FlightSegment:
             length: float,
             dep_loc: str,
             arr_loc: str,
-            long_lat: Tuple[Tuple[float, float], Tuple[float, float]]
+            long_lat: Tuple[Tuple[float, float], Tuple[float, float]],
+            arc: Optional[Tuple[Tuple[float, float], ...]] = None
     ) -> None:
         """
         Initialize a FlightSegment object based on the parameters specified.
+
+        The <arc> is the curved path drawn for this segment; if it is not
+        given, a straight line between the <long_lat> endpoints is used.
         """
 
         self._flight_id = fid
@@ -85,12 +112,14 @@ class FlightSegment:
         self._dep_loc = dep_loc
         self._base_cost = base_cost
         self._long_lat = long_lat
+        self._arc = long_lat if arc is None else arc
         self._manifest = []
         self._time = (dep, arr)
-        self._flight_duration = arr - dep
+        self._flight_duration = SYMBOLS.intern(arr - dep)
         self.seat_availability = AIRPLANE_CAPACITY.copy()
-        self.seat_capacity = AIRPLANE_CAPACITY.copy()
+        self.seat_capacity = AIRPLANE_CAPACITY
         self._flight_length = length
+        self._traffic = None
 
     def __repr__(self) -> str:
         return ("[" + str(self._flight_id) + "]:" + str(self._dep_loc)
@@ -109,17 +138,17 @@ class FlightSegment:
     def get_arr(self) -> str:
         """ Returns the arrival airport (i.e. the IATA). """
 
-        return str(self._arr_loc)
+        return self._arr_loc
 
     def get_dep(self) -> str:
         """ Returns the departure airport (i.e. the IATA). """
 
-        return str(self._dep_loc)
+        return self._dep_loc
 
     def get_fid(self) -> str:
         """ Returns the flight identifier. """
 
-        return str(self._flight_id)
+        return self._flight_id
 
     def get_long_lat(self) -> Tuple[Tuple[float, float], Tuple[float, float]]:
         """ Returns the longitude and latitude of a FlightSegment,
@@ -128,6 +157,22 @@ class FlightSegment:
 
         return tuple(self._long_lat)
 
+    def get_arc(self) -> Tuple[Tuple[float, float], ...]:
+        """ Returns the (longitude, latitude) points of the great-circle arc
+            flown by this FlightSegment, from departure to arrival.
+        """
+
+        return self._arc
+
+    def set_route(self,
+                  long_lat: Tuple[Tuple[float, float], Tuple[float, float]],
+                  arc: Tuple[Tuple[float, float], ...]) -> None:
+        """ Replaces the <long_lat> endpoints and the <arc> of this
+            FlightSegment, when the location of one of its airports changes.
+        """
+        self._long_lat = long_lat
+        self._arc = arc
+
     def get_duration(self) -> datetime.time:
         """ Returns the duration of the flight. """
 
@@ -138,6 +183,13 @@ class FlightSegment:
 
         return float(self._base_cost)
 
+    def get_manifest(self) -> List[Tuple[int, str]]:
+        """ Returns the (customer_id, seat_type) pairs of every seat booked
+            on this flight segment. The list must not be modified.
+        """
+
+        return self._manifest
+
     def check_manifest(self, cid: int) -> bool:
         """ Returns True if a certain customer <cid> has booked a seat
             on this specific flight, otherwise False.
@@ -170,14 +222,18 @@ class FlightSegment:
         elif curr is not None:
             if self.seat_availability[seat_type] > 0:
                 self._manifest.remove((cid, curr))
-                self._manifest.append((cid, seat_type))
+                self._manifest.append((cid, SYMBOLS.intern(seat_type)))
                 self.seat_availability[curr] += 1
                 self.seat_availability[seat_type] -= 1
+                if self._traffic is not None:
+                    self._traffic.seat_moved(self, curr, seat_type)
             return
         else:
             if self.seat_availability[seat_type] > 0:
-                self._manifest.append((cid, seat_type))
+                self._manifest.append((cid, SYMBOLS.intern(seat_type)))
                 self.seat_availability[seat_type] -= 1
+                if self._traffic is not None:
+                    self._traffic.seat_moved(self, None, seat_type)
 
     def cancel_seat(self, cid: int) -> None:
         """	If a seat has already been booked by <cid>, cancel the booking
@@ -188,14 +244,34 @@ class FlightSegment:
             if i[0] == cid:
                 self._manifest.remove(i)
                 self.seat_availability[i[1]] += 1
+                if self._traffic is not None:
+                    self._traffic.seat_moved(self, i[1], None)
         return None
 
+    def set_traffic(self, traffic: Optional[TrafficStats]) -> None:
+        """ Makes <traffic> the TrafficStats told of every seat booked or
+            cancelled on this segment from now on (or none, if it is None).
+        """
+        self._traffic = traffic
+
 
 # ------------------------------------------------------------------------------
 class Trip:
     """ A Trip is composed of FlightSegment(s) which makes up a customer's
         itinerary.
 
+    >>> from application import flight_segment
+    >>> def seg(dep, arr):
+    ...     return flight_segment("PA-1", "YYZ", "YVR",
+    ...         datetime.datetime(2019, 1, 1, *dep),
+    ...         datetime.datetime(2019, 1, 1, *arr), 3350.0)
+    >>> trip = Trip("R1", 1, datetime.date(2019, 1, 1),
+    ...             [seg((21, 0), (23, 0)), seg((22, 0), (1, 30))])
+    >>> trip.get_in_flight_time(), trip.get_layover_time()
+    (330, 1380)
+    >>> trip.get_total_trip_time()
+    1710
+
     === Public Attributes ===
     reservation_id:
          a unique identifier for this trip.
@@ -207,10 +283,20 @@ class Trip:
     # === Private Attributes ===
     # _flights:
     #      a list of all flight segments for this particular trip
+    # _in_flight_time:
+    #      the minutes spent in flight, computed once from _flights.
+    # _layover_time:
+    #      the minutes spent on the ground between flights, computed once
+    #      from _flights.
+    __slots__ = ("reservation_id", "customer_id", "trip_departure",
+                 "_flights", "_in_flight_time", "_layover_time")
+
     reservation_id: str
     customer_id: int
     trip_departure: datetime.date
     _flights: List[FlightSegment]
+    _in_flight_time: int
+    _layover_time: int
 
     def __init__(self, rid: str, cid: int, trip_date: datetime.date,
                  flight_segments: List[FlightSegment]) -> None:
@@ -221,6 +307,20 @@ class Trip:
         self.trip_departure = trip_date
         self.customer_id = cid
 
+        # The segments' times never change, so neither do these. A leg
+        # departing before the last one landed is that flight on the next
+        # day, as in search.ConnectionSearch.
+        self._in_flight_time = 0
+        self._layover_time = 0
+        landed = None
+        for seg in flight_segments:
+            dep, arr = seg.get_times()
+            self._in_flight_time += int((arr - dep).total_seconds() // 60)
+            if landed is not None:
+                self._layover_time += int(
+                    (dep - landed).total_seconds() // 60) % (24 * 60)
+            landed = arr
+
     def get_flight_segments(self) -> List[FlightSegment]:
         """ Returns a list of all Flight Segments part of this booking. """
 
@@ -235,23 +335,21 @@ class Trip:
         """ Returns the amount of time (in minutes) the trip is spent in
             flight (i.e. the time in the air only).
         """
-        total = 0
-        for seg in self._flights:
-            dep, arr = seg.get_times()
-            total += int((arr - dep).total_seconds() // 60)
-        return total
+        return self._in_flight_time
 
-    @property
     def get_total_trip_time(self) -> int:
         """ Returns the amount of time (in minutes) the trip takes,
             including all transit time (i.e. including waiting for the next
             flight on a layover).
         """
-        if not self._flights:
-            return 0
-        first_dep = self._flights[0].get_times()
-        last_arr = self._flights[-1].get_times()
-        return int((last_arr - first_dep).total_seconds() // 60)
+        return self._in_flight_time + self._layover_time
+
+    def get_layover_time(self) -> int:
+        """ Returns the amount of time (in minutes) the trip spends on the
+            ground between flights: the sum of the gaps between each leg's
+            arrival and the next leg's departure.
+        """
+        return self._layover_time
 
 
 if __name__ == '__main__':
@@ -260,8 +358,8 @@ if __name__ == '__main__':
     python_ta.check_all(config={
         'allowed-import-modules': [
             'python_ta', 'typing', 'doctest',
-            'datetime', '__future__'
+            'datetime', 'symbols', 'traffic', '__future__'
         ],
-        'max-attributes': 11,
-        'max-args': 9
+        'max-attributes': 12,
+        'max-args': 10
     })
@@ -0,0 +1,286 @@
+"""Generates synthetic datasets of any size, for load testing"""
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sys
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from geometry import great_circle_distance
+
+# DATA_DIR: the directory holding the datasets shipped with the application.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "..", "data")
+
+# HUB_SKEW: the exponent of the Zipf weights of airports; the higher it is,
+#           the more routes are flown to and from the largest hubs.
+HUB_SKEW = 1.1
+
+# CLASS_MIX: the share of the seats booked in each seat class.
+CLASS_MIX = (("Economy", 0.85), ("Business", 0.15))
+
+# SEATS: the seats of each class on every flight segment generated.
+SEATS = {"Economy": 150, "Business": 22}
+
+# EXTRA_LEG: the chance that an itinerary goes on for another leg.
+EXTRA_LEG = 0.6
+
+# MAX_LEGS: the most legs an itinerary may have.
+MAX_LEGS = 5
+
+# CRUISE_SPEED, TURNAROUND: a flight lasts TURNAROUND minutes, plus its
+#                           length in km over CRUISE_SPEED km per minute.
+CRUISE_SPEED = 13.5
+TURNAROUND = 30
+
+FIRST_NAMES = ("Patty", "Olive", "Aida", "Teri", "Peg", "Allie", "Liz",
+               "Constance", "Lois", "Minnie", "Lynn", "Ray", "Lee",
+               "Isabelle", "Eileen", "Rita", "Barb", "Hugh", "Jack", "Anna")
+LAST_NAMES = ("O'Furniture", "Yew", "Bugg", "Dactyl", "Legge", "Grater",
+              "Erd", "Noring", "Di Nominator", "Van Ryder", "O'Leeum",
+              "O'Sun", "Sin", "Ringing", "Sideways", "Book", "Dwyer",
+              "Mungus", "Pott", "Gram")
+NATIONALITIES = (("Canadian", 0.41), ("British", 0.10), ("French", 0.09),
+                 ("Italian", 0.09), ("American", 0.08), ("Japanese", 0.08),
+                 ("German", 0.08), ("Russian", 0.07))
+
+# A flight segment generated for one day:
+# (flight ID, departure IATA, arrival IATA, departure minute, arrival minute,
+#  length in km).
+Flight = Tuple[str, str, str, int, int, int]
+
+
+def read_airports(path: str) -> Dict[str, Tuple[float, float]]:
+    """ Returns the (longitude, latitude) of every airport in the airports
+        file at <path>, indexed by IATA.
+    """
+    locations = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split(",")
+            locations[fields[0]] = (float(fields[-2]), float(fields[-1]))
+    return locations
+
+
+def make_routes(locations: Dict[str, Tuple[float, float]], count: int,
+                rng: random.Random) -> List[Tuple[str, str, str, int, int]]:
+    """ Returns <count> routes flown daily between the airports at
+        <locations>, as (flight ID, departure IATA, arrival IATA, usual
+        departure minute, length in km) tuples.
+
+        Airports are weighted by a Zipf distribution over a random ranking,
+        so a few hubs get most of the routes. The same pair of airports may
+        be flown several times a day.
+    """
+    airports = sorted(locations)
+    rng.shuffle(airports)
+    weights = [1 / (rank + 1) ** HUB_SKEW for rank in range(len(airports))]
+    width = max(3, len(str(count)))
+    routes = []
+    for n in range(count):
+        dep, arr = rng.choices(airports, weights, k=2)
+        while arr == dep:
+            arr = rng.choices(airports, weights)[0]
+        length = round(great_circle_distance(locations[dep], locations[arr]))
+        routes.append(("PA-{:0{}d}".format(n + 1, width), dep, arr,
+                       rng.randrange(5 * 60, 23 * 60), max(1, length)))
+    return routes
+
+
+def fly_day(routes: List[Tuple[str, str, str, int, int]],
+            rng: random.Random) -> List[Flight]:
+    """ Returns the flight segments flying the <routes> on one day, with
+        their departure times varied by up to 20 minutes either way.
+    """
+    flights = []
+    for fid, dep, arr, minute, length in routes:
+        dep_min = min(23 * 60 + 59, max(0, minute + rng.randint(-20, 20)))
+        arr_min = dep_min + TURNAROUND + round(length / CRUISE_SPEED)
+        flights.append((fid, dep, arr, dep_min, arr_min, length))
+    return flights
+
+
+def clock(minute: int) -> str:
+    """ Returns the "HH:MM" time of day of the <minute> (from the start of
+        the day of departure), wrapping past midnight.
+
+    >>> clock(9 * 60 + 40)
+    '09:40'
+    >>> clock(25 * 60 + 5)
+    '01:05'
+    """
+    minute %= 24 * 60
+    return "{:02d}:{:02d}".format(minute // 60, minute % 60)
+
+
+def reservation_id(n: int, digits: int) -> str:
+    """ Returns the <n>-th reservation ID, of <digits> base-36 characters.
+        IDs are scrambled, but distinct for all n below 36 ** digits.
+
+    >>> reservation_id(0, 5), reservation_id(1, 5)
+    ('00000', '0063Z')
+    """
+    code = n * 7919 % 36 ** digits
+    chars = []
+    for _ in range(digits):
+        code, d = divmod(code, 36)
+        chars.append("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"[d])
+    return "".join(reversed(chars))
+
+
+def customer_id(n: int, count: int) -> int:
+    """ Returns the ID of the <n>-th of <count> customers: 6 digits, if
+        there are fewer than 900000 customers, and distinct for every n.
+
+    >>> customer_id(0, 10), customer_id(1, 10)
+    (100000, 107919)
+    """
+    space = max(900000, count)
+    if space % 7919 == 0:
+        space += 1
+    return 100000 + n * 7919 % space
+
+
+def write_customers(path: str, count: int, rng: random.Random) -> None:
+    """ Writes <count> customers to the customers file at <path>. """
+
+    names, shares = zip(*NATIONALITIES)
+    with open(path, "w") as f:
+        for n in range(count):
+            f.write("{},{} {},{},{}\n".format(
+                customer_id(n, count), rng.choice(FIRST_NAMES),
+                rng.choice(LAST_NAMES), rng.randint(18, 90),
+                rng.choices(names, shares)[0]))
+
+
+def book_day(flights: List[Flight], trips: int, rng: random.Random,
+             customers: int, first_trip: int, digits: int,
+             day: str) -> List[str]:
+    """ Returns the lines of the trips file for <trips> trips on the day
+        <day> ("YYYY-MM-DD"), booked on its <flights>.
+
+        Each trip starts with a random flight, so the busiest airports see
+        the most trips, and goes on, leg by leg, with a flight departing its
+        last arrival airport after it landed, until it stops, runs out of
+        connections or reaches MAX_LEGS. A seat class that is full on a
+        flight is swapped for the other; a flight full in both classes ends
+        the trip there. Customers book trips with a skew towards a few
+        frequent flyers.
+    """
+    departures, minutes = {}, {}
+    for i in sorted(range(len(flights)), key=lambda k: flights[k][3]):
+        departures.setdefault(flights[i][1], []).append(i)
+        minutes.setdefault(flights[i][1], []).append(flights[i][3])
+    seats = [dict(SEATS) for _ in flights]
+    classes, shares = zip(*CLASS_MIX)
+
+    lines = []
+    for n in range(trips):
+        legs = []
+        current = rng.randrange(len(flights))
+        while current is not None and len(legs) < MAX_LEGS:
+            seat = rng.choices(classes, shares)[0]
+            if seats[current][seat] <= 0:
+                seat = next((c for c in classes if seats[current][c] > 0),
+                            None)
+                if seat is None:
+                    break
+            seats[current][seat] -= 1
+            legs.append((flights[current][1], seat))
+            stop = flights[current][2]
+            first = bisect_left(minutes.get(stop, []), flights[current][4])
+            onward = departures.get(stop, [])
+            current = (onward[rng.randrange(first, len(onward))]
+                       if first < len(onward) and rng.random() < EXTRA_LEG
+                       else None)
+            if current is None:
+                legs.append((stop, ""))
+        if not legs:
+            continue
+        if legs[-1][1]:
+            legs.append((flights[current][1], ""))
+        cid = customer_id(int(customers * rng.random() ** 2), customers)
+        lines.append("{},{},{},[{}]\n".format(
+            reservation_id(first_trip + n, digits), cid, day,
+            ",".join("('{}','{}')".format(*leg) for leg in legs)))
+    return lines
+
+
+def generate(directory: str, segments: int, trips: int, customers: int,
+             days: int = 365, seed: int = 0,
+             start: datetime.date = datetime.date(2019, 1, 1),
+             file_airports: Optional[str] = None) -> Tuple[int, int]:
+    """ Writes a dataset of about <segments> flight segments and <trips>
+        trips, over <days> days from <start>, and <customers> customers, to
+        airports.csv, customers.csv, segments.csv and trips.csv in
+        <directory>. The airports are copied from <file_airports> (by
+        default, those shipped in DATA_DIR). Returns the number of flight
+        segments and trips written.
+
+        The same arguments always give the same files. Only one day's
+        flights are held in memory at a time, so memory use depends on the
+        number of flights a day, but not on the number of days.
+    """
+    file_airports = file_airports or os.path.join(DATA_DIR, "airports.csv")
+    os.makedirs(directory, exist_ok=True)
+    shutil.copyfile(file_airports, os.path.join(directory, "airports.csv"))
+    locations = read_airports(file_airports)
+    routes = make_routes(locations, max(1, segments // days),
+                         random.Random("{}-routes".format(seed)))
+    write_customers(os.path.join(directory, "customers.csv"), customers,
+                    random.Random("{}-customers".format(seed)))
+
+    digits = 5
+    while 36 ** digits < trips:
+        digits += 1
+    written_segments = written_trips = 0
+    with open(os.path.join(directory, "segments.csv"), "w") as seg_file, \
+            open(os.path.join(directory, "trips.csv"), "w") as trip_file:
+        for d in range(days):
+            rng = random.Random("{}-{}".format(seed, d))
+            day = start + datetime.timedelta(days=d)
+            flights = fly_day(routes, rng)
+            stamp = day.strftime("%Y:%m:%d")
+            seg_file.writelines(
+                "{},{},{},{},{},{},{}\n".format(
+                    fid, dep, arr, stamp, clock(dep_min), clock(arr_min),
+                    length)
+                for fid, dep, arr, dep_min, arr_min, length in flights)
+            written_segments += len(flights)
+
+            quota = trips * (d + 1) // days - trips * d // days
+            lines = book_day(flights, quota, rng, customers, written_trips,
+                             digits, day.isoformat())
+            trip_file.writelines(lines)
+            written_trips += len(lines)
+    return written_segments, written_trips
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ Generates a dataset as asked by the command line arguments <argv>.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="directory to write the files to")
+    parser.add_argument("--segments", type=int, default=10000000)
+    parser.add_argument("--trips", type=int, default=5000000)
+    parser.add_argument("--customers", type=int, default=500000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", type=datetime.date.fromisoformat,
+                        default=datetime.date(2019, 1, 1),
+                        help="first day, as YYYY-MM-DD")
+    parser.add_argument("--airports", help="airports file to copy")
+    args = parser.parse_args(argv)
+
+    counts = generate(args.directory, args.segments, args.trips,
+                      args.customers, args.days, args.seed, args.start,
+                      args.airports)
+    print("Wrote {} flight segments and {} trips to {}".format(
+        counts[0], counts[1], args.directory))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Great-circle geometry for the routes flown between airports"""
+import math
+from typing import Dict, Iterable, List, Tuple
+
+# EARTH_RADIUS: mean radius of the Earth, in kilometers.
+EARTH_RADIUS = 6371.0
+
+# ARC_STEPS: number of straight pieces used to draw a route's curved arc.
+ARC_STEPS = 16
+
+
+class Route:
+    """ The precomputed geometry of a route between two airports. Routes are
+        shared by every FlightSegment flying between the same two airports.
+
+    === Public Attributes ===
+    long_lat:
+        the ((LON1, LAT1), (LON2, LAT2)) coordinates of the departure and
+        arrival airports.
+    distance:
+        the great-circle distance, in kilometers, between the two airports.
+    arc:
+        a polyline of (longitude, latitude) points along the great circle,
+        from the departure airport to the arrival airport.
+
+    >>> r = build_routes({"YYZ": (-79.63, 43.68), "CDG": (2.55, 49.01)},
+    ...                  [("YYZ", "CDG")])[("YYZ", "CDG")]
+    >>> round(r.distance)
+    6020
+    >>> r.arc[0] == r.long_lat[0] and len(r.arc) == ARC_STEPS + 1
+    True
+    """
+
+    long_lat: Tuple[Tuple[float, float], Tuple[float, float]]
+    distance: float
+    arc: Tuple[Tuple[float, float], ...]
+
+    def __init__(self, long_lat: Tuple[Tuple[float, float],
+                                       Tuple[float, float]],
+                 distance: float, arc: Tuple[Tuple[float, float], ...]) -> None:
+        """ Initialize a Route with its precomputed geometry. """
+
+        self.long_lat = long_lat
+        self.distance = distance
+        self.arc = arc
+
+    def __repr__(self) -> str:
+        return "Route({}, {:.0f}km)".format(self.long_lat, self.distance)
+
+
+def great_circle_distance(start: Tuple[float, float],
+                          end: Tuple[float, float]) -> float:
+    """ Returns the great-circle distance, in kilometers, between the
+        (longitude, latitude) points <start> and <end>.
+
+    >>> great_circle_distance((0.0, 0.0), (0.0, 0.0))
+    0.0
+    """
+    lon1, lat1 = math.radians(start[0]), math.radians(start[1])
+    lon2, lat2 = math.radians(end[0]), math.radians(end[1])
+    h = (math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2)
+         * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def build_routes(locations: Dict[str, Tuple[float, float]],
+                 pairs: Iterable[Tuple[str, str]]) \
+        -> Dict[Tuple[str, str], Route]:
+    """ Returns a Route for every distinct (departure, arrival) IATA pair in
+        <pairs>, indexed by that pair.
+
+        The geometry of all routes is computed together, column by column,
+        so each route's trigonometry is done exactly once. Pairs with an
+        airport missing from <locations> are placed at (0.0, 0.0).
+    """
+    keys = list(dict.fromkeys(pairs))
+    origin = (0.0, 0.0)
+    starts = [locations.get(k[0], origin) for k in keys]
+    ends = [locations.get(k[1], origin) for k in keys]
+
+    # Unit vectors of both endpoints, one column per coordinate.
+    lat1 = [math.radians(p[1]) for p in starts]
+    lat2 = [math.radians(p[1]) for p in ends]
+    lon1 = [math.radians(p[0]) for p in starts]
+    lon2 = [math.radians(p[0]) for p in ends]
+    x1 = [math.cos(a) * math.cos(o) for a, o in zip(lat1, lon1)]
+    y1 = [math.cos(a) * math.sin(o) for a, o in zip(lat1, lon1)]
+    z1 = [math.sin(a) for a in lat1]
+    x2 = [math.cos(a) * math.cos(o) for a, o in zip(lat2, lon2)]
+    y2 = [math.cos(a) * math.sin(o) for a, o in zip(lat2, lon2)]
+    z2 = [math.sin(a) for a in lat2]
+
+    # Central angles, from the chord length between the unit vectors.
+    angles = [2 * math.asin(min(1.0, math.sqrt((a - b) ** 2 + (c - d) ** 2
+                                               + (e - f) ** 2) / 2))
+              for a, b, c, d, e, f in zip(x1, x2, y1, y2, z1, z2)]
+
+    fractions = [i / ARC_STEPS for i in range(ARC_STEPS + 1)]
+    routes = {}
+    for i, key in enumerate(keys):
+        omega = angles[i]
+        if omega < 1e-9:
+            arc = (starts[i], ends[i])
+        else:
+            arc = _slerp_arc(omega, (x1[i], y1[i], z1[i]),
+                             (x2[i], y2[i], z2[i]), fractions)
+            # Pin the start to the airport's exact coordinates; the end is
+            # left unwrapped when the arc crosses the antimeridian.
+            arc = (starts[i],) + arc[1:]
+        routes[key] = Route((starts[i], ends[i]), EARTH_RADIUS * omega, arc)
+    return routes
+
+
+def _slerp_arc(omega: float, start: Tuple[float, float, float],
+               end: Tuple[float, float, float], fractions: List[float]) \
+        -> Tuple[Tuple[float, float], ...]:
+    """ Returns the (longitude, latitude) points at each of the <fractions>
+        of the way along the great circle from the unit vector <start> to
+        <end>, which are <omega> radians apart.
+
+        Longitudes are unwrapped so consecutive points never jump across the
+        antimeridian.
+    """
+    sin_omega = math.sin(omega)
+    points = []
+    prev_lon = None
+    for t in fractions:
+        a = math.sin((1 - t) * omega) / sin_omega
+        b = math.sin(t * omega) / sin_omega
+        x = a * start[0] + b * end[0]
+        y = a * start[1] + b * end[1]
+        z = a * start[2] + b * end[2]
+        lon = math.degrees(math.atan2(y, x))
+        lat = math.degrees(math.atan2(z, math.hypot(x, y)))
+        if prev_lon is not None:
+            if lon - prev_lon > 180:
+                lon -= 360
+            elif lon - prev_lon < -180:
+                lon += 360
+        prev_lon = lon
+        points.append((lon, lat))
+    return tuple(points)
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'math'
+        ],
+        'max-locals': 25
+    })
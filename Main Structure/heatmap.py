@@ -0,0 +1,150 @@
+"""Rasterizes the arcs of flight segments into a density heatmap"""
+import math
+from array import array
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from flight import FlightSegment
+
+# RAMP: the colour stops of the heatmap, from the least used pixel drawn
+#       (0.0) to the most used (1.0), as (RED, GREEN, BLUE, ALPHA).
+RAMP = ((0.0, (20, 40, 160, 90)),
+        (0.3, (0, 170, 220, 170)),
+        (0.6, (250, 220, 0, 220)),
+        (1.0, (255, 30, 0, 255)))
+
+# LEVELS: the number of colours the ramp is divided into.
+LEVELS = 256
+
+
+def palette(levels: int = LEVELS) -> List[bytes]:
+    """ Returns the RGBA colour of each of the <levels> levels of RAMP.
+
+    >>> colours = palette(3)
+    >>> list(colours[0]), list(colours[-1])
+    ([20, 40, 160, 90], [255, 30, 0, 255])
+    """
+    colours = []
+    for level in range(levels):
+        at = level / max(1, levels - 1)
+        for (start, low), (stop, high) in zip(RAMP, RAMP[1:]):
+            if at <= stop:
+                share = (at - start) / (stop - start)
+                colours.append(bytes(round(a + (b - a) * share)
+                                     for a, b in zip(low, high)))
+                break
+    return colours
+
+
+class Heatmap:
+    """ An accumulation raster: the number of flight segments whose arcs
+    cross each pixel of a screen.
+
+    Segments on the same route share one arc, which is rasterized once and
+    counted by the number of segments flying it, so the cost of building a
+    heatmap grows with the routes drawn, not the segments. The counts are
+    then coloured along RAMP, on a log scale so that quiet routes still
+    show beside the busiest corridors, into one RGBA image.
+
+    >>> h = Heatmap((4, 3))
+    >>> h.add_polyline([(0, 0), (3, 0), (3, 2)], 2)
+    >>> h.add_polyline([(0, 0), (3, 0)], 1)
+    >>> list(h.counts[:4]), list(h.counts[4:8]), h.peak()
+    ([3, 3, 3, 3], [0, 0, 0, 2], 3)
+
+    === Public Attributes ===
+    size:
+        the (width, height) of the raster, in pixels.
+    counts:
+        the number of segments crossing each pixel, row by row.
+    """
+
+    size: Tuple[int, int]
+    counts: array
+
+    def __init__(self, size: Tuple[int, int]) -> None:
+        """ Initialize an empty Heatmap of <size> (width, height). """
+        self.size = size
+        self.counts = array("I", bytes(4 * size[0] * size[1]))
+
+    def add_polyline(self, points: Sequence[Tuple[int, int]],
+                     weight: int = 1) -> None:
+        """ Adds <weight> to every pixel of the polyline through the screen
+            <points>, counting each pixel once per line however many pieces
+            of it pass through. Pixels off the raster are left out.
+        """
+        width, height = self.size
+        counts = self.counts
+        drawn = set()
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            # Pieces wholly off one side of the raster are skipped.
+            if (x0 < 0 and x1 < 0) or (y0 < 0 and y1 < 0) or \
+                    (x0 >= width and x1 >= width) or \
+                    (y0 >= height and y1 >= height):
+                continue
+            dx, dy = x1 - x0, y1 - y0
+            steps = max(abs(dx), abs(dy), 1)
+            for i in range(steps + 1):
+                x = x0 + (2 * dx * i + steps) // (2 * steps)
+                y = y0 + (2 * dy * i + steps) // (2 * steps)
+                if 0 <= x < width and 0 <= y < height:
+                    drawn.add(y * width + x)
+        for pixel in drawn:
+            counts[pixel] += weight
+
+    def accumulate(self, drawables: Iterable[FlightSegment],
+                   project: Callable[[Tuple[Tuple[float, float], ...]],
+                                     Sequence[Tuple[int, int]]]) -> int:
+        """ Adds the arcs of the <drawables>, turned into screen points by
+            <project>, and returns the number of distinct arcs rasterized.
+        """
+        arcs: Dict[int, Tuple[Tuple[Tuple[float, float], ...], int]] = {}
+        for drw in drawables:
+            arc = drw.get_arc()
+            entry = arcs.get(id(arc))
+            arcs[id(arc)] = (arc, 1 if entry is None else entry[1] + 1)
+        for arc, weight in arcs.values():
+            self.add_polyline(project(arc), weight)
+        return len(arcs)
+
+    def peak(self) -> int:
+        """ Returns the highest count of any pixel. """
+
+        return max(self.counts, default=0)
+
+    def to_rgba(self, levels: int = LEVELS) -> bytes:
+        """ Returns the heatmap as RGBA pixels, row by row: pixels no segment
+            crosses are transparent, and the rest are coloured by the log of
+            their count, relative to the peak.
+
+        >>> h = Heatmap((3, 1))
+        >>> h.add_polyline([(1, 0), (2, 0)], 1)
+        >>> h.add_polyline([(2, 0), (2, 0)], 9)
+        >>> list(h.to_rgba(3))
+        [0, 0, 0, 0, 20, 40, 160, 90, 255, 30, 0, 255]
+        """
+        colours = palette(levels)
+        peak = self.peak()
+        pixels = bytearray(4 * len(self.counts))
+        if peak == 0:
+            return bytes(pixels)
+        # Counts 1 to peak map to levels 0 to levels - 1.
+        scale = (levels - 1) / math.log(peak) if peak > 1 else 0
+        colour_of = {}
+        for i, count in enumerate(self.counts):
+            if count:
+                colour = colour_of.get(count)
+                if colour is None:
+                    colour = colours[round(math.log(count) * scale)]
+                    colour_of[count] = colour
+                pixels[4 * i:4 * i + 4] = colour
+        return bytes(pixels)
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'math', 'array', 'flight'
+        ]
+    })
@@ -0,0 +1,196 @@
+"""Merges delta files of new airports, customers, segments and trips into a
+live dataset, without reloading it"""
+from __future__ import annotations
+
+import csv
+import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from airport import Airport
+from application import AIRPORT_LOCATIONS, ROUTES, create_airports, \
+    create_customers, create_flight_segments, load_trips
+from customer import Customer
+from fares import FareEngine
+from flight import FlightSegment, Trip
+from geometry import build_routes
+from search import ConnectionSearch
+from traffic import TrafficStats
+
+
+def read_csv(path: Optional[str]) -> List[List[str]]:
+    """ Returns the rows of the CSV file at <path>, or no rows if <path> is
+        None.
+    """
+    if path is None:
+        return []
+    with open(path, newline="") as f:
+        return list(csv.reader(f))
+
+
+class LiveModel:
+    """ The airports, customers, flight segments and trips of a dataset,
+    which new data is merged into as it arrives.
+
+    Ingesting a delta does work in proportion to its size only. The result is
+    the same as a full rebuild from the base files with each delta appended
+    to them, provided no earlier trip needed the new flight segments (i.e.
+    new segments are for flights not booked yet). The one exception is an
+    airport that arrives, or moves, after segments flying to or from it:
+    the routes through it are rebuilt, and every segment is looked at to
+    give those on them the new geometry.
+
+    === Public Attributes ===
+    airports:
+        every airport, in the order they were first read; an airport read
+        again replaces the one with the same IATA.
+    customers:
+        every customer, indexed by their customer ID.
+    flight_segments:
+        every flight segment, indexed by its departure date.
+    trips:
+        every trip booked, in the order they were read.
+    fares:
+        the FareEngine pricing every trip.
+    traffic:
+        the airport traffic, route passengers and load factors of every
+        flight segment, kept up to date as seats are booked.
+    connections:
+        the itinerary search over every flight segment.
+    """
+    # === Private Attributes ===
+    # _airport_index:
+    #     the position in airports of each airport, indexed by its IATA.
+    # _segments_flown:
+    #     the flight segments of every trip, in order, once asked for.
+
+    airports: List[Airport]
+    customers: Dict[int, Customer]
+    flight_segments: Dict[datetime.date, List[FlightSegment]]
+    trips: List[Trip]
+    fares: FareEngine
+    traffic: TrafficStats
+    connections: ConnectionSearch
+    _airport_index: Dict[str, int]
+    _segments_flown: Optional[List[FlightSegment]]
+
+    def __init__(self) -> None:
+        """ Initialize an empty LiveModel. """
+
+        self.airports = []
+        self.customers = {}
+        self.flight_segments = {}
+        self.trips = []
+        self.fares = FareEngine()
+        self.traffic = TrafficStats()
+        self.connections = ConnectionSearch()
+        self._airport_index = {}
+        self._segments_flown = None
+
+    def ingest(self, airport_log: Iterable[List[str]] = (),
+               customer_log: Iterable[List[str]] = (),
+               segment_log: Iterable[List[str]] = (),
+               trip_log: Iterable[List[str]] = ()) -> List[Trip]:
+        """ Merges the rows of new airports, customers, flight segments and
+            trips in the given logs into this model, in that order, and
+            returns the trips booked.
+
+            A customer whose ID is already known has their details updated
+            in place, keeping their trips and miles. New flight segments
+            join the end of their date's bucket, and new trips are priced
+            after (and with the discounts earned by) all the trips before.
+
+            Precondition:
+            - The logs contain the input data in the correct format.
+        """
+        airport_log = list(airport_log)
+        before = {row[0]: AIRPORT_LOCATIONS.get(row[0]) for row in airport_log}
+        moved = set()
+        for airport in create_airports(airport_log):
+            iata = airport.get_airport_id()
+            if before[iata] != airport.get_location():
+                moved.add(iata)
+            if iata in self._airport_index:
+                self.airports[self._airport_index[iata]] = airport
+            else:
+                self._airport_index[iata] = len(self.airports)
+                self.airports.append(airport)
+        if moved:
+            self._reroute(moved)
+
+        for cid, new in create_customers(list(customer_log)).items():
+            old = self.customers.get(cid)
+            if old is None:
+                self.customers[cid] = new
+            else:
+                old.name, old.age, old.nationality = \
+                    new.name, new.age, new.nationality
+
+        new_segments = create_flight_segments(list(segment_log))
+        for day, segments in new_segments.items():
+            if day not in self.flight_segments:
+                self.flight_segments[day] = []
+            self.flight_segments[day].extend(segments)
+            self.traffic.add_segments(segments)
+        self.connections.add_segments(seg for segments in new_segments.values()
+                                      for seg in segments)
+
+        trips = load_trips(list(trip_log), self.customers,
+                           self.flight_segments, self.fares)
+        self.trips.extend(trips)
+        if self._segments_flown is not None:
+            self._segments_flown.extend(seg for trip in trips
+                                        for seg in trip.get_flight_segments())
+        return trips
+
+    def _reroute(self, moved: Set[str]) -> None:
+        """ Rebuilds the routes in ROUTES to or from the airports whose IATA
+            is in <moved>, and gives the flight segments on them their new
+            geometry.
+        """
+        pairs = [pair for pair in ROUTES
+                 if pair[0] in moved or pair[1] in moved]
+        if not pairs:
+            return
+        ROUTES.update(build_routes(AIRPORT_LOCATIONS, pairs))
+        for segments in self.flight_segments.values():
+            for seg in segments:
+                if seg.get_dep() in moved or seg.get_arr() in moved:
+                    route = ROUTES[(seg.get_dep(), seg.get_arr())]
+                    seg.set_route(route.long_lat, route.arc)
+
+    def ingest_files(self, file_airports: Optional[str] = None,
+                     file_customers: Optional[str] = None,
+                     file_segments: Optional[str] = None,
+                     file_trips: Optional[str] = None) -> List[Trip]:
+        """ Merges the delta CSV files given into this model, as ingest does,
+            and returns the trips booked.
+        """
+        return self.ingest(read_csv(file_airports), read_csv(file_customers),
+                           read_csv(file_segments), read_csv(file_trips))
+
+    def segments_flown(self) -> List[FlightSegment]:
+        """ Returns the flight segments of every trip, in order. The list is
+            kept up to date by later ingests.
+        """
+        if self._segments_flown is None:
+            self._segments_flown = [seg for trip in self.trips
+                                    for seg in trip.get_flight_segments()]
+        return self._segments_flown
+
+    def count_segments(self) -> int:
+        """ Returns the number of flight segments in this model. """
+
+        return sum(len(day) for day in self.flight_segments.values())
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'csv', 'datetime', 'airport',
+            'application', 'customer', 'fares', 'flight', 'geometry',
+            'search', 'traffic', '__future__'
+        ],
+        'allowed-io': ['read_csv']
+    })
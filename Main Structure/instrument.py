@@ -0,0 +1,266 @@
+"""Named timing spans, counters and on-demand profiling of the hot paths"""
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+# ENV_VAR: setting this environment variable to a directory turns the
+#          instrumentation on in the application, and dumps its results
+#          there on exit.
+ENV_VAR = "PYTHON_AIR_TRACE"
+
+# BUCKETS: the number of latency histogram buckets; bucket i counts spans
+#          lasting under 2 ** i microseconds (the last bucket counts the rest).
+BUCKETS = 32
+
+
+class _NoSpan:
+    """ The span handed out while instrumentation is off: it does nothing.
+    """
+
+    def __enter__(self) -> _NoSpan:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        return None
+
+
+_NO_SPAN = _NoSpan()
+
+
+class SpanStats:
+    """ The counters and latency histogram of every span with one name.
+
+    === Public Attributes ===
+    count:
+        the number of spans recorded.
+    total:
+        their total time, in seconds.
+    minimum, maximum:
+        the shortest and longest of them, in seconds.
+    histogram:
+        histogram[i] is the number of spans lasting under 2 ** i microseconds
+        but not under 2 ** (i - 1).
+    """
+
+    count: int
+    total: float
+    minimum: float
+    maximum: float
+    histogram: List[int]
+
+    def __init__(self) -> None:
+        """ Initialize SpanStats with nothing recorded. """
+
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float("inf")
+        self.maximum = 0.0
+        self.histogram = [0] * BUCKETS
+
+    def add(self, elapsed: float) -> None:
+        """ Records a span lasting <elapsed> seconds. """
+
+        self.count += 1
+        self.total += elapsed
+        self.minimum = min(self.minimum, elapsed)
+        self.maximum = max(self.maximum, elapsed)
+        self.histogram[min(BUCKETS - 1,
+                           int(elapsed * 1e6).bit_length())] += 1
+
+    def to_dict(self) -> Dict[str, object]:
+        """ Returns these stats as a JSON-compatible dictionary. """
+
+        return {"count": self.count, "total_s": self.total,
+                "mean_s": self.total / self.count if self.count else 0.0,
+                "min_s": self.minimum if self.count else 0.0,
+                "max_s": self.maximum, "histogram_us_log2": self.histogram}
+
+
+class _Span:
+    """ A span being timed. Spans nest within a thread, which gives the call
+        stacks of the flame graph.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+        self.child_time = 0.0
+        self.profiler = None
+        self.traced = False
+
+    def __enter__(self) -> _Span:
+        stack = _stack()
+        stack.append(self)
+        mode = _ARMED.pop(self.name, None)
+        if mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif mode == "tracemalloc":
+            self.profiler = "tracemalloc"
+            # Tracing started by someone else (e.g. a benchmark) is left on.
+            self.traced = not tracemalloc.is_tracing()
+            if self.traced:
+                tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        elapsed = time.perf_counter() - self.start
+        if isinstance(self.profiler, cProfile.Profile):
+            self.profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out) \
+                .sort_stats("cumulative").print_stats(30)
+            _PROFILES[self.name] = out.getvalue()
+        elif self.profiler == "tracemalloc":
+            top = tracemalloc.take_snapshot().statistics("lineno")[:30]
+            if self.traced:
+                tracemalloc.stop()
+            _PROFILES[self.name] = "\n".join(str(stat) for stat in top)
+
+        stack = _stack()
+        stack.pop()
+        path = ";".join(s.name for s in stack + [self])
+        if stack:
+            stack[-1].child_time += elapsed
+        with _LOCK:
+            if self.name not in _STATS:
+                _STATS[self.name] = SpanStats()
+            _STATS[self.name].add(elapsed)
+            _STACKS[path] = (_STACKS.get(path, 0.0)
+                             + max(0.0, elapsed - self.child_time))
+
+
+_enabled = False
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+_STATS: Dict[str, SpanStats] = {}
+_STACKS: Dict[str, float] = {}
+_ARMED: Dict[str, str] = {}
+_PROFILES: Dict[str, str] = {}
+
+
+def _stack() -> List[_Span]:
+    """ Returns the spans open in the current thread, outermost first. """
+
+    stack = getattr(_LOCAL, "stack", None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+    return stack
+
+
+def span(name: str) -> object:
+    """ Returns a context manager timing the code it wraps as a span called
+        <name>. While instrumentation is off, the same do-nothing object is
+        returned every time, so spans left in hot paths cost almost nothing.
+
+    >>> with span("example"):
+    ...     pass
+    >>> "example" in stats()
+    False
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name)
+
+
+def enable() -> None:
+    """ Turns instrumentation on. """
+
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """ Turns instrumentation off, keeping what has been recorded. """
+
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    """ Returns True if instrumentation is on. """
+
+    return _enabled
+
+
+def reset() -> None:
+    """ Forgets everything recorded so far. """
+
+    with _LOCK:
+        _STATS.clear()
+        _STACKS.clear()
+        _ARMED.clear()
+        _PROFILES.clear()
+
+
+def profile_next(name: str, mode: str = "cprofile") -> None:
+    """ Profiles the next span called <name> with cProfile (<mode>
+        "cprofile") or tracemalloc (<mode> "tracemalloc"). The report is then
+        available from profiles().
+    """
+    if mode not in ("cprofile", "tracemalloc"):
+        raise ValueError("Unknown profiling mode: " + mode)
+    _ARMED[name] = mode
+
+
+def stats() -> Dict[str, Dict[str, object]]:
+    """ Returns the stats of every span name recorded, as dictionaries. """
+
+    with _LOCK:
+        return {name: s.to_dict() for name, s in _STATS.items()}
+
+
+def profiles() -> Dict[str, str]:
+    """ Returns the text report of every span profiled, by span name. """
+
+    return dict(_PROFILES)
+
+
+def dump_json(path: str) -> None:
+    """ Writes the stats and profile reports recorded to <path>, as JSON. """
+
+    with open(path, "w") as f:
+        json.dump({"spans": stats(), "profiles": profiles()}, f, indent=2)
+
+
+def dump_collapsed(path: str) -> None:
+    """ Writes the time spent in each stack of spans to <path>, in the
+        collapsed-stack format read by flame graph tools: one
+        "outer;inner microseconds" line per stack, counting self time only.
+    """
+    with _LOCK:
+        lines = ["{} {}".format(path, round(seconds * 1e6))
+                 for path, seconds in sorted(_STACKS.items())]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def dump(directory: Optional[str] = None) -> None:
+    """ Writes spans.json and spans.folded into <directory>, which defaults
+        to the directory named by the ENV_VAR environment variable.
+    """
+    directory = directory or os.environ.get(ENV_VAR) or "."
+    os.makedirs(directory, exist_ok=True)
+    dump_json(os.path.join(directory, "spans.json"))
+    dump_collapsed(os.path.join(directory, "spans.folded"))
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'cProfile', 'io', 'json',
+            'os', 'pstats', 'threading', 'time', 'tracemalloc', '__future__'
+        ],
+        'allowed-io': ['dump_json', 'dump_collapsed']
+    })
@@ -0,0 +1,451 @@
+"""Defines the BookingJournal, a write-ahead log of bookings and cancellations"""
+from __future__ import annotations
+
+import datetime
+import os
+import struct
+import threading
+import zlib
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from customer import Customer
+from fares import FareEngine
+from flight import FlightSegment, Trip
+
+# The kinds of event recorded in a journal.
+BOOK_SEAT = 1
+CANCEL_SEAT = 2
+BOOK_TRIP = 3
+CANCEL_TRIP = 4
+
+# JOURNAL_FILE, CHECKPOINT_FILE: the names of the files kept in a journal's
+#                                directory.
+JOURNAL_FILE = "bookings.journal"
+CHECKPOINT_FILE = "bookings.checkpoint"
+
+# GROUP_SIZE: the default number of events buffered before they are written
+#             and flushed to disk together.
+GROUP_SIZE = 64
+
+_MAGIC = b"PAC2"
+# A record is (sequence number, kind, payload length), the payload, and the
+# CRC-32 of the payload.
+_HEADER = struct.Struct("<QBI")
+_CRC = struct.Struct("<I")
+_INT = struct.Struct("<I")
+_COST = struct.Struct("<d")
+# A change of miles: (date ordinal, miles).
+_MILES = struct.Struct("<Iq")
+
+SegmentKey = Tuple[str, int]
+
+
+def segment_key(segment: FlightSegment) -> SegmentKey:
+    """ Returns the (flight id, departure date ordinal) pair which uniquely
+        identifies <segment> in the dataset.
+    """
+    return segment.get_fid(), segment.get_times()[0].toordinal()
+
+
+class _Writer:
+    """ Packs the fields of a record into bytes. """
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+
+    def int(self, value: int) -> _Writer:
+        """ Appends the unsigned 32-bit <value>. """
+        self.data += _INT.pack(value)
+        return self
+
+    def str(self, value: str) -> _Writer:
+        """ Appends <value>, prefixed with its length. """
+        raw = value.encode("utf-8")
+        self.data += _INT.pack(len(raw)) + raw
+        return self
+
+    def segment(self, key: SegmentKey) -> _Writer:
+        """ Appends the segment key <key>. """
+        return self.str(key[0]).int(key[1])
+
+
+class _Reader:
+    """ Unpacks the fields of a record, in the order they were written. """
+
+    def __init__(self, data: bytes, pos: int = 0) -> None:
+        self.data = data
+        self.pos = pos
+
+    def int(self) -> int:
+        """ Returns the next unsigned 32-bit integer. """
+        value = _INT.unpack_from(self.data, self.pos)[0]
+        self.pos += _INT.size
+        return value
+
+    def str(self) -> str:
+        """ Returns the next length-prefixed string. """
+        size = self.int()
+        value = self.data[self.pos:self.pos + size].decode("utf-8")
+        self.pos += size
+        return value
+
+    def segment(self) -> SegmentKey:
+        """ Returns the next segment key. """
+        return self.str(), self.int()
+
+
+class BookingJournal:
+    """ An append-only, on-disk journal of the seats and trips booked and
+        cancelled, from which the bookings can be recovered after a restart.
+
+    Events are buffered and written together (group commit) once
+    <group_size> of them are pending, or when commit is called. A checkpoint
+    writes the current bookings to a separate file and empties the journal,
+    so recovery reads the checkpoint and then replays only the events logged
+    after it.
+
+    >>> import tempfile
+    >>> from application import flight_segment
+    >>> from booking import BookingService
+    >>> def dataset():
+    ...     day = datetime.datetime(2019, 1, 1, 9)
+    ...     flights = {day.date(): [
+    ...         flight_segment(fid, dep, arr, day, day, 3350.0)
+    ...         for fid, dep, arr in (("A1", "YYZ", "YVR"),
+    ...                               ("B2", "YVR", "SFO"))]}
+    ...     return flights, {cid: Customer(cid, "Ann", 30, "Canadian")
+    ...                      for cid in (1, 2)}
+    >>> def state(flights, customers):
+    ...     return ([seg.get_manifest() for seg in flights[day]],
+    ...             [(c.get_total_flight_costs(), c.get_miles_history())
+    ...              for c in customers.values()])
+    >>> day = datetime.date(2019, 1, 1)
+    >>> journal = BookingJournal(tempfile.mkdtemp(), group_size=2)
+    >>> flights, customers = dataset()
+    >>> a1, b2 = flights[day]
+    >>> service = BookingService(journal=journal)
+    >>> t1 = service.book_trip(customers[1], "R1",
+    ...                        [(a1, "Economy"), (b2, "Business")], day)
+    >>> t2 = service.book_trip(customers[2], "R2", [(a1, "Business")], day)
+    >>> journal.checkpoint(flights, customers)
+    >>> t3 = service.book_trip(customers[2], "R3", [(b2, "Economy")], day)
+    >>> service.cancel_trip(customers[1], t1, [(a1, "Economy")])
+    >>> journal.close()
+    >>> recovered = BookingJournal(journal.directory)
+    >>> flights2, customers2 = dataset()
+    >>> recovered.recover(flights2, customers2)
+    2
+    >>> recovered.close()
+    >>> state(flights2, customers2) == state(flights, customers)
+    True
+    >>> [c.get_trip("R1") is None for c in customers2.values()]
+    [True, True]
+
+    === Public Attributes ===
+    directory:
+        the directory holding the journal and checkpoint files.
+    group_size:
+        the number of events buffered before they are written to disk.
+    """
+    # === Private Attributes ===
+    # _file:
+    #     the journal file, opened for appending.
+    # _buffer:
+    #     the records logged but not yet written to the journal file.
+    # _pending:
+    #     the number of records in _buffer.
+    # _sequence:
+    #     the sequence number of the last event logged.
+    # _lock:
+    #     guards the buffer, so events may be logged from many threads.
+
+    directory: str
+    group_size: int
+    _file: BinaryIO
+    _buffer: bytearray
+    _pending: int
+    _sequence: int
+    _lock: threading.Lock
+
+    def __init__(self, directory: str, group_size: int = GROUP_SIZE) -> None:
+        """ Initialize a BookingJournal kept in <directory>, creating the
+            directory if needed. Call recover before logging new events into
+            an existing journal.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.group_size = group_size
+        self._buffer = bytearray()
+        self._pending = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._file = open(os.path.join(directory, JOURNAL_FILE), "ab")
+
+    def log_book_seat(self, segment: FlightSegment, cid: int,
+                      seat_type: str) -> None:
+        """ Logs that customer <cid> booked a <seat_type> seat on <segment>.
+        """
+        self._log(BOOK_SEAT, _Writer().segment(segment_key(segment))
+                  .int(cid).str(seat_type).data)
+
+    def log_cancel_seat(self, segment: FlightSegment, cid: int) -> None:
+        """ Logs that customer <cid> cancelled their seat on <segment>. """
+
+        self._log(CANCEL_SEAT,
+                  _Writer().segment(segment_key(segment)).int(cid).data)
+
+    def log_book_trip(self, trip: Trip,
+                      segments: List[Tuple[FlightSegment, str]]) -> None:
+        """ Logs that the <trip> was booked on the (FlightSegment, seat_type)
+            pairs in <segments>, including the seats booked on them.
+        """
+        w = _Writer().str(trip.get_reservation_id()).int(trip.customer_id) \
+            .int(trip.trip_departure.toordinal()).int(len(segments))
+        for seg, seat_type in segments:
+            w.segment(segment_key(seg)).str(seat_type)
+        self._log(BOOK_TRIP, w.data)
+
+    def log_cancel_trip(self, trip: Trip,
+                        segments: List[Tuple[FlightSegment, str]]) -> None:
+        """ Logs that the <trip> was cancelled on the (FlightSegment,
+            seat_type) pairs in <segments>, releasing the seats on them.
+        """
+        w = _Writer().str(trip.get_reservation_id()).int(trip.customer_id) \
+            .int(len(segments))
+        for seg, seat_type in segments:
+            w.segment(segment_key(seg)).str(seat_type)
+        self._log(CANCEL_TRIP, w.data)
+
+    def commit(self) -> None:
+        """ Writes every buffered event to the journal, and waits until they
+            are safely on disk.
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """ Commits the buffered events, and closes the journal. """
+
+        self.commit()
+        self._file.close()
+
+    def checkpoint(self, flights: Dict[datetime.date, List[FlightSegment]],
+                   customers: Dict[int, Customer]) -> None:
+        """ Writes every seat and trip currently booked in <flights> and
+            <customers> to the checkpoint, then empties the journal.
+
+            Precondition: no bookings are being made while this runs.
+        """
+        w = _Writer()
+        manifests = [(seg, seg.get_manifest())
+                     for day in flights.values() for seg in day
+                     if seg.get_manifest()]
+        w.int(len(manifests))
+        for seg, manifest in manifests:
+            w.segment(segment_key(seg)).int(len(manifest))
+            for cid, seat_type in manifest:
+                w.int(cid).str(seat_type)
+
+        trips = [(cus, trip) for cus in customers.values()
+                 for trip in cus.get_trips()]
+        trips.sort(key=lambda pair: pair[1].trip_departure)
+        w.int(len(trips))
+        for cus, trip in trips:
+            segments = trip.get_flight_segments()
+            w.str(trip.get_reservation_id()).int(cus.get_id()) \
+                .int(trip.trip_departure.toordinal()).int(len(segments))
+            for seg in segments:
+                w.segment(segment_key(seg)) \
+                    .str(seg.check_seat_class(cus.get_id()) or "")
+            w.data += _COST.pack(cus.get_cost_of_trip(trip))
+
+        # The miles are kept change by change, not per trip, so the peak a
+        # customer reached before a cancellation (and the status it gave)
+        # survives recovery.
+        histories = [(cus.get_id(), cus.get_miles_history())
+                     for cus in customers.values()]
+        histories = [(cid, history) for cid, history in histories if history]
+        w.int(len(histories))
+        for cid, history in histories:
+            w.int(cid).int(len(history))
+            for when, miles in history:
+                w.data += _MILES.pack(when.toordinal(), miles)
+
+        with self._lock:
+            self._flush()
+            path = os.path.join(self.directory, CHECKPOINT_FILE)
+            with open(path + ".tmp", "wb") as f:
+                f.write(_MAGIC + struct.pack("<Q", self._sequence)
+                        + w.data + _CRC.pack(zlib.crc32(w.data)))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            self._file.truncate(0)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def has_bookings(self) -> bool:
+        """ Returns True if this journal holds a checkpoint or any event to
+            recover.
+        """
+        with self._lock:
+            return os.path.exists(os.path.join(
+                self.directory, CHECKPOINT_FILE)) or self._file.tell() > 0 \
+                or bool(self._buffer)
+
+    def recover(self, flights: Dict[datetime.date, List[FlightSegment]],
+                customers: Dict[int, Customer],
+                fares: Optional[FareEngine] = None) -> int:
+        """ Restores the bookings of the last checkpoint into <flights> and
+            <customers>, then replays the events logged after it. Returns the
+            number of events replayed. The trips booked after the checkpoint
+            are priced with the <fares>, if given, as they were when booked.
+
+            Precondition: <flights> and <customers> were created from the
+            dataset, with no trips loaded or seats booked.
+        """
+        segments = {segment_key(seg): seg
+                    for day in flights.values() for seg in day}
+        with self._lock:
+            self._sequence = self._load_checkpoint(segments, customers)
+            replayed = 0
+            path = os.path.join(self.directory, JOURNAL_FILE)
+            with open(path, "rb") as f:
+                data = f.read()
+            pos = 0
+            while pos + _HEADER.size <= len(data):
+                seq, kind, size = _HEADER.unpack_from(data, pos)
+                body = pos + _HEADER.size
+                end = body + size + _CRC.size
+                if end > len(data) or _CRC.unpack_from(
+                        data, body + size)[0] != zlib.crc32(
+                            data[body:body + size]):
+                    break
+                if seq > self._sequence:
+                    _replay(kind, _Reader(data, body), segments, customers,
+                            fares)
+                    self._sequence = seq
+                    replayed += 1
+                pos = end
+            # Drop a record torn by a crash, so new events follow whole ones.
+            self._file.truncate(pos)
+        return replayed
+
+    def _log(self, kind: int, payload: bytes) -> None:
+        """ Buffers an event of the given <kind>, and writes the buffer out
+            once it holds group_size events.
+        """
+        with self._lock:
+            self._sequence += 1
+            self._buffer += _HEADER.pack(self._sequence, kind, len(payload))
+            self._buffer += payload
+            self._buffer += _CRC.pack(zlib.crc32(payload))
+            self._pending += 1
+            if self._pending >= self.group_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        """ Writes the buffered events to disk. The lock must be held. """
+
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+            self._pending = 0
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _load_checkpoint(self, segments: Dict[SegmentKey, FlightSegment],
+                         customers: Dict[int, Customer]) -> int:
+        """ Restores the bookings in the checkpoint, if there is one, and
+            returns the sequence number of the last event it includes.
+        """
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:4] != _MAGIC or _CRC.unpack_from(data, len(data) - 4)[0] \
+                != zlib.crc32(data[12:-4]):
+            raise ValueError("Corrupt booking checkpoint: " + path)
+
+        r = _Reader(data, 12)
+        for _ in range(r.int()):
+            seg = segments[r.segment()]
+            for _ in range(r.int()):
+                cid = r.int()
+                seg.book_seat(cid, r.str())
+
+        for _ in range(r.int()):
+            rid, cid = r.str(), r.int()
+            trip_date = datetime.date.fromordinal(r.int())
+            legs = []
+            for _ in range(r.int()):
+                seg = segments[r.segment()]
+                legs.append((seg, r.str()))
+            cost = _COST.unpack_from(data, r.pos)[0]
+            r.pos += _COST.size
+            customer = customers[cid]
+            trip = customer.book_trip(rid, legs, trip_date, deferred=True)
+            customer.set_cost_of_trip(trip, cost)
+
+        for _ in range(r.int()):
+            customer = customers[r.int()]
+            for _ in range(r.int()):
+                ordinal, miles = _MILES.unpack_from(data, r.pos)
+                r.pos += _MILES.size
+                customer.record_miles(datetime.date.fromordinal(ordinal),
+                                      miles)
+        return struct.unpack_from("<Q", data, 4)[0]
+
+
+def _replay(kind: int, r: _Reader, segments: Dict[SegmentKey, FlightSegment],
+            customers: Dict[int, Customer],
+            fares: Optional[FareEngine]) -> None:
+    """ Applies the event of the given <kind>, read from <r>, to <segments>
+        and <customers>, pricing any trip booked with the <fares>.
+    """
+    if kind == BOOK_SEAT:
+        seg = segments[r.segment()]
+        cid = r.int()
+        seg.book_seat(cid, r.str())
+    elif kind == CANCEL_SEAT:
+        seg = segments[r.segment()]
+        seg.cancel_seat(r.int())
+    elif kind == BOOK_TRIP:
+        rid, cid = r.str(), r.int()
+        trip_date = datetime.date.fromordinal(r.int())
+        legs = []
+        for _ in range(r.int()):
+            seg = segments[r.segment()]
+            legs.append((seg, r.str()))
+        for seg, seat_type in legs:
+            seg.book_seat(cid, seat_type)
+        if fares is None:
+            customers[cid].book_trip(rid, legs, trip_date)
+        else:
+            fares.book_trip(customers[cid], rid, legs, trip_date)
+    elif kind == CANCEL_TRIP:
+        rid, cid = r.str(), r.int()
+        legs = []
+        for _ in range(r.int()):
+            seg = segments[r.segment()]
+            legs.append((seg, r.str()))
+        customer = customers[cid]
+        trip = customer.get_trip(rid)
+        if trip is not None:
+            # The seats cancelled are those logged, as in the live cancel.
+            customer.cancel_trip(trip, legs)
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'datetime', 'os', 'struct',
+            'threading', 'zlib', 'customer', 'fares', 'flight', '__future__'
+        ],
+        'allowed-io': ['checkpoint', 'recover', '_load_checkpoint'],
+        'max-locals': 20
+    })
@@ -0,0 +1,151 @@
+"""Parses large CSV files in parallel, over newline-aligned byte ranges"""
+import csv
+import gc
+import io
+import locale
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+# WORKERS: the default number of worker processes.
+WORKERS = os.cpu_count() or 1
+
+# MIN_RANGE: the fewest bytes parsed by one worker; smaller files are parsed
+#            in this process.
+MIN_RANGE = 4 << 20
+
+# SEPARATOR: joins the fields of a range's rows into one string sent back by
+#            a worker; it never appears in the data files.
+SEPARATOR = "\0"
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    """ Pauses the cyclic garbage collector while rows are built: they hold
+        only strings, so cannot form cycles, but the millions of lists made
+        would otherwise set it off over and over.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def split_ranges(path: str, parts: int) -> List[Tuple[int, int]]:
+    """ Returns up to <parts> (start, end) byte ranges covering the file at
+        <path>, in order. Each but the last ends just after a newline, so
+        every line is in exactly one range.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for n in range(1, parts):
+            target = max(size * n // parts, bounds[-1])
+            if target >= size:
+                break
+            f.seek(target)
+            f.readline()
+            if f.tell() > bounds[-1] and f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_range(path: str, start: int, end: int) -> Tuple[str, array]:
+    """ Returns the rows of the CSV file at <path> between bytes <start> and
+        <end>, as a column buffer: the fields of every row joined by
+        SEPARATOR, and the number of fields in each row.
+
+        The bytes are decoded and their newlines translated as open() would
+        in text mode, so the rows are those csv.reader reads from the file.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return parse_text(data.decode(locale.getpreferredencoding(False)))
+
+
+def parse_text(text: str) -> Tuple[str, array]:
+    """ Returns the column buffer of the CSV <text>, as parse_range does for
+        a range of a file.
+    """
+    fields = []
+    counts = array("i")
+    with _gc_paused():
+        for row in csv.reader(io.StringIO(text, newline=None)):
+            fields.extend(row)
+            counts.append(len(row))
+    return SEPARATOR.join(fields), counts
+
+
+def _rows(buffer: Tuple[str, array]) -> List[List[str]]:
+    """ Returns the rows of the column <buffer> made by parse_range.
+
+    >>> _rows(parse_text("a,b\\r\\nc\\n\\n\\"d,e\\",f\\n"))
+    [['a', 'b'], ['c'], [], ['d,e', 'f']]
+    >>> _rows(parse_text(",\\n\\n"))
+    [['', ''], []]
+    >>> _rows(parse_text("a,b\\nc,d\\n"))
+    [['a', 'b'], ['c', 'd']]
+    """
+    joined, counts = buffer
+    fields = joined.split(SEPARATOR) if sum(counts) else []
+    if counts and 0 < min(counts) == max(counts):
+        # Rows of the same width are regrouped in C.
+        return list(map(list, zip(*[iter(fields)] * counts[0])))
+    rows = []
+    i = 0
+    for count in counts:
+        rows.append(fields[i:i + count])
+        i += count
+    return rows
+
+
+def stream_rows(path: str) -> Iterator[List[str]]:
+    """ Yields the rows of the CSV file at <path> one at a time, the same as
+        reading it with csv.reader, so each can be freed before the next is
+        read. Unlike read_rows, the file's rows are never all held at once.
+    """
+    with open(path) as f:
+        yield from csv.reader(f)
+
+
+def read_rows(path: str, workers: int = WORKERS,
+              min_range: int = MIN_RANGE) -> List[List[str]]:
+    """ Returns the rows of the CSV file at <path>, the same as reading it
+        with csv.reader, parsed by up to <workers> processes, each given a
+        byte range of at least <min_range> bytes.
+
+        Precondition: no field of the file contains a newline, so every
+        line is a row.
+    """
+    parts = max(1, min(workers, os.path.getsize(path) // max(1, min_range)))
+    ranges = split_ranges(path, parts)
+    if len(ranges) == 1:
+        with _gc_paused():
+            return _rows(parse_range(path, *ranges[0]))
+    with ProcessPoolExecutor(len(ranges)) as pool:
+        buffers = pool.map(parse_range, [path] * len(ranges),
+                           [r[0] for r in ranges], [r[1] for r in ranges])
+        rows = []
+        with _gc_paused():
+            for buffer in buffers:
+                rows.extend(_rows(buffer))
+    return rows
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'csv', 'gc', 'io', 'locale',
+            'os', 'array', 'concurrent.futures', 'contextlib'
+        ],
+        'allowed-io': ['split_ranges', 'parse_range', 'stream_rows']
+    })
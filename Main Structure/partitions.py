@@ -0,0 +1,316 @@
+"""Stores flight segments in date partitions of a compact binary format, so
+date-bounded loads only read the partitions they need"""
+from __future__ import annotations
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import struct
+import sys
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional
+
+from application import flight_segment
+from flight import FlightSegment
+from symbols import SYMBOLS
+
+# MANIFEST_FILE: the name of the manifest of a partitioned directory.
+MANIFEST_FILE = "partitions.json"
+
+# GRAINS: how segments may be partitioned, with the key of the partition
+#         holding a date.
+GRAINS = {"month": lambda day: day.strftime("%Y-%m"),
+          "day": lambda day: day.isoformat()}
+
+_MAGIC = b"PAS1"
+_COUNT = struct.Struct("<I")
+_LENGTH = struct.Struct("<H")
+# A row: flight ID, departure and arrival IATA (codes into the partition's
+# strings), departure date ordinal, departure and arrival minute of the day,
+# and length.
+_ROW = struct.Struct("<IIIIHHd")
+
+
+class _Partition:
+    """ The rows of one partition, as they are written.
+
+    === Public Attributes ===
+    codes:
+        the code of every string in the partition, in order.
+    rows:
+        the packed rows of the partition.
+    days:
+        the number of rows departing on each date.
+    """
+
+    codes: Dict[str, int]
+    rows: bytearray
+    days: Dict[datetime.date, int]
+
+    def __init__(self) -> None:
+        self.codes = {}
+        self.rows = bytearray()
+        self.days = {}
+
+    def code(self, text: str) -> int:
+        """ Returns the code of <text> in this partition's strings. """
+        if text not in self.codes:
+            self.codes[text] = len(self.codes)
+        return self.codes[text]
+
+    def to_bytes(self) -> bytes:
+        """ Returns the contents of this partition's file. """
+        strings = bytearray()
+        for text in self.codes:
+            raw = text.encode("utf-8")
+            strings += _LENGTH.pack(len(raw)) + raw
+        return b"".join([_MAGIC, _COUNT.pack(len(self.codes)), strings,
+                         _COUNT.pack(len(self.rows) // _ROW.size),
+                         self.rows])
+
+
+def _minute_of_day(clock: str) -> int:
+    """ Returns the minute of the day of the "HH:MM" <clock>.
+
+    >>> _minute_of_day("13:05")
+    785
+    """
+    hours, minutes = clock.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def write_partitions(file_segments: str, directory: str,
+                     grain: str = "month") -> int:
+    """ Writes the flight segments of the segments file at <file_segments>
+        to <directory>, one file per <grain> ("month" or "day") of departure
+        dates, with a manifest of the dates each one covers. Returns the
+        number of partitions written.
+    """
+    if grain not in GRAINS:
+        raise ValueError("Unknown partition grain: " + grain)
+    key_of = GRAINS[grain]
+    partitions = {}
+    with open(file_segments) as f:
+        for row in csv.reader(f):
+            day = datetime.date(*map(int, row[3].split(":")))
+            part = partitions.setdefault(key_of(day), _Partition())
+            part.rows += _ROW.pack(part.code(row[0]), part.code(row[1]),
+                                   part.code(row[2]), day.toordinal(),
+                                   _minute_of_day(row[4]),
+                                   _minute_of_day(row[5]), float(row[6]))
+            part.days[day] = part.days.get(day, 0) + 1
+
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    for key in sorted(partitions):
+        part = partitions[key]
+        name = "segments-{}.bin".format(key)
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(part.to_bytes())
+        entries.append({"key": key, "file": name,
+                        "first": min(part.days).isoformat(),
+                        "last": max(part.days).isoformat(),
+                        "days": {day.isoformat(): count for day, count
+                                 in sorted(part.days.items())}})
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as f:
+        json.dump({"grain": grain, "partitions": entries}, f, indent=1)
+    return len(entries)
+
+
+def read_partition(path: str) -> Dict[datetime.date, List[FlightSegment]]:
+    """ Returns the flight segments in the partition file at <path>, indexed
+        by departure date, in the order they were in the segments file, as
+        create_flight_segments would make them.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != _MAGIC:
+        raise ValueError("Not a segment partition: " + path)
+    strings = []
+    pos = len(_MAGIC) + _COUNT.size
+    for _ in range(_COUNT.unpack_from(data, len(_MAGIC))[0]):
+        length = _LENGTH.unpack_from(data, pos)[0]
+        pos += _LENGTH.size
+        strings.append(SYMBOLS.intern(data[pos:pos + length].decode("utf-8")))
+        pos += length
+    pos += _COUNT.size
+
+    d = {}
+    days = {}
+    for fid, dep, arr, ordinal, dep_min, arr_min, dist in \
+            _ROW.iter_unpack(data[pos:]):
+        if ordinal not in days:
+            midnight = datetime.datetime.fromordinal(ordinal)
+            days[ordinal] = (midnight, d.setdefault(midnight.date(), []))
+        midnight, segments = days[ordinal]
+        segments.append(flight_segment(
+            strings[fid], strings[dep], strings[arr],
+            midnight + datetime.timedelta(minutes=dep_min),
+            midnight + datetime.timedelta(minutes=arr_min),
+            SYMBOLS.intern(dist)))
+    return d
+
+
+class SegmentPartitions(Mapping):
+    """ The flight segments of a partitioned directory, indexed by departure
+    date, as create_flight_segments returns them, but read from disk one
+    partition at a time, when a date in it is first looked up.
+
+    Its dates come from the manifest, so listing or counting them reads no
+    partition. Looking up segments in a date range, through between, opens
+    only the partitions overlapping it. Lazily loaded trips are only booked
+    on the segments of their own dates, so a DateFilter query of one
+    quarter, over a dataset.LazySegments, never reads the other months from
+    disk.
+
+    >>> import tempfile
+    >>> from dataset import LazySegments, load_lazy
+    >>> from filter import DateFilter
+    >>> tmp = tempfile.mkdtemp()
+    >>> months = range(1, 7)
+    >>> with open(os.path.join(tmp, "segments.csv"), "w") as f:
+    ...     for m in months:
+    ...         _ = f.write("PA-{0},YYZ,YVR,2019:0{0}:01,09:00,11:30,3350\\n"
+    ...                     .format(m))
+    >>> with open(os.path.join(tmp, "trips.csv"), "w") as f:
+    ...     for m in months:
+    ...         _ = f.write("R{0},1,2019-0{0}-01,\\"[('YYZ','Economy'),"
+    ...                     "('YVR','')]\\"\\n".format(m))
+    >>> write_partitions(os.path.join(tmp, "segments.csv"), tmp)
+    6
+    >>> parts = SegmentPartitions(tmp)
+    >>> customers, index = load_lazy(os.path.join(tmp, "trips.csv"),
+    ...                              [["1", "Ann", "30", "CA"]], parts)
+    >>> q1 = DateFilter().apply(list(customers.values()),
+    ...                         LazySegments(index), "2019-01-01/2019-03-31")
+    >>> [seg.get_fid() for seg in q1]
+    ['PA-1', 'PA-2', 'PA-3']
+    >>> parts.loaded_partitions()
+    ['2019-01', '2019-02', '2019-03']
+
+    === Public Attributes ===
+    directory:
+        the directory holding the partitions and their manifest.
+    grain:
+        how the segments are partitioned: "month" or "day".
+    """
+    # === Private Attributes ===
+    # _files:
+    #     the file of each partition, indexed by its key.
+    # _days:
+    #     the partition key of every date with segments, in order.
+    # _loaded:
+    #     the segments of every partition read so far, indexed by key.
+    # _lock:
+    #     guards _loaded, so a partition is only read once.
+
+    directory: str
+    grain: str
+    _files: Dict[str, str]
+    _days: Dict[datetime.date, str]
+    _loaded: Dict[str, Dict[datetime.date, List[FlightSegment]]]
+    _lock: threading.Lock
+
+    def __init__(self, directory: str) -> None:
+        """ Initialize the SegmentPartitions written to <directory> by
+            write_partitions. Only the manifest is read.
+
+            Precondition: the airports are created first.
+        """
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        self.grain = manifest["grain"]
+        self._files = {}
+        self._days = {}
+        for entry in manifest["partitions"]:
+            self._files[entry["key"]] = entry["file"]
+            for day in entry["days"]:
+                self._days[datetime.date.fromisoformat(day)] = entry["key"]
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, day: datetime.date) -> List[FlightSegment]:
+        key = self._days.get(day) if isinstance(day, datetime.date) else None
+        if key is None:
+            raise KeyError(day)
+        return self._partition(key)[day]
+
+    def __iter__(self) -> Iterator[datetime.date]:
+        return iter(self._days)
+
+    def __len__(self) -> int:
+        return len(self._days)
+
+    def __contains__(self, day: object) -> bool:
+        return day in self._days
+
+    def _partition(self, key: str) -> Dict[datetime.date, List[FlightSegment]]:
+        """ Returns the segments of the partition <key>, reading it first if
+            it has not been read yet.
+        """
+        with self._lock:
+            if key not in self._loaded:
+                self._loaded[key] = read_partition(
+                    os.path.join(self.directory, self._files[key]))
+            return self._loaded[key]
+
+    def partitions_between(self, start: datetime.date,
+                           end: datetime.date) -> List[str]:
+        """ Returns the keys of the partitions holding segments departing
+            from <start> to <end>, inclusive, in order.
+        """
+        keys = []
+        for day, key in self._days.items():
+            if start <= day <= end and key not in keys:
+                keys.append(key)
+        return keys
+
+    def between(self, start: datetime.date,
+                end: datetime.date) -> Dict[datetime.date, List[FlightSegment]]:
+        """ Returns the flight segments departing from <start> to <end>,
+            inclusive, indexed by date, reading only the partitions holding
+            them.
+        """
+        found = {}
+        for key in self.partitions_between(start, end):
+            for day, segments in self._partition(key).items():
+                if start <= day <= end:
+                    found[day] = segments
+        return found
+
+    def segments_between(self, start: datetime.date,
+                         end: datetime.date) -> List[FlightSegment]:
+        """ Returns the flight segments departing from <start> to <end>,
+            inclusive, in date order.
+        """
+        return [seg for segments in self.between(start, end).values()
+                for seg in segments]
+
+    def loaded_partitions(self) -> List[str]:
+        """ Returns the keys of the partitions read so far. """
+
+        with self._lock:
+            return sorted(self._loaded)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ Partitions a segments file, as asked by the command line arguments
+        <argv>.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("segments", help="segments file to partition")
+    parser.add_argument("directory", help="directory to write them to")
+    parser.add_argument("--grain", choices=sorted(GRAINS), default="month")
+    args = parser.parse_args(argv)
+
+    count = write_partitions(args.segments, args.directory, args.grain)
+    print("Wrote {} partitions to {}".format(count, args.directory))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
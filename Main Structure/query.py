@@ -0,0 +1,166 @@
+"""Answers filter queries over a dataset from the command line, without the
+GUI"""
+import argparse
+import os
+import sys
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import application
+import export
+from customer import Customer
+from dataset import LazySegments, load_lazy
+from filter import CustomerFilter, DateFilter, DurationFilter, Filter, \
+    LocationFilter, TripFilter
+from flight import FlightSegment, Trip
+from partitions import SegmentPartitions
+
+
+def trip_summary(customer: Customer, trip: Trip) -> str:
+    """ Returns the summary of the <trip> booked by <customer>, as displayed
+        by the visualizer.
+    """
+    return "\n".join([
+        "Summary of Trip (ID: {}):".format(trip.get_reservation_id()),
+        "The itinerary for this trip is: {}.".format(
+            trip.get_flight_segments()),
+        "The cost of this trip is: ${:.2f}.".format(
+            customer.get_cost_of_trip(trip)),
+        "The total trip time is: {}-minutes.".format(
+            trip.get_total_trip_time()),
+        "The time in-flight is: {}-minutes.".format(
+            trip.get_in_flight_time()),
+        "The layover time is: {}-minutes.".format(
+            trip.get_layover_time())])
+
+
+def segment_line(segment: FlightSegment) -> str:
+    """ Returns one line identifying the <segment>: its flight ID, departure
+        date, and departure and arrival airports.
+    """
+    return "{} {} {} {}".format(segment.get_fid(),
+                                segment.get_times()[0].date(),
+                                segment.get_dep(), segment.get_arr())
+
+
+def load(data_dir: str, dataset: str, lazy: bool, workers: int = 1,
+         partitions: Optional[str] = None) \
+        -> Tuple[Dict[int, Customer], Sequence[FlightSegment],
+                 Callable[[str], Optional[Trip]]]:
+    """ Loads the <dataset> in <data_dir>, only indexing its trips if <lazy>
+        is True, parsing its files with <workers> processes. Its flight
+        segments are read from the <partitions> directory instead, if given,
+        one partition at a time as trips need them. Returns its customers,
+        indexed by ID, the flight segments of all of its trips, and a
+        function finding a trip by reservation ID.
+    """
+    seg_file, trip_file = application.DATASETS[dataset]
+    logs = application.import_data(
+        os.path.join(data_dir, "airports.csv"),
+        os.path.join(data_dir, "customers.csv"),
+        os.devnull if partitions else os.path.join(data_dir, seg_file),
+        os.devnull if lazy else os.path.join(data_dir, trip_file), workers)
+    application.create_airports(logs[0])
+    if partitions:
+        flights = SegmentPartitions(partitions)
+    else:
+        flights = application.create_flight_segments(logs[1])
+    if lazy:
+        customers, index = load_lazy(os.path.join(data_dir, trip_file),
+                                     logs[2], flights)
+        return customers, LazySegments(index), index.trip
+    customers = application.create_customers(logs[2])
+    trips = application.load_trips(logs[3], customers, flights)
+    # The first trip booked under a reservation ID is the one found.
+    by_reservation = {}
+    for trip in trips:
+        by_reservation.setdefault(trip.get_reservation_id(), trip)
+    return (customers,
+            [seg for trip in trips for seg in trip.get_flight_segments()],
+            by_reservation.get)
+
+
+def filter_arg(f: Filter) -> Callable[[str], Tuple[Filter, str]]:
+    """ Returns an argparse type pairing the filter <f> with its filter
+        string, so filters given on the command line keep their order.
+    """
+    return lambda filter_string: (f, filter_string.upper())
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ Runs the query given by the command line arguments <argv>, printing
+        its result, and returns the exit status.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__, epilog="Filters are applied in the order given.")
+    parser.add_argument("--data", default=application.DATA_DIR,
+                        help="directory of the dataset files")
+    parser.add_argument("--dataset", choices=sorted(application.DATASETS),
+                        default="small")
+    parser.add_argument("--lazy", action="store_true",
+                        help="only load the trips the query needs")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes parsing the segment and trip files")
+    parser.add_argument("--partitions", metavar="DIR",
+                        help="read flight segments from the partitions in "
+                             "DIR (see partitions.py); with --lazy, only "
+                             "those the query needs are read")
+    filters = parser.add_argument_group("filters")
+    for flag, f, example in (("--customer", CustomerFilter(), "ID"),
+                             ("--location", LocationFilter(), "IATA"),
+                             ("--duration", DurationFilter(), "LMMM|GMMM"),
+                             ("--date", DateFilter(), "START/END"),
+                             ("--trip", TripFilter(), "RESERVATION_ID")):
+        filters.add_argument(flag, dest="filters", action="append",
+                             type=filter_arg(f), metavar=example, default=[])
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--ids", action="store_true",
+                        help="print every flight segment selected")
+    output.add_argument("--summary", metavar="RESERVATION_ID",
+                        action="append",
+                        help="print the summary of a trip instead")
+    output.add_argument("--export", metavar="PATH",
+                        help="write the flight segments selected, with their "
+                             "manifests, to PATH ('-' for standard output)")
+    output.add_argument("--export-trips", metavar="PATH",
+                        help="write the summaries of all trips to PATH "
+                             "instead (e.g. '--export-trips - --format "
+                             "table' for a report)")
+    parser.add_argument("--format", choices=export.FORMATS, default="csv",
+                        help="format of the exported file")
+    args = parser.parse_args(argv)
+
+    customers, data, find_trip = load(args.data, args.dataset, args.lazy,
+                                       args.workers, args.partitions)
+    if args.summary:
+        status = 0
+        for rid in args.summary:
+            rid = rid.upper()
+            trip = find_trip(rid)
+            if trip is None:
+                print("This Trip (ID: {}) does not exist in your dataset!"
+                      .format(rid))
+                status = 1
+            else:
+                print(trip_summary(customers[trip.customer_id], trip))
+        return status
+    if args.export_trips:
+        export.export(export.trip_rows(customers.values()),
+                      export.TRIP_FIELDS, args.export_trips, args.format)
+        return 0
+
+    everyone = list(customers.values())
+    for f, filter_string in args.filters:
+        data = f.apply(everyone, data, filter_string)
+    if args.export:
+        export.export(export.segment_rows(data), export.SEGMENT_FIELDS,
+                      args.export, args.format)
+    elif args.ids:
+        for seg in data:
+            print(segment_line(seg))
+    else:
+        print(len(data))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
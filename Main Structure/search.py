@@ -0,0 +1,253 @@
+"""Defines ConnectionSearch, which finds the fastest or cheapest itineraries
+between two airports on a time-expanded graph of flight segments"""
+from __future__ import annotations
+
+import datetime
+import heapq
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from customer import CLASS_MULTIPLIER
+from flight import FlightSegment
+from geometry import great_circle_distance
+
+# MIN_CONNECTION: the fewest minutes allowed between landing and taking the
+#                 next flight.
+MIN_CONNECTION = 45
+
+# MAX_LAYOVER: the most minutes allowed between landing and taking the next
+#              flight.
+MAX_LAYOVER = 24 * 60
+
+# MAX_LEGS: the most flight segments an itinerary may have.
+MAX_LEGS = 4
+
+# OBJECTIVES: what itineraries may be ranked by.
+OBJECTIVES = ("time", "fare")
+
+# SLACK: the share of the lower bound on the rest of an itinerary's cost that
+#        is used to guide a search, leaving room for rounding errors.
+SLACK = 0.999
+
+# A departure: (departure minute, arrival minute, flight segment), counting
+# minutes from 0001-01-01.
+Departure = Tuple[int, int, FlightSegment]
+
+# An itinerary found: (its total time in minutes, or its fare, and its flight
+# segments in order).
+Itinerary = Tuple[float, List[FlightSegment]]
+
+
+def _minute(moment: datetime.datetime) -> int:
+    """ Returns the number of minutes from 0001-01-01 to <moment>.
+
+    >>> _minute(datetime.datetime(1, 1, 2, 1, 5))
+    1505
+    """
+    return ((moment.toordinal() - 1) * 24 + moment.hour) * 60 + moment.minute
+
+
+def _departure(segment: FlightSegment) -> Departure:
+    """ Returns the departure of the <segment>. A segment whose arrival time
+        is before its departure time lands on the next day.
+    """
+    dep, arr = segment.get_times()
+    start = _minute(dep)
+    return start, start + (_minute(arr) - start) % (24 * 60), segment
+
+
+class ConnectionSearch:
+    """ Finds itineraries between airports over every flight segment added
+    to it.
+
+    The flight segments are indexed by departure airport, in order of
+    departure time. Each is a node of a time-expanded graph: it connects to
+    every segment leaving its arrival airport between MIN_CONNECTION and
+    MAX_LAYOVER minutes after it lands, found by bisecting that airport's
+    departures. A search runs A* over this graph, from the segments leaving
+    the origin on the day asked for, expanding each segment at most k times,
+    so the k best itineraries are found in order without visiting the rest
+    of the schedule.
+
+    A* is guided by a lower bound on the cost of getting from an airport to
+    the destination: the great-circle distance between them times the
+    lowest fare (or flying time) per km of any segment added. As no segment
+    costs less per km, and no route is shorter than the great circle, the
+    bound never overestimates, so the itineraries found are still the best.
+
+    Segments with no seat left in the class asked for are pruned, as are
+    itineraries visiting an airport twice. Seats are checked when a search
+    runs, so bookings made since the segments were added are accounted for.
+    """
+    # === Private Attributes ===
+    # _departures:
+    #     the departures from every airport, in order of departure minute,
+    #     indexed by IATA.
+    # _minutes:
+    #     the departure minutes of _departures, for bisecting.
+    # _locations:
+    #     the (longitude, latitude) of every airport flown to or from,
+    #     indexed by IATA.
+    # _per_km:
+    #     the lowest flying time, in minutes, and base fare, per km of
+    #     great-circle distance, of any segment added, by objective.
+
+    _departures: Dict[str, List[Departure]]
+    _minutes: Dict[str, List[int]]
+    _locations: Dict[str, Tuple[float, float]]
+    _per_km: Dict[str, float]
+
+    def __init__(self, segments: Iterable[FlightSegment] = ()) -> None:
+        """ Initialize a ConnectionSearch over the flight <segments>. """
+
+        self._departures = {}
+        self._minutes = {}
+        self._locations = {}
+        self._per_km = {"time": math.inf, "fare": math.inf}
+        self.add_segments(segments)
+
+    def add_segments(self, segments: Iterable[FlightSegment]) -> int:
+        """ Adds the flight <segments> to the index, and returns how many
+            were added.
+        """
+        touched = set()
+        count = 0
+        for seg in segments:
+            dep = seg.get_dep()
+            if dep not in self._departures:
+                self._departures[dep] = []
+            departure = _departure(seg)
+            self._departures[dep].append(departure)
+            touched.add(dep)
+
+            start, end = seg.get_long_lat()
+            self._locations[dep] = start
+            self._locations[seg.get_arr()] = end
+            distance = great_circle_distance(start, end)
+            if distance > 0:
+                self._per_km["time"] = min(
+                    self._per_km["time"],
+                    (departure[1] - departure[0]) / distance)
+                self._per_km["fare"] = min(
+                    self._per_km["fare"],
+                    seg.get_length() * seg.get_base_fare_cost() / distance)
+            count += 1
+        for dep in touched:
+            self._departures[dep].sort(key=lambda d: d[0])
+            self._minutes[dep] = [d[0] for d in self._departures[dep]]
+        return count
+
+    def departures(self, iata: str, start: int, end: int) -> List[Departure]:
+        """ Returns the departures from the airport <iata> from minute
+            <start> up to, but not including, minute <end>.
+        """
+        minutes = self._minutes.get(iata, [])
+        return self._departures[iata][bisect_left(minutes, start):
+                                      bisect_left(minutes, end)] \
+            if minutes else []
+
+    def _bound(self, by: str, multiplier: float,
+               destination: str) -> Callable[[str], float]:
+        """ Returns a function giving the lower bound on the cost, <by> time
+            or fare with the class <multiplier>, of getting from an airport
+            to <destination>.
+        """
+        end = self._locations.get(destination)
+        rate = self._per_km[by] * SLACK * (multiplier if by == "fare" else 1)
+        if end is None or rate == math.inf:
+            return lambda iata: 0.0
+        bounds = {}
+
+        def bound(iata: str) -> float:
+            """ Returns the lower bound from the airport <iata>. """
+            if iata not in bounds:
+                bounds[iata] = rate * great_circle_distance(
+                    self._locations[iata], end)
+            return bounds[iata]
+        return bound
+
+    def search(self, origin: str, destination: str, day: datetime.date,
+               k: int = 1, by: str = "time", seat_type: str = "Economy",
+               min_connection: int = MIN_CONNECTION,
+               max_layover: int = MAX_LAYOVER,
+               max_legs: int = MAX_LEGS) -> List[Itinerary]:
+        """ Returns up to <k> itineraries from <origin> to <destination>
+            leaving on <day>, best first, with a seat of <seat_type> free on
+            every segment. They are ranked <by> "time" (minutes from the
+            first departure to the last arrival) or "fare" (the sum of each
+            segment's length times its base fare cost times the class
+            multiplier, before any frequent flyer discount).
+        """
+        if by not in OBJECTIVES:
+            raise ValueError("Unknown objective: " + by)
+        if seat_type not in CLASS_MULTIPLIER:
+            raise ValueError("Unknown seat type: " + seat_type)
+        multiplier = CLASS_MULTIPLIER[seat_type]
+        start = (day.toordinal() - 1) * 24 * 60
+        bound = self._bound(by, multiplier, destination)
+
+        # A label is (cost plus bound, order, cost, departure, previous
+        # label), so each itinerary is the chain of labels that reached it.
+        heap = []
+        order = 0
+        for departure in self.departures(origin, start, start + 24 * 60):
+            seg = departure[2]
+            if seg.seat_availability.get(seat_type, 0) > 0:
+                cost = (departure[1] - departure[0] if by == "time" else
+                        seg.get_length() * seg.get_base_fare_cost()
+                        * multiplier)
+                heap.append((cost + bound(seg.get_arr()), order, cost,
+                             departure, None))
+                order += 1
+        heapq.heapify(heap)
+
+        found = []
+        expanded = {}
+        while heap and len(found) < k:
+            label = heapq.heappop(heap)
+            _, _, cost, (_, arrival, seg), previous = label
+            legs = [seg]
+            while previous is not None:
+                legs.append(previous[3][2])
+                previous = previous[4]
+            legs.reverse()
+            if seg.get_arr() == destination:
+                found.append((round(cost, 2), legs))
+                continue
+            times = expanded.get(id(seg), 0)
+            if times >= k or len(legs) >= max_legs:
+                continue
+            expanded[id(seg)] = times + 1
+
+            visited = {leg.get_dep() for leg in legs}
+            for departure in self.departures(seg.get_arr(),
+                                             arrival + min_connection,
+                                             arrival + max_layover + 1):
+                onward = departure[2]
+                if onward.get_arr() in visited or \
+                        onward.seat_availability.get(seat_type, 0) <= 0:
+                    continue
+                step = (departure[1] - arrival if by == "time" else
+                        onward.get_length() * onward.get_base_fare_cost()
+                        * multiplier)
+                heapq.heappush(heap, (cost + step + bound(onward.get_arr()),
+                                      order, cost + step, departure, label))
+                order += 1
+        return found
+
+    def count_segments(self) -> int:
+        """ Returns the number of flight segments indexed. """
+
+        return sum(len(d) for d in self._departures.values())
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'datetime', 'heapq', 'math',
+            'bisect', 'customer', 'flight', 'geometry', '__future__'
+        ]
+    })
@@ -0,0 +1,521 @@
+"""A local HTTP query service over a dataset loaded once, and a load test
+for it"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import application
+from booking import BookingService
+from export import segment_rows, trip_row
+from filter import CustomerFilter, DateFilter, DurationFilter, Filter, \
+    LocationFilter, TripFilter
+from flight import FlightSegment, Trip
+from ingest import LiveModel
+
+# FILTERS: the filter applied for each query parameter of /segments.
+FILTERS = {"customer": CustomerFilter(), "location": LocationFilter(),
+           "duration": DurationFilter(), "date": DateFilter(),
+           "trip": TripFilter()}
+
+# WORKERS: the default number of threads filters and bookings are run on.
+WORKERS = 4
+
+# REASONS: the reason phrase of each HTTP status code sent.
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict",
+           500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    """ Raised to answer a request with an error status. """
+
+    status: int
+
+    def __init__(self, status: int, message: str) -> None:
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class QueryService:
+    """ Serves queries, trip summaries, bookings and cancellations over a
+    LiveModel, to many clients at once, over HTTP/1.1 (with keep-alive) on a
+    TCP port or a Unix socket.
+
+    Requests are read and answered on an asyncio event loop. Filters and
+    bookings run on a pool of worker threads, so a long filter does not hold
+    up other clients' requests. Bookings go through a BookingService, so
+    concurrent bookings of the same seats are safe.
+
+    Endpoints, all answering with JSON:
+        GET /segments?customer=..&location=..&duration=..&date=..&trip=..
+            applies the filters given, in order, to the flight segments of
+            all trips. Add ids=1 for the segments themselves (limit=N for the
+            first N only), not just their count.
+        GET /trips/<reservation ID>
+            the summary of a trip.
+        POST /trips
+            books a trip given as {"customer_id": .., "reservation_id": ..,
+            "date": "YYYY-MM-DD", "legs": [[flight ID, seat type], ..]}.
+        DELETE /trips/<reservation ID>
+            cancels a trip.
+        GET /stats
+            the size of the dataset, and a sample customer and reservation.
+        GET /connections?from=..&to=..&date=YYYY-MM-DD&k=..&by=time|fare
+                &class=..
+            the k best itineraries between two airports leaving on a date,
+            with a seat of the class free on every flight segment.
+        GET /traffic?n=..&date=YYYY-MM-DD
+            the n busiest airports (on the date, if given) and routes, and
+            the load factor of every seat class.
+
+    === Public Attributes ===
+    model:
+        the dataset served.
+    booking:
+        the BookingService every booking and cancellation goes through.
+    """
+    # === Private Attributes ===
+    # _segments:
+    #     the flight segments of all trips. It is replaced, not changed,
+    #     under _lock, when a trip is booked or cancelled, so a filter
+    #     running meanwhile sees a consistent snapshot.
+    # _trips:
+    #     every trip, indexed by reservation ID.
+    # _booking:
+    #     the reservation IDs of the trips being booked.
+    # _flights:
+    #     every flight segment, indexed by (departure date, flight ID).
+    # _lock:
+    #     guards _segments, _trips and _booking.
+    # _pool:
+    #     the worker threads.
+
+    model: LiveModel
+    booking: BookingService
+    _segments: List[FlightSegment]
+    _trips: Dict[str, Trip]
+    _booking: Set[str]
+    _flights: Dict[Tuple[datetime.date, str], FlightSegment]
+    _lock: threading.Lock
+    _pool: ThreadPoolExecutor
+
+    def __init__(self, model: LiveModel, workers: int = WORKERS) -> None:
+        """ Initialize a QueryService over the <model>, with <workers>
+            worker threads.
+        """
+
+        self.model = model
+        self.booking = BookingService(fares=model.fares)
+        self._segments = list(model.segments_flown())
+        self._trips = {trip.get_reservation_id(): trip
+                       for trip in model.trips}
+        self._booking = set()
+        self._flights = {(day, seg.get_fid()): seg
+                         for day, segs in model.flight_segments.items()
+                         for seg in segs}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(workers)
+
+    def close(self) -> None:
+        """ Stops the worker threads. """
+
+        self._pool.shutdown()
+
+    def filter_segments(self, query: List[Tuple[str, str]]) -> Dict:
+        """ Returns the answer to GET /segments with the given <query>
+            parameters.
+        """
+        with self._lock:
+            data = self._segments
+        everyone = list(self.model.customers.values())
+        ids, limit = False, None
+        for name, value in query:
+            if name == "ids":
+                ids = value not in ("", "0")
+            elif name == "limit":
+                try:
+                    limit = int(value)
+                except ValueError:
+                    raise HTTPError(400, "Invalid limit: " + value)
+            elif name in FILTERS:
+                data = FILTERS[name].apply(everyone, data, value.upper())
+            else:
+                raise HTTPError(400, "Unknown parameter: " + name)
+        answer = {"count": len(data)}
+        if ids:
+            answer["segments"] = list(segment_rows(data[:limit]))
+        return answer
+
+    def summary(self, reservation_id: str) -> Dict:
+        """ Returns the summary of the trip <reservation_id>. """
+
+        trip = self._trips.get(reservation_id)
+        if trip is None:
+            raise HTTPError(404, "No such trip: " + reservation_id)
+        return trip_row(self.model.customers[trip.customer_id], trip)
+
+    def book(self, request: Dict) -> Dict:
+        """ Books the trip described by the <request>, and returns its
+            summary.
+        """
+        try:
+            cid = int(request["customer_id"])
+            rid = str(request["reservation_id"]).upper()
+            day = datetime.date.fromisoformat(request["date"])
+            legs = [(self._flights[(day, fid)], seat)
+                    for fid, seat in request["legs"]]
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPError(400, "Invalid booking: {!r}".format(e))
+        customer = self.model.customers.get(cid)
+        if customer is None:
+            raise HTTPError(404, "No such customer: {}".format(cid))
+        if not legs or any(seat not in seg.seat_capacity
+                           for seg, seat in legs):
+            raise HTTPError(400, "Invalid booking: bad legs")
+        with self._lock:
+            if rid in self._trips or rid in self._booking:
+                raise HTTPError(409, "Trip already booked: " + rid)
+            self._booking.add(rid)
+        trip = None
+        try:
+            trip = self.booking.book_trip(customer, rid, legs, day)
+        finally:
+            with self._lock:
+                self._booking.discard(rid)
+                if trip is not None:
+                    self._trips[rid] = trip
+                    self._segments = (self._segments
+                                      + trip.get_flight_segments())
+        if trip is None:
+            raise HTTPError(409, "Seats not available")
+        return trip_row(customer, trip)
+
+    def cancel(self, reservation_id: str) -> Dict:
+        """ Cancels the trip <reservation_id>, and returns its summary. """
+
+        with self._lock:
+            trip = self._trips.pop(reservation_id, None)
+        if trip is None:
+            raise HTTPError(404, "No such trip: " + reservation_id)
+        customer = self.model.customers[trip.customer_id]
+        row = trip_row(customer, trip)
+        self.booking.cancel_trip(
+            customer, trip,
+            # Legs the customer holds no seat on have none to cancel.
+            [(seg, seg.check_seat_class(trip.customer_id))
+             for seg in trip.get_flight_segments()
+             if seg.check_seat_class(trip.customer_id) is not None])
+        # Other trips fly the same segments, so only the first occurrence
+        # of each of this trip's legs is dropped, in one pass.
+        drop = {}
+        for seg in trip.get_flight_segments():
+            drop[id(seg)] = drop.get(id(seg), 0) + 1
+        with self._lock:
+            segments = []
+            for seg in self._segments:
+                if drop.get(id(seg)):
+                    drop[id(seg)] -= 1
+                else:
+                    segments.append(seg)
+            self._segments = segments
+        return row
+
+    def stats(self) -> Dict:
+        """ Returns the answer to GET /stats. """
+
+        trip = self.model.trips[0] if self.model.trips else None
+        return {"customers": len(self.model.customers),
+                "flight_segments": self.model.count_segments(),
+                "trips": len(self._trips),
+                "sample_customer": trip.customer_id if trip else None,
+                "sample_reservation":
+                    trip.get_reservation_id() if trip else None}
+
+    def connections(self, query: Dict[str, str]) -> Dict:
+        """ Returns the answer to GET /connections with the given <query>.
+        """
+        by = query.get("by", "time")
+        try:
+            itineraries = self.model.connections.search(
+                query["from"].upper(), query["to"].upper(),
+                datetime.date.fromisoformat(query["date"]),
+                int(query.get("k", 1)), by, query.get("class", "Economy"))
+        except (KeyError, ValueError) as e:
+            raise HTTPError(400, "Invalid query: {!r}".format(e))
+        fields = ("flight_id", "date", "departure_time", "arrival_time",
+                  "departure", "arrival")
+        return {"itineraries": [
+            {"minutes" if by == "time" else "fare": cost,
+             "legs": [{field: row[field] for field in fields}
+                      for row in segment_rows(legs)]}
+            for cost, legs in itineraries]}
+
+    def traffic(self, query: Dict[str, str]) -> Dict:
+        """ Returns the answer to GET /traffic with the given <query>. """
+
+        try:
+            n = int(query.get("n", 10))
+            day = (datetime.date.fromisoformat(query["date"])
+                   if "date" in query else None)
+        except ValueError as e:
+            raise HTTPError(400, "Invalid query: {}".format(e))
+        rollups = self.model.traffic
+        return {"airports": rollups.busiest_airports(n, day),
+                "routes": [["{}-{}".format(*route), passengers]
+                           for route, passengers in rollups.busiest_routes(n)],
+                "load_factors": rollups.load_factors()}
+
+    async def dispatch(self, method: str, target: str,
+                       body: bytes) -> Tuple[int, Dict]:
+        """ Returns the status and JSON answer to the request <method>
+            <target>, with the given <body>.
+        """
+        loop = asyncio.get_running_loop()
+        url = urlsplit(target)
+        parts = [unquote(p) for p in url.path.strip("/").split("/")]
+        if parts == ["segments"] and method == "GET":
+            return 200, await loop.run_in_executor(
+                self._pool, self.filter_segments, parse_qsl(url.query))
+        if parts[0] == "trips" and len(parts) == 2:
+            if method == "GET":
+                return 200, self.summary(parts[1].upper())
+            if method == "DELETE":
+                return 200, await loop.run_in_executor(
+                    self._pool, self.cancel, parts[1].upper())
+        if parts == ["trips"] and method == "POST":
+            try:
+                request = json.loads(body or b"null")
+            except ValueError:
+                raise HTTPError(400, "Invalid JSON")
+            if not isinstance(request, dict):
+                raise HTTPError(400, "Expected a JSON object")
+            return 201, await loop.run_in_executor(self._pool, self.book,
+                                                   request)
+        if parts == ["stats"] and method == "GET":
+            return 200, self.stats()
+        if parts == ["connections"] and method == "GET":
+            return 200, await loop.run_in_executor(
+                self._pool, self.connections, dict(parse_qsl(url.query)))
+        if parts == ["traffic"] and method == "GET":
+            return 200, self.traffic(dict(parse_qsl(url.query)))
+        if parts[0] in ("segments", "trips", "stats", "connections",
+                        "traffic"):
+            raise HTTPError(405, "Method not allowed: " + method)
+        raise HTTPError(404, "No such endpoint: " + url.path)
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """ Answers the requests of one client connection, until it closes
+            or asks to.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0))
+                    method, target, version = line.decode("latin-1").split()
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    length, method, version = 0, None, "HTTP/1.0"
+                body = await reader.readexactly(length)
+                try:
+                    if method is None:
+                        raise HTTPError(400, "Malformed request")
+                    status, answer = await self.dispatch(method, target, body)
+                except HTTPError as e:
+                    status, answer = e.status, {"error": str(e)}
+                except Exception as e:  # Keep serving other requests.
+                    status, answer = 500, {"error": repr(e)}
+                payload = json.dumps(answer).encode()
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: "
+                             "application/json\r\nContent-Length: {}\r\n\r\n"
+                             .format(status, REASONS[status], len(payload))
+                             .encode("latin-1") + payload)
+                await writer.drain()
+                if (headers.get("connection", "").lower() == "close"
+                        or version == "HTTP/1.0"):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port: int = 8080, unix: Optional[str] = None,
+                    ready: Optional[asyncio.Event] = None) -> None:
+        """ Serves requests on <port> of localhost, or on the Unix socket at
+            <unix> if it is given, until cancelled. Sets <ready>, if given,
+            once connections are accepted.
+        """
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle, unix)
+        else:
+            server = await asyncio.start_server(self.handle, "127.0.0.1",
+                                                port)
+        async with server:
+            if ready is not None:
+                ready.set()
+            await server.serve_forever()
+
+
+async def _request(reader: asyncio.StreamReader,
+                   writer: asyncio.StreamWriter, method: str, target: str,
+                   body: bytes = b"") -> Tuple[int, bytes]:
+    """ Sends one request on a keep-alive connection, and returns the status
+        and body of its answer.
+    """
+    writer.write("{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}"
+                 "\r\n\r\n".format(method, target, len(body))
+                 .encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            try:
+                length = int(value)
+            except ValueError:
+                raise ConnectionError("Invalid Content-Length: " + value)
+    return status, await reader.readexactly(length)
+
+
+async def _connect(port: int, unix: Optional[str]) \
+        -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """ Opens a connection to the service. """
+
+    if unix is not None:
+        return await asyncio.open_unix_connection(unix)
+    return await asyncio.open_connection("127.0.0.1", port)
+
+
+async def load_test(clients: int, requests: int, port: int = 8080,
+                    unix: Optional[str] = None,
+                    targets: Optional[List[str]] = None) -> Dict:
+    """ Sends <requests> requests from each of <clients> concurrent clients
+        (each on its own keep-alive connection) to the service, cycling
+        through the GET <targets> (by default, one of each kind of query).
+        Returns the throughput, the p50, p99 and maximum latencies, in
+        seconds, and the number of errors.
+    """
+    if targets is None:
+        reader, writer = await _connect(port, unix)
+        sample = json.loads((await _request(reader, writer, "GET",
+                                            "/stats"))[1])
+        writer.close()
+        targets = ["/segments?customer={}".format(sample["sample_customer"]),
+                   "/segments?location=YYZ",
+                   "/segments?duration=L300",
+                   "/segments?date=2019-01-01/2019-01-07",
+                   "/segments?trip={}".format(sample["sample_reservation"]),
+                   "/trips/{}".format(sample["sample_reservation"])]
+    latencies = []
+    errors = 0
+
+    async def client(n: int) -> None:
+        """ Sends the requests of the <n>-th client. """
+        nonlocal errors
+        reader, writer = await _connect(port, unix)
+        try:
+            for i in range(requests):
+                target = targets[(n + i) % len(targets)]
+                start = time.perf_counter()
+                status = (await _request(reader, writer, "GET", target))[0]
+                latencies.append(time.perf_counter() - start)
+                errors += status >= 400
+        except ConnectionError:
+            # The connection is unusable; its remaining requests are lost.
+            errors += 1
+        finally:
+            writer.close()
+
+    began = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    elapsed = time.perf_counter() - began
+    latencies.sort()
+    return {"requests": len(latencies), "errors": errors,
+            "throughput": len(latencies) / elapsed,
+            "p50": statistics.median(latencies),
+            "p99": latencies[max(0, math.ceil(0.99 * len(latencies)) - 1)],
+            "max": latencies[-1]}
+
+
+def load_model(data_dir: str, dataset: str) -> LiveModel:
+    """ Returns a LiveModel of the <dataset> in <data_dir>. """
+
+    seg_file, trip_file = application.DATASETS[dataset]
+    model = LiveModel()
+    model.ingest_files(os.path.join(data_dir, "airports.csv"),
+                       os.path.join(data_dir, "customers.csv"),
+                       os.path.join(data_dir, seg_file),
+                       os.path.join(data_dir, trip_file))
+    return model
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ Serves or load tests the service, as asked by the command line
+        arguments <argv>.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="load a dataset and serve it")
+    serve.add_argument("--data", default=application.DATA_DIR)
+    serve.add_argument("--dataset", choices=sorted(application.DATASETS),
+                       default="small")
+    serve.add_argument("--workers", type=int, default=WORKERS)
+    test = commands.add_parser("loadtest", help="load test a running service")
+    test.add_argument("--clients", type=int, default=32)
+    test.add_argument("--requests", type=int, default=100,
+                      help="requests sent by each client")
+    for command in (serve, test):
+        command.add_argument("--port", type=int, default=8080)
+        command.add_argument("--unix", help="Unix socket path, instead of a "
+                                            "TCP port")
+    args = parser.parse_args(argv)
+
+    if args.command == "loadtest":
+        result = asyncio.run(load_test(args.clients, args.requests,
+                                       args.port, args.unix))
+        print("{requests} requests, {errors} errors, {throughput:.0f} req/s"
+              .format(**result))
+        print("p50 {:.2f}ms  p99 {:.2f}ms  max {:.2f}ms".format(
+            result["p50"] * 1000, result["p99"] * 1000, result["max"] * 1000))
+        return 1 if result["errors"] else 0
+
+    service = QueryService(load_model(args.data, args.dataset), args.workers)
+    print("Serving on", args.unix or "http://127.0.0.1:{}".format(args.port))
+    try:
+        asyncio.run(service.serve(args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,408 @@
+"""Publishes the flight segments, manifests and trips of a dataset as columns
+in shared memory or a file, which worker processes read without copying"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, \
+    Tuple, TypeVar
+
+from customer import Customer
+from flight import FlightSegment, Trip
+
+# COLUMNS: the name and array typecode of every column of a snapshot, in the
+#          order they are laid out. Strings (flight IDs, IATA codes, seat
+#          types and reservation IDs) are stored as codes into the strings
+#          column, and the manifests and legs of the i-th segment and trip
+#          run from the i-th to the (i + 1)-th of their offsets.
+COLUMNS = (
+    ("seg_fid", "i"), ("seg_dep", "i"), ("seg_arr", "i"),
+    ("seg_dep_minute", "q"), ("seg_arr_minute", "q"),
+    ("seg_length", "d"), ("seg_base_cost", "d"), ("seg_manifest", "q"),
+    ("man_cid", "q"), ("man_seat", "i"),
+    ("trip_rid", "i"), ("trip_cid", "q"), ("trip_date", "i"),
+    ("trip_cost", "d"), ("trip_legs", "q"), ("leg_segment", "i"),
+    ("strings", "B"), ("string_ends", "q"),
+)
+
+# WORKERS: the default number of worker processes.
+WORKERS = os.cpu_count() or 1
+
+# _PUBLISHED: the names of the shared memory blocks published by this
+#             process.
+_PUBLISHED = set()
+
+_MAGIC = b"PACOLS01"
+# The header is the magic number and the number of columns, followed by an
+# entry for each column: its name, typecode, offset and number of items.
+# Every column starts on an 8-byte boundary.
+_HEADER = struct.Struct("<8sI4x")
+_ENTRY = struct.Struct("<16sc7xQQ")
+_ALIGN = 8
+
+T = TypeVar("T")
+
+
+def _minute(moment: datetime.datetime) -> int:
+    """ Returns the number of minutes from 0001-01-01 to <moment>. """
+
+    return ((moment.toordinal() - 1) * 24 + moment.hour) * 60 + moment.minute
+
+
+def _moment(minute: int) -> datetime.datetime:
+    """ Returns the moment <minute> minutes after 0001-01-01.
+
+    >>> _moment(_minute(datetime.datetime(2019, 3, 4, 5, 6)))
+    datetime.datetime(2019, 3, 4, 5, 6)
+    """
+    day, minute = divmod(minute, 24 * 60)
+    return datetime.datetime.fromordinal(day + 1) + \
+        datetime.timedelta(minutes=minute)
+
+
+def build_columns(segments: Iterable[FlightSegment], trips: Iterable[Trip],
+                  customers: Dict[int, Customer]) -> Dict[str, array]:
+    """ Returns the COLUMNS of the flight <segments>, with their manifests,
+        and of the <trips> booked by the <customers>, with their costs.
+
+        Precondition: every segment of the <trips> is among the <segments>.
+    """
+    columns = {name: array(code) for name, code in COLUMNS}
+    codes = {}
+
+    def code(text: str) -> int:
+        """ Returns the code of <text> in the strings column. """
+        if text not in codes:
+            codes[text] = len(codes)
+            columns["strings"].frombytes(text.encode("utf-8"))
+            columns["string_ends"].append(len(columns["strings"]))
+        return codes[text]
+
+    rows = {}
+    columns["seg_manifest"].append(0)
+    for seg in segments:
+        rows[id(seg)] = len(rows)
+        dep, arr = seg.get_times()
+        columns["seg_fid"].append(code(seg.get_fid()))
+        columns["seg_dep"].append(code(seg.get_dep()))
+        columns["seg_arr"].append(code(seg.get_arr()))
+        columns["seg_dep_minute"].append(_minute(dep))
+        columns["seg_arr_minute"].append(_minute(arr))
+        columns["seg_length"].append(seg.get_length())
+        columns["seg_base_cost"].append(seg.get_base_fare_cost())
+        for cid, seat_type in seg.get_manifest():
+            columns["man_cid"].append(cid)
+            columns["man_seat"].append(code(seat_type))
+        columns["seg_manifest"].append(len(columns["man_cid"]))
+
+    columns["trip_legs"].append(0)
+    for trip in trips:
+        columns["trip_rid"].append(code(trip.get_reservation_id()))
+        columns["trip_cid"].append(trip.customer_id)
+        columns["trip_date"].append(trip.trip_departure.toordinal())
+        columns["trip_cost"].append(
+            customers[trip.customer_id].get_cost_of_trip(trip))
+        for seg in trip.get_flight_segments():
+            columns["leg_segment"].append(rows[id(seg)])
+        columns["trip_legs"].append(len(columns["leg_segment"]))
+    return columns
+
+
+def _layout(columns: Dict[str, array]) -> Tuple[bytes, List[int], int]:
+    """ Returns the header of a snapshot of the <columns>, the offset of
+        each column in it, and its total size in bytes.
+    """
+    entries = []
+    offsets = []
+    size = _HEADER.size + _ENTRY.size * len(COLUMNS)
+    for name, typecode in COLUMNS:
+        size += -size % _ALIGN
+        offsets.append(size)
+        entries.append(_ENTRY.pack(name.encode("ascii"),
+                                   typecode.encode("ascii"), size,
+                                   len(columns[name])))
+        size += len(columns[name]) * columns[name].itemsize
+    return (_HEADER.pack(_MAGIC, len(COLUMNS)) + b"".join(entries), offsets,
+            max(size, 1))
+
+
+def publish(columns: Dict[str, array],
+            name: Optional[str] = None) -> shared_memory.SharedMemory:
+    """ Copies the <columns> into a new shared memory block, named <name> if
+        given, and returns it. Workers read it with attach; the publisher
+        must close and unlink it once they are done.
+    """
+    header, offsets, size = _layout(columns)
+    block = shared_memory.SharedMemory(name, create=True, size=size)
+    _PUBLISHED.add(block.name)
+    block.buf[:len(header)] = header
+    for (name, _), offset in zip(COLUMNS, offsets):
+        raw = memoryview(columns[name]).cast("B")
+        block.buf[offset:offset + len(raw)] = raw
+        raw.release()
+    return block
+
+
+def save(columns: Dict[str, array], path: str) -> None:
+    """ Writes the <columns> to the file at <path>, laid out exactly as in
+        a shared memory block, for load to map.
+    """
+    header, offsets, _ = _layout(columns)
+    with open(path, "wb") as f:
+        f.write(header)
+        for (name, _), offset in zip(COLUMNS, offsets):
+            _pad(f, offset)
+            columns[name].tofile(f)
+
+
+def _pad(f: BinaryIO, offset: int) -> None:
+    """ Writes zeros to <f> up to <offset>. """
+
+    f.write(bytes(offset - f.tell()))
+
+
+class Snapshot:
+    """ A read-only view of the columns of a dataset, laid out by publish or
+    save, in shared memory or in a memory-mapped file.
+
+    Opening a snapshot only reads its header, and columns are views into the
+    memory they are laid out in, so it takes the same time however big the
+    dataset is, and nothing is copied or unpickled. Strings are decoded as
+    they are asked for.
+
+    === Public Attributes ===
+    segment_count:
+        the number of flight segments.
+    trip_count:
+        the number of trips.
+    """
+    # === Private Attributes ===
+    # _owner:
+    #     the shared memory block or memory map holding the columns, closed
+    #     with this snapshot, if any.
+    # _buffer:
+    #     a read-only view of all of the columns.
+    # _columns:
+    #     a typed view of every column, indexed by name.
+    # _strings:
+    #     the strings decoded so far, indexed by code.
+
+    segment_count: int
+    trip_count: int
+    _owner: Optional[object]
+    _buffer: memoryview
+    _columns: Dict[str, memoryview]
+    _strings: Dict[int, str]
+
+    def __init__(self, buffer: object, owner: Optional[object] = None) \
+            -> None:
+        """ Initialize a Snapshot of the columns laid out in <buffer>, which
+            is closed (if it is a shared memory block or memory map) along
+            with this snapshot.
+        """
+        self._owner = owner
+        self._columns = {}
+        self._buffer = memoryview(buffer).toreadonly()
+        magic, count = _HEADER.unpack_from(self._buffer)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError("Not a dataset snapshot")
+        for i in range(count):
+            name, typecode, offset, length = _ENTRY.unpack_from(
+                self._buffer, _HEADER.size + i * _ENTRY.size)
+            typecode = typecode.decode("ascii")
+            self._columns[name.rstrip(b"\0").decode("ascii")] = \
+                self._buffer[offset:offset + length * array(typecode).itemsize
+                             ].cast(typecode)
+        self._strings = {}
+        self.segment_count = len(self._columns["seg_fid"])
+        self.trip_count = len(self._columns["trip_rid"])
+
+    def __enter__(self) -> Snapshot:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ Releases the views of this snapshot, and closes the memory they
+            are into. The columns can no longer be used afterwards.
+        """
+        for view in self._columns.values():
+            view.release()
+        self._columns = {}
+        self._buffer.release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def column(self, name: str) -> memoryview:
+        """ Returns the column <name>, one of COLUMNS, as a typed view. """
+
+        return self._columns[name]
+
+    def string(self, code: int) -> str:
+        """ Returns the string whose code is <code>. """
+
+        if code not in self._strings:
+            ends = self._columns["string_ends"]
+            start = ends[code - 1] if code else 0
+            self._strings[code] = str(
+                self._columns["strings"][start:ends[code]], "utf-8")
+        return self._strings[code]
+
+    def segment(self, row: int) -> Tuple[str, str, str, datetime.datetime,
+                                         datetime.datetime, float]:
+        """ Returns the flight ID, departure and arrival IATA, departure and
+            arrival times, and length of the flight segment in <row>.
+        """
+        c = self._columns
+        return (self.string(c["seg_fid"][row]), self.string(c["seg_dep"][row]),
+                self.string(c["seg_arr"][row]),
+                _moment(c["seg_dep_minute"][row]),
+                _moment(c["seg_arr_minute"][row]), c["seg_length"][row])
+
+    def manifest(self, row: int) -> List[Tuple[int, str]]:
+        """ Returns the (customer ID, seat type) pairs booked on the flight
+            segment in <row>.
+        """
+        c = self._columns
+        start, end = c["seg_manifest"][row], c["seg_manifest"][row + 1]
+        return [(c["man_cid"][i], self.string(c["man_seat"][i]))
+                for i in range(start, end)]
+
+    def trip(self, row: int) -> Tuple[str, int, datetime.date, float,
+                                      List[int]]:
+        """ Returns the reservation ID, customer ID, date and cost of the
+            trip in <row>, and the rows of its flight segments.
+        """
+        c = self._columns
+        start, end = c["trip_legs"][row], c["trip_legs"][row + 1]
+        return (self.string(c["trip_rid"][row]), c["trip_cid"][row],
+                datetime.date.fromordinal(c["trip_date"][row]),
+                c["trip_cost"][row], list(c["leg_segment"][start:end]))
+
+
+def attach(name: str) -> Snapshot:
+    """ Returns a Snapshot of the shared memory block <name>, made by
+        publish, closed along with it.
+    """
+    # An unrelated process would otherwise unlink the block on exit.
+    untrack = multiprocessing.parent_process() is None and \
+        name not in _PUBLISHED
+    if untrack and sys.version_info >= (3, 13):
+        block = shared_memory.SharedMemory(name, track=False)
+    else:
+        block = shared_memory.SharedMemory(name)
+        if untrack and os.name == "posix":
+            # The tracker knows POSIX blocks by their name with a leading /.
+            resource_tracker.unregister("/" + block.name, "shared_memory")
+    return Snapshot(block.buf, block)
+
+
+def load(path: str) -> Snapshot:
+    """ Returns a Snapshot of the file at <path>, written by save, mapped
+        into memory rather than read.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return Snapshot(mapped, mapped)
+
+
+def _run(name: str, func: Callable[[Snapshot, int, int], T], start: int,
+         stop: int) -> T:
+    """ Returns func(snapshot, <start>, <stop>) on the shared memory block
+        <name>, in a worker.
+    """
+    with attach(name) as snapshot:
+        return func(snapshot, start, stop)
+
+
+def map_rows(name: str, func: Callable[[Snapshot, int, int], T], rows: int,
+             workers: int = WORKERS) -> List[T]:
+    """ Splits <rows> rows into one range per worker, and returns the result
+        of func(snapshot, start, stop) on each, run in a pool of <workers>
+        processes which attach to the shared memory block <name>. The
+        <func> must be defined at the top level of a module.
+    """
+    bounds = [rows * n // workers for n in range(workers + 1)]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_run, [name] * workers, [func] * workers,
+                             bounds[:-1], bounds[1:]))
+
+
+def passengers_by_airport(snapshot: Snapshot, start: int,
+                          stop: int) -> Dict[str, int]:
+    """ Returns the number of seats booked on the flight segments in rows
+        <start> to <stop> of the <snapshot>, by departure airport.
+    """
+    deps = snapshot.column("seg_dep")
+    offsets = snapshot.column("seg_manifest")
+    counts = {}
+    for row in range(start, stop):
+        booked = offsets[row + 1] - offsets[row]
+        if booked:
+            counts[deps[row]] = counts.get(deps[row], 0) + booked
+    return {snapshot.string(dep): n for dep, n in counts.items()}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ Publishes a dataset, as asked by the command line arguments <argv>,
+        and counts its passengers by airport in worker processes.
+    """
+    import application
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data", default=application.DATA_DIR)
+    parser.add_argument("--dataset", choices=sorted(application.DATASETS),
+                        default="small")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--save", metavar="PATH",
+                        help="also write the snapshot to PATH")
+    args = parser.parse_args(argv)
+
+    seg_file, trip_file = application.DATASETS[args.dataset]
+    logs = application.import_data(
+        os.path.join(args.data, "airports.csv"),
+        os.path.join(args.data, "customers.csv"),
+        os.path.join(args.data, seg_file), os.path.join(args.data, trip_file))
+    application.create_airports(logs[0])
+    flights = application.create_flight_segments(logs[1])
+    customers = application.create_customers(logs[2])
+    trips = application.load_trips(logs[3], customers, flights)
+    segments = [seg for day in flights.values() for seg in day]
+    columns = build_columns(segments, trips, customers)
+    if args.save:
+        save(columns, args.save)
+    block = publish(columns)
+    try:
+        start = time.perf_counter()
+        attach(block.name).close()
+        print("Attached to {:.1f}MiB in {:.3f}ms".format(
+            block.size / 2 ** 20, (time.perf_counter() - start) * 1000))
+        start = time.perf_counter()
+        totals = {}
+        for counts in map_rows(block.name, passengers_by_airport,
+                               len(segments), args.workers):
+            for iata, n in counts.items():
+                totals[iata] = totals.get(iata, 0) + n
+        print("Counted {} passengers on {} workers in {:.3f}s".format(
+            sum(totals.values()), args.workers,
+            time.perf_counter() - start))
+    finally:
+        block.close()
+        block.unlink()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
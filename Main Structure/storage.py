@@ -0,0 +1,435 @@
+"""Defines SQLiteStore, a storage backend for datasets larger than memory"""
+from __future__ import annotations
+
+import csv
+import datetime
+import sqlite3
+import weakref
+from collections.abc import Sequence
+from itertools import groupby
+from typing import Iterable, List, Optional, Tuple, Union
+
+from application import book_itinerary, create_airports, \
+    create_flight_segments, parse_itinerary, resolve_itinerary
+from customer import CLASS_MULTIPLIER, Customer, discount_for_miles, \
+    segment_miles
+from filter import CustomerFilter, DateFilter, DurationFilter, Filter, \
+    LocationFilter, ResetFilter, TripFilter, parse_date_range
+from flight import FlightSegment, Trip
+
+SCHEMA = """
+CREATE TABLE airports (iata TEXT PRIMARY KEY, name TEXT, lon REAL, lat REAL);
+CREATE TABLE customers (cid INTEGER PRIMARY KEY, name TEXT, age INTEGER,
+                        nationality TEXT, seq INTEGER);
+CREATE TABLE segments (id INTEGER PRIMARY KEY, fid TEXT, dep TEXT, arr TEXT,
+                       date TEXT, dep_time TEXT, arr_time TEXT, length TEXT,
+                       duration REAL, dep_year INTEGER, dep_month INTEGER,
+                       dep_day INTEGER, arr_year INTEGER, arr_month INTEGER,
+                       arr_day INTEGER);
+CREATE INDEX segments_by_date ON segments (dep_year, dep_month, dep_day);
+CREATE INDEX segments_by_dep ON segments (dep);
+CREATE INDEX segments_by_arr ON segments (arr);
+CREATE TABLE bookings (segment_id INTEGER, cid INTEGER, seat TEXT);
+CREATE INDEX bookings_by_customer ON bookings (cid, segment_id);
+CREATE INDEX bookings_by_segment ON bookings (segment_id);
+CREATE TABLE trips (seq INTEGER PRIMARY KEY, rid TEXT, cid INTEGER,
+                    date TEXT, cost REAL, miles INTEGER);
+CREATE INDEX trips_by_reservation ON trips (rid);
+CREATE INDEX trips_by_customer ON trips (cid);
+CREATE TABLE trip_segments (trip_seq INTEGER, position INTEGER,
+                            segment_id INTEGER, seat TEXT,
+                            PRIMARY KEY (trip_seq, position));
+"""
+
+# CHUNK_SIZE: the number of rows read, built or written at a time.
+CHUNK_SIZE = 10000
+
+# SQL_FILTERS: the filters applied as SQL conditions; any other is applied
+#              in memory, to the segments the others leave.
+SQL_FILTERS = (CustomerFilter, DateFilter, DurationFilter, LocationFilter,
+               ResetFilter, TripFilter)
+
+
+class SQLiteStore:
+    """ The airports, customers, flight segments and trips of a dataset,
+        stored in an indexed SQLite database rather than in memory.
+
+    FlightSegments, Trips and Customers are only built when they are asked
+    for, and are kept only while they are in use elsewhere. Filters are
+    applied as SQL conditions, and give the same flight segments, in the same
+    order, as applying them to the segments of all trips in memory.
+
+    === Public Attributes ===
+    path:
+        the path of the SQLite database.
+    """
+    # === Private Attributes ===
+    # _db:
+    #     the connection to the database.
+    # _segments:
+    #     the FlightSegments built and still in use, indexed by their id.
+    # _customers:
+    #     the Customers built and still in use, indexed by their ID.
+
+    path: str
+    _db: sqlite3.Connection
+    _segments: weakref.WeakValueDictionary
+    _customers: weakref.WeakValueDictionary
+
+    def __init__(self, path: str) -> None:
+        """ Open the store in the database at <path>, built by build_store.
+        """
+
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._segments = weakref.WeakValueDictionary()
+        self._customers = weakref.WeakValueDictionary()
+        create_airports([[row[0], row[1], str(row[2]), str(row[3])] for row
+                         in self._db.execute("SELECT * FROM airports")])
+
+    def close(self) -> None:
+        """ Close the connection to the database. """
+
+        self._db.close()
+
+    def segments(self, ids: Iterable[int]) -> List[FlightSegment]:
+        """ Returns the FlightSegments with the given <ids>, in order, with
+            their manifests.
+        """
+        ids = list(ids)
+        found = {}
+        for sid in ids:
+            seg = self._segments.get(sid)
+            if seg is not None:
+                found[sid] = seg
+        missing = list({sid for sid in ids if sid not in found})
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = self._db.execute(
+                "SELECT id, fid, dep, arr, date, dep_time, arr_time, length "
+                "FROM segments WHERE id IN (" + marks + ") ORDER BY id",
+                chunk).fetchall()
+            built = _build_segments([list(row[1:]) for row in rows])
+            by_id = dict(zip([row[0] for row in rows], built))
+            for sid, cid, seat in self._db.execute(
+                    "SELECT segment_id, cid, seat FROM bookings WHERE "
+                    "segment_id IN (" + marks + ") ORDER BY rowid", chunk):
+                by_id[sid].book_seat(cid, seat)
+            self._segments.update(by_id)
+            found.update(by_id)
+        return [found[sid] for sid in ids]
+
+    def segments_on(self, day: datetime.date) -> List[FlightSegment]:
+        """ Returns the FlightSegments departing on <day>. """
+
+        return self.segments(self._day_ids(day))
+
+    def _day_ids(self, day: datetime.date) -> List[int]:
+        """ Returns the ids of the flight segments departing on <day>. """
+
+        return [row[0] for row in self._db.execute(
+            "SELECT id FROM segments WHERE dep_year = ? AND dep_month = ? "
+            "AND dep_day = ? ORDER BY id", (day.year, day.month, day.day))]
+
+    def customer_ids(self) -> List[int]:
+        """ Returns the IDs of all customers, in the order of the dataset. """
+
+        return [row[0] for row in
+                self._db.execute("SELECT cid FROM customers ORDER BY seq")]
+
+    def customer(self, cid: int) -> Optional[Customer]:
+        """ Returns the Customer with ID <cid>, with all their trips booked,
+            or None if there is no such customer.
+        """
+        # The customer may be collected at any time, so it is only looked
+        # up once.
+        customer = self._customers.get(cid)
+        if customer is not None:
+            return customer
+        row = self._db.execute("SELECT name, age, nationality FROM customers"
+                               " WHERE cid = ?", (cid,)).fetchone()
+        if row is None:
+            return None
+        customer = Customer(cid, row[0], row[1], row[2])
+        trips = self._db.execute("SELECT seq, rid, date, cost, miles FROM "
+                                 "trips WHERE cid = ? ORDER BY seq",
+                                 (cid,)).fetchall()
+        for seq, rid, date, cost, miles in trips:
+            legs = self._db.execute(
+                "SELECT segment_id, seat FROM trip_segments WHERE trip_seq = ?"
+                " ORDER BY position", (seq,)).fetchall()
+            segments = self.segments(leg[0] for leg in legs)
+            trip_date = datetime.date.fromisoformat(date)
+            trip = customer.book_trip(
+                rid, list(zip(segments, [leg[1] for leg in legs])),
+                trip_date, deferred=True)
+            customer.set_cost_of_trip(trip, cost)
+            customer.record_miles(trip_date, miles)
+        self._customers[cid] = customer
+        return customer
+
+    def trip(self, reservation_id: str) -> Optional[Trip]:
+        """ Returns the Trip with <reservation_id>, or None if there is none.
+            If several trips share it, the one a TripFilter would find is
+            returned.
+        """
+        row = self._trip_row(reservation_id)
+        if row is None:
+            return None
+        return self.customer(row[1]).get_trip(reservation_id)
+
+    def apply(self, filters: List[Tuple[Filter, str]]) -> List[FlightSegment]:
+        """ Returns the flight segments of all trips which remain after
+            applying each (Filter, filter_string) pair of <filters> in turn,
+            as the Filters would in memory.
+
+            Filters with no SQL form (those not in SQL_FILTERS) are applied
+            in memory, after the others, to the segments they leave. The
+            customers they are given are only built as the filters read them.
+        """
+        conditions, params, trip_seqs, in_memory = [], [], [], []
+        for f, filter_string in filters:
+            if not isinstance(f, SQL_FILTERS):
+                in_memory.append((f, filter_string))
+            elif isinstance(f, TripFilter):
+                row = self._trip_row(filter_string)
+                if row is not None:
+                    trip_seqs.append(row[0])
+            else:
+                condition = self._condition(f, filter_string)
+                if condition is not None:
+                    conditions.append(condition[0])
+                    params.extend(condition[1])
+
+        if trip_seqs:
+            # A trip filter keeps its trip's segments, in itinerary order.
+            conditions.append("ts.trip_seq = ?")
+            params.append(trip_seqs[-1])
+            for seq in trip_seqs[:-1]:
+                conditions.append("s.id IN (SELECT segment_id FROM "
+                                  "trip_segments WHERE trip_seq = ?)")
+                params.append(seq)
+        where = " AND ".join(conditions) if conditions else "1"
+        ids = [row[0] for row in self._db.execute(
+            "SELECT ts.segment_id FROM trip_segments ts JOIN segments s "
+            "ON s.id = ts.segment_id WHERE " + where +
+            " ORDER BY ts.trip_seq, ts.position", params)]
+        result = self.segments(ids)
+        if in_memory:
+            customers = StoredCustomers(self)
+            for f, filter_string in in_memory:
+                result = f.apply(customers, result, filter_string)
+        return result
+
+    def _condition(self, f: Filter, filter_string: str) \
+            -> Optional[Tuple[str, List]]:
+        """ Returns the SQL condition on a segment <s> applied by the filter
+            <f> with <filter_string>, and its parameters, or None if the
+            filter has no effect.
+
+            Precondition: <f> is one of the SQL_FILTERS, other than a
+                          TripFilter.
+        """
+        if isinstance(f, ResetFilter):
+            return None
+        if isinstance(f, CustomerFilter):
+            try:
+                cid = int(filter_string)
+            except ValueError:
+                return None
+            if self._db.execute("SELECT 1 FROM customers WHERE cid = ?",
+                                (cid,)).fetchone() is None:
+                return None
+            return ("EXISTS (SELECT 1 FROM bookings b WHERE "
+                    "b.segment_id = s.id AND b.cid = ?)", [cid])
+        if isinstance(f, DurationFilter):
+            if len(filter_string) < 2 or filter_string[0] not in ('L', 'G') \
+                    or not filter_string[1:].isdigit():
+                return None
+            op = "<" if filter_string[0] == 'L' else ">"
+            return "s.duration " + op + " ?", [int(filter_string[1:])]
+        if isinstance(f, LocationFilter):
+            if len(filter_string) != 3:
+                return None
+            return "(s.dep = ? OR s.arr = ?)", [filter_string, filter_string]
+        if isinstance(f, DateFilter):
+            date_range = parse_date_range(filter_string)
+            if date_range is None:
+                return None
+            return ("(s.dep_year, s.dep_month, s.dep_day) >= (?, ?, ?) AND "
+                    "(s.arr_year, s.arr_month, s.arr_day) <= (?, ?, ?)",
+                    list(date_range[0] + date_range[1]))
+        return None
+
+    def _trip_row(self, reservation_id: str) -> Optional[Tuple[int, int]]:
+        """ Returns the (seq, cid) of the trip with <reservation_id> found
+            first in customer order, as a TripFilter would, or None.
+        """
+        return self._db.execute(
+            "SELECT t.seq, t.cid FROM trips t JOIN customers c "
+            "ON c.cid = t.cid WHERE t.rid = ? ORDER BY c.seq, t.seq LIMIT 1",
+            (reservation_id,)).fetchone()
+
+    def load_trips(self, rows: Iterable[List[str]]) -> None:
+        """ Books, prices and stores the trip <rows> into the database, one
+            day of trips at a time, and commits them.
+
+            Precondition: the trips are in order of date, as in the dataset.
+        """
+        db = self._db
+        miles = {}
+        seq = db.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM trips").fetchone()[0]
+        for date, day_rows in groupby(rows, key=lambda r: r[2]):
+            trip_date = datetime.date(*map(int, date.split("-")))
+            day_ids = self._day_ids(trip_date)
+            day_segments = self.segments(day_ids)
+            ids = dict(zip(day_segments, day_ids))
+            trips, legs = [], []
+            for row in day_rows:
+                cid = int(row[1])
+                segments = resolve_itinerary(parse_itinerary(row[3:]),
+                                             day_segments)
+                if not segments or not book_itinerary(cid, segments):
+                    continue
+                total, peak = miles.get(cid, (0, 0))
+                fares = [seg.get_length() * seg.get_base_fare_cost()
+                         * CLASS_MULTIPLIER[seat_type] for seg, seat_type in
+                         segments]
+                cost = sum(fares) * (100 + discount_for_miles(peak)) / 100
+                earned = sum(segment_miles(seg, seat_type)
+                             for seg, seat_type in segments)
+                miles[cid] = (total + earned, max(peak, total + earned))
+                seq += 1
+                trips.append((seq, row[0], cid, trip_date.isoformat(), cost,
+                              earned))
+                legs.extend((seq, i, ids[seg], seat_type)
+                            for i, (seg, seat_type) in enumerate(segments))
+            db.executemany("INSERT INTO trips VALUES (?, ?, ?, ?, ?, ?)",
+                           trips)
+            db.executemany("INSERT INTO trip_segments VALUES (?, ?, ?, ?)",
+                           legs)
+            db.executemany("DELETE FROM bookings WHERE segment_id = ?",
+                           [(sid,) for sid in day_ids])
+            db.executemany("INSERT INTO bookings VALUES (?, ?, ?)",
+                           [(ids[seg], cid, seat_type) for seg in day_segments
+                            for cid, seat_type in seg.get_manifest()])
+        db.commit()
+
+
+class StoredCustomers(Sequence):
+    """ The customers of a SQLiteStore, in the order of the dataset, each
+    built only when it is read, so a filter applied in memory builds only the
+    customers it looks at.
+    """
+    # === Private Attributes ===
+    # _store:
+    #     the store holding the customers.
+    # _ids:
+    #     the ID of every customer, in order.
+
+    _store: SQLiteStore
+    _ids: List[int]
+
+    def __init__(self, store: SQLiteStore) -> None:
+        """ Initialize the sequence of the customers in <store>. """
+
+        self._store = store
+        self._ids = store.customer_ids()
+
+    def __getitem__(self, i: Union[int, slice]) \
+            -> Union[Customer, List[Customer]]:
+        if isinstance(i, slice):
+            return [self._store.customer(cid) for cid in self._ids[i]]
+        return self._store.customer(self._ids[i])
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+def _build_segments(rows: List[List[str]]) -> List[FlightSegment]:
+    """ Returns the FlightSegments of the segment <rows>, in the same order.
+    """
+    by_date = create_flight_segments(rows)
+    taken = {}
+    segments = []
+    for row in rows:
+        day = datetime.date(*map(int, row[3].split(":")))
+        i = taken.get(day, 0)
+        segments.append(by_date[day][i])
+        taken[day] = i + 1
+    return segments
+
+
+def _chunks(rows: Iterable[List[str]]) -> Iterable[List[List[str]]]:
+    """ Yields the <rows> in lists of CHUNK_SIZE rows. """
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def build_store(path: str, file_airports: str, file_customers: str,
+                file_segments: str, file_trips: str) -> SQLiteStore:
+    """ Loads the dataset in the given CSV files into a new SQLite database
+        at <path>, and returns the store opened on it.
+
+        Trips are booked, priced and given their miles exactly as load_trips
+        and a FareEngine would, one day of trips at a time, so at most one
+        day of flight segments is held in memory.
+
+        Precondition: the trips are in order of date, as in the dataset.
+    """
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    with open(file_airports) as f:
+        rows = list(csv.reader(f))
+    create_airports(rows)
+    db.executemany("INSERT INTO airports VALUES (?, ?, ?, ?)",
+                   [(r[0], r[1], float(r[2]), float(r[3])) for r in rows])
+
+    with open(file_customers) as f:
+        db.executemany("INSERT INTO customers VALUES (?, ?, ?, ?, ?)",
+                       ((int(r[0]), r[1], int(r[2]), r[3], i)
+                        for i, r in enumerate(csv.reader(f))))
+
+    with open(file_segments) as f:
+        for chunk in _chunks(csv.reader(f)):
+            db.executemany(
+                "INSERT INTO segments (fid, dep, arr, date, dep_time, "
+                "arr_time, length, duration, dep_year, dep_month, dep_day, "
+                "arr_year, arr_month, arr_day) VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row + [seg.get_duration().total_seconds() / 60,
+                        dep.year, dep.month, dep.day,
+                        arr.year, arr.month, arr.day]
+                 for row, seg, (dep, arr) in zip(
+                     chunk, *zip(*[(seg, seg.get_times())
+                                   for seg in _build_segments(chunk)]))])
+    db.commit()
+    db.close()
+
+    store = SQLiteStore(path)
+    with open(file_trips) as f:
+        store.load_trips(csv.reader(f))
+    return store
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'csv', 'datetime', 'sqlite3',
+            'weakref', 'collections.abc', 'itertools', 'application', 'customer', 'filter',
+            'flight', '__future__'
+        ],
+        'allowed-io': ['build_store'],
+        'max-locals': 25
+    })
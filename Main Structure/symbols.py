@@ -0,0 +1,83 @@
+"""Defines the SymbolTable, which interns the strings and small values
+repeated across a dataset so that every object holding one shares a copy"""
+from typing import Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T", bound=Hashable)
+
+# SYMBOL_CAPACITY: the number of values a SymbolTable holds before it is
+#                  emptied. A full dataset interns a few thousand.
+SYMBOL_CAPACITY = 1 << 16
+
+
+class SymbolTable:
+    """ A table of interned values: IATA codes, flight IDs, seat classes,
+    dates, durations and the like, which a dataset repeats thousands of
+    times.
+
+    Interning a value returns the copy already in the table, if an equal one
+    of the same type was interned before, so the duplicate read from a file
+    can be freed. Values of different types are kept apart, so a length of
+    100000.0 km never comes back as the customer ID 100000.
+
+    The table is shared by long-running services that keep interning the
+    dates and IDs of new bookings, so it is emptied whenever it reaches its
+    capacity. Objects already holding an interned value keep it; only
+    values interned afterwards stop sharing a copy with them.
+
+    >>> table = SymbolTable(capacity=3)
+    >>> a = table.intern("".join(["YY", "Z"]))
+    >>> b = table.intern("".join(["Y", "YZ"]))
+    >>> a is b, len(table)
+    (True, 1)
+    >>> table.intern(100000), table.intern(100000.0)
+    (100000, 100000.0)
+    >>> _ = table.intern("YVR")
+    >>> len(table)
+    1
+
+    === Public Attributes ===
+    capacity:
+        the number of values this table holds before it is emptied.
+    """
+    # === Private Attributes ===
+    # _symbols:
+    #     every value interned, indexed by its type and itself.
+
+    capacity: int
+    _symbols: Dict[Tuple[type, Hashable], Hashable]
+
+    def __init__(self, capacity: int = SYMBOL_CAPACITY) -> None:
+        """ Initialize an empty SymbolTable holding up to <capacity> values.
+        """
+
+        self.capacity = capacity
+        self._symbols = {}
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def intern(self, value: T) -> T:
+        """ Returns the interned copy of <value>, adding it to this table if
+            no equal value is in it yet.
+        """
+        key = (type(value), value)
+        symbol = self._symbols.get(key)
+        if symbol is None:
+            if len(self._symbols) >= self.capacity:
+                self._symbols.clear()
+            symbol = self._symbols[key] = value
+        return symbol
+
+
+# SYMBOLS: the symbol table shared by every dataset loaded.
+SYMBOLS = SymbolTable()
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest'
+        ]
+    })
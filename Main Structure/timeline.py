@@ -0,0 +1,218 @@
+"""Defines the Timeline, which finds the flight segments in the air at any
+minute of a schedule, for playing it back"""
+from __future__ import annotations
+
+import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from flight import FlightSegment
+
+# CHECKPOINT: the minutes between the active sets precomputed by a Timeline;
+#             a seek never replays more than this many minutes of events.
+CHECKPOINT = 60
+
+
+def minute_of(moment: datetime.datetime) -> int:
+    """ Returns the number of minutes from 0001-01-01 to <moment>.
+
+    >>> minute_of(datetime.datetime(1, 1, 2, 1, 5))
+    1505
+    """
+    return ((moment.toordinal() - 1) * 24 + moment.hour) * 60 + moment.minute
+
+
+def moment_of(minute: int) -> datetime.datetime:
+    """ Returns the moment <minute> minutes after 0001-01-01.
+
+    >>> moment_of(1505)
+    datetime.datetime(1, 1, 2, 1, 5)
+    """
+    return datetime.datetime.min + datetime.timedelta(minutes=minute)
+
+
+def _span(segment: FlightSegment) -> Tuple[int, int]:
+    """ Returns the minutes the <segment> takes off and lands. A segment
+        whose arrival time is before its departure time lands on the next
+        day.
+    """
+    dep, arr = segment.get_times()
+    start = minute_of(dep)
+    return start, start + (minute_of(arr) - start) % (24 * 60)
+
+
+class Timeline:
+    """ The flight segments of a schedule, indexed by the minutes they take
+    off and land, so that those in the air at any minute are found without
+    looking at the rest.
+
+    A segment is in the air from the minute it takes off up to, but not
+    including, the minute it lands. Every minute has a bucket of the
+    segments taking off and one of those landing then; the active set is
+    kept for the current minute, and moving to a nearby minute only applies
+    (or, going back, undoes) the buckets in between. The active set is also
+    precomputed every CHECKPOINT minutes, so a seek to any minute, however
+    far, starts from the checkpoint before it and replays under CHECKPOINT
+    minutes of buckets.
+
+    >>> from application import flight_segment
+    >>> def seg(fid, dep, arr):
+    ...     return flight_segment(fid, "YYZ", "YVR",
+    ...         datetime.datetime(2019, 1, 1, *dep),
+    ...         datetime.datetime(2019, 1, 1, *arr), 3350.0)
+    >>> t = Timeline([seg("A1", (8, 0), (12, 0)), seg("B2", (11, 0), (13, 30)),
+    ...               seg("C3", (23, 0), (2, 0))])
+    >>> [s.get_fid() for s in t.seek_to(datetime.datetime(2019, 1, 1, 11))]
+    ['A1', 'B2']
+    >>> [s.get_fid() for s in t.seek(t.now() + 60)]
+    ['B2']
+    >>> [s.get_fid() for s in t.seek_to(datetime.datetime(2019, 1, 2, 1))]
+    ['C3']
+    >>> t.progress(t.active()[0])
+    0.6666666666666666
+    >>> [s.get_fid() for s in t.seek(t.start)]
+    ['A1']
+
+    === Public Attributes ===
+    start:
+        the minute the first segment takes off.
+    end:
+        the minute the last segment lands.
+    """
+    # === Private Attributes ===
+    # _spans:
+    #     the minutes each segment takes off and lands, indexed by its id.
+    # _starts:
+    #     the segments taking off at each minute.
+    # _ends:
+    #     the segments landing at each minute.
+    # _checkpoints:
+    #     the segments in the air at start and every CHECKPOINT minutes
+    #     after it.
+    # _now:
+    #     the minute of _active.
+    # _active:
+    #     the segments in the air at _now, indexed by their id, in the order
+    #     they took off.
+
+    start: int
+    end: int
+    _spans: Dict[int, Tuple[int, int]]
+    _starts: Dict[int, List[FlightSegment]]
+    _ends: Dict[int, List[FlightSegment]]
+    _checkpoints: List[Tuple[FlightSegment, ...]]
+    _now: int
+    _active: Dict[int, FlightSegment]
+
+    def __init__(self, segments: Iterable[FlightSegment]) -> None:
+        """ Initialize a Timeline of the flight <segments>, each played
+            once however many times it is given, at the minute its first
+            segment takes off.
+        """
+        self._spans = {}
+        self._starts = {}
+        self._ends = {}
+        for seg in segments:
+            if id(seg) in self._spans:
+                continue
+            dep, arr = _span(seg)
+            self._spans[id(seg)] = (dep, arr)
+            if dep < arr:
+                self._starts.setdefault(dep, []).append(seg)
+                self._ends.setdefault(arr, []).append(seg)
+        for bucket in self._starts.values():
+            bucket.sort(key=lambda s: self._spans[id(s)])
+
+        self.start = min(self._starts, default=0)
+        self.end = max(self._ends, default=self.start)
+        self._now = self.start
+        self._active = {id(s): s for s in self._starts.get(self.start, ())}
+        self._checkpoints = []
+        for minute in range(self.start, self.end + 1, CHECKPOINT):
+            self._forward(minute)
+            self._checkpoints.append(tuple(self._active.values()))
+        self.seek(self.start)
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+    def now(self) -> int:
+        """ Returns the minute of the active set. """
+        return self._now
+
+    def active(self) -> List[FlightSegment]:
+        """ Returns the segments in the air at the current minute, in the
+            order they took off.
+        """
+        return list(self._active.values())
+
+    def seek(self, minute: int) -> List[FlightSegment]:
+        """ Moves to <minute>, kept from start to end, and returns the
+            segments in the air then, in the order they took off.
+        """
+        minute = min(max(minute, self.start), self.end)
+        if not -CHECKPOINT <= minute - self._now <= CHECKPOINT:
+            index = (minute - self.start) // CHECKPOINT
+            self._now = self.start + index * CHECKPOINT
+            self._active = {id(s): s for s in self._checkpoints[index]}
+        if minute >= self._now:
+            self._forward(minute)
+        else:
+            self._back(minute)
+        return self.active()
+
+    def seek_to(self, moment: datetime.datetime) -> List[FlightSegment]:
+        """ Moves to the minute of <moment>, as seek does. """
+        return self.seek(minute_of(moment))
+
+    def _forward(self, minute: int) -> None:
+        """ Applies the buckets after the current minute up to <minute>. """
+        active = self._active
+        for now in range(self._now + 1, minute + 1):
+            for seg in self._ends.get(now, ()):
+                del active[id(seg)]
+            for seg in self._starts.get(now, ()):
+                active[id(seg)] = seg
+        self._now = max(self._now, minute)
+
+    def _back(self, minute: int) -> None:
+        """ Undoes the buckets from the current minute down to, but not
+            including, <minute>. Segments put back in the air are reordered
+            by when they took off.
+        """
+        active = self._active
+        landed = False
+        for now in range(self._now, minute, -1):
+            for seg in self._ends.get(now, ()):
+                active[id(seg)] = seg
+                landed = True
+            for seg in self._starts.get(now, ()):
+                del active[id(seg)]
+        if landed:
+            self._active = {id(s): s for s in sorted(
+                active.values(), key=lambda s: self._spans[id(s)])}
+        self._now = minute
+
+    def progress(self, segment: FlightSegment) -> float:
+        """ Returns how much of the <segment>'s flight is done at the current
+            minute, from 0.0 to 1.0.
+        """
+        dep, arr = self._spans[id(segment)]
+        if arr <= dep:
+            return 1.0
+        return min(max((self._now - dep) / (arr - dep), 0.0), 1.0)
+
+    def count_active(self) -> int:
+        """ Returns the number of segments in the air at the current minute.
+        """
+        return len(self._active)
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'datetime', 'flight',
+            '__future__'
+        ]
+    })
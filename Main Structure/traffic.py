@@ -0,0 +1,245 @@
+"""Defines TrafficStats, the airport traffic, route passenger and load factor
+rollups of a set of FlightSegments, kept up to date as seats are booked"""
+from __future__ import annotations
+
+import datetime
+import heapq
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from flight import FlightSegment
+
+# A route: (departure IATA, arrival IATA).
+Route = Tuple[str, str]
+
+# LOCK_STRIPES: the number of locks shared by the booking counters of all
+#               routes, as in booking.BookingService.
+LOCK_STRIPES = 512
+
+
+class TrafficStats:
+    """ The departures and arrivals of every airport on every day, the
+    passengers flown on every route, and the load factor of every seat class,
+    of the FlightSegments added to it.
+
+    The rollups are built in one grouped pass over the segments added, which
+    then report every seat booked, changed or cancelled on them, so each
+    booking updates them in O(1) and queries never scan the segments.
+
+    Routes share a fixed number of locks, picked by the route, so bookings
+    on different routes rarely wait for one another. Each lock has its own
+    counters of the seats booked in each class, which are summed when asked
+    for.
+
+    Load factors are seats booked over seats offered; passengers count the
+    seats booked on a route, so a customer on two flights of the same route
+    counts twice.
+    """
+    # === Private Attributes ===
+    # _departures, _arrivals:
+    #     the number of flight segments departing from or arriving at an
+    #     airport on a day, indexed by (IATA, date).
+    # _airport_totals:
+    #     the number of departures plus arrivals of an airport on all days,
+    #     indexed by IATA.
+    # _by_day:
+    #     the number of departures plus arrivals of every airport on a day,
+    #     indexed by date, then IATA.
+    # _passengers:
+    #     the number of seats booked on every route.
+    # _booked, _capacity:
+    #     the number of seats booked and offered on every route, in every
+    #     seat class, indexed by (route, seat type).
+    # _class_booked:
+    #     the number of seats booked in every seat class on the routes of
+    #     each lock, indexed by seat type.
+    # _class_capacity:
+    #     the number of seats offered in every seat class over all routes,
+    #     indexed by seat type.
+    # _locks:
+    #     the locks guarding the booking counters of the routes, as seats on
+    #     different flight segments may be booked at the same time.
+    # _add_lock:
+    #     guards the counters of airports, days and seats offered, which
+    #     only change as segments are added.
+
+    _departures: Dict[Tuple[str, datetime.date], int]
+    _arrivals: Dict[Tuple[str, datetime.date], int]
+    _airport_totals: Dict[str, int]
+    _by_day: Dict[datetime.date, Dict[str, int]]
+    _passengers: Dict[Route, int]
+    _booked: Dict[Tuple[Route, str], int]
+    _capacity: Dict[Tuple[Route, str], int]
+    _class_booked: List[Dict[str, int]]
+    _class_capacity: Dict[str, int]
+    _locks: List[threading.Lock]
+    _add_lock: threading.Lock
+
+    def __init__(self, segments: Iterable[FlightSegment] = (),
+                 stripes: int = LOCK_STRIPES) -> None:
+        """ Initialize the TrafficStats of the flight <segments>, with
+            <stripes> locks for routes.
+        """
+
+        self._departures = {}
+        self._arrivals = {}
+        self._airport_totals = {}
+        self._by_day = {}
+        self._passengers = {}
+        self._booked = {}
+        self._capacity = {}
+        self._class_booked = [{} for _ in range(stripes)]
+        self._class_capacity = {}
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._add_lock = threading.Lock()
+        self.add_segments(segments)
+
+    def add_segments(self, segments: Iterable[FlightSegment]) -> int:
+        """ Adds the flight <segments>, with the seats already booked on
+            them, to these rollups in one pass, and returns how many were
+            added. From now on, the segments report every change to their
+            bookings.
+
+            Precondition:
+            - none of the <segments> has been added before.
+        """
+        count = 0
+        with self._add_lock:
+            for seg in segments:
+                dep, arr = seg.get_dep(), seg.get_arr()
+                dep_time, arr_time = seg.get_times()
+                key = (dep, dep_time.date())
+                self._departures[key] = self._departures.get(key, 0) + 1
+                key = (arr, arr_time.date())
+                self._arrivals[key] = self._arrivals.get(key, 0) + 1
+                for iata, day in ((dep, dep_time.date()),
+                                  (arr, arr_time.date())):
+                    self._airport_totals[iata] = \
+                        self._airport_totals.get(iata, 0) + 1
+                    on_day = self._by_day.setdefault(day, {})
+                    on_day[iata] = on_day.get(iata, 0) + 1
+
+                route = (dep, arr)
+                stripe = self._stripe(route)
+                with self._locks[stripe]:
+                    class_booked = self._class_booked[stripe]
+                    for seat_type, capacity in seg.seat_capacity.items():
+                        booked = capacity - seg.seat_availability[seat_type]
+                        key = (route, seat_type)
+                        self._capacity[key] = \
+                            self._capacity.get(key, 0) + capacity
+                        self._booked[key] = self._booked.get(key, 0) + booked
+                        self._class_capacity[seat_type] = \
+                            self._class_capacity.get(seat_type, 0) + capacity
+                        class_booked[seat_type] = \
+                            class_booked.get(seat_type, 0) + booked
+                        self._passengers[route] = \
+                            self._passengers.get(route, 0) + booked
+                    seg.set_traffic(self)
+                count += 1
+        return count
+
+    def _stripe(self, route: Route) -> int:
+        """ Returns the index of the lock guarding <route>. """
+
+        return hash(route) % len(self._locks)
+
+    def seat_moved(self, segment: FlightSegment, old: Optional[str],
+                   new: Optional[str]) -> None:
+        """ Records that a seat on <segment> moved from the seat class <old>
+            to <new>: a new booking if <old> is None, or a cancellation if
+            <new> is None.
+        """
+        route = (segment.get_dep(), segment.get_arr())
+        stripe = self._stripe(route)
+        with self._locks[stripe]:
+            class_booked = self._class_booked[stripe]
+            if old is not None:
+                self._booked[(route, old)] -= 1
+                class_booked[old] -= 1
+                self._passengers[route] -= 1
+            if new is not None:
+                self._booked[(route, new)] += 1
+                class_booked[new] += 1
+                self._passengers[route] += 1
+
+    def airport_traffic(self, iata: str, day: datetime.date) -> Tuple[int, int]:
+        """ Returns the number of flight segments departing from and arriving
+            at the airport <iata> on <day>.
+        """
+        return (self._departures.get((iata, day), 0),
+                self._arrivals.get((iata, day), 0))
+
+    def busiest_airports(self, n: int = 10,
+                         day: Optional[datetime.date] = None) \
+            -> List[Tuple[str, int]]:
+        """ Returns the <n> airports with the most departures plus arrivals
+            on <day> (or on all days, if it is None), busiest first, as
+            (IATA, flight segments) pairs.
+        """
+        if day is None:
+            totals = self._airport_totals
+        else:
+            totals = self._by_day.get(day, {})
+        return heapq.nlargest(n, totals.items(), key=lambda kv: (kv[1], kv[0]))
+
+    def route_passengers(self, dep: str, arr: str) -> int:
+        """ Returns the number of seats booked on flights from <dep> to
+            <arr>.
+        """
+        return self._passengers.get((dep, arr), 0)
+
+    def busiest_routes(self, n: int = 10) -> List[Tuple[Route, int]]:
+        """ Returns the <n> routes with the most passengers, busiest first,
+            as (route, passengers) pairs.
+        """
+        return heapq.nlargest(n, self._passengers.items(),
+                              key=lambda kv: (kv[1], kv[0]))
+
+    def load_factor(self, seat_type: Optional[str] = None,
+                    route: Optional[Route] = None) -> float:
+        """ Returns the share of the seats offered that are booked, in the
+            seat class <seat_type> on the <route>, or in all seat classes or
+            on all routes if they are None. Returns 0.0 if no seats are
+            offered.
+        """
+        if route is None:
+            if seat_type is None:
+                booked = sum(sum(counts.values())
+                             for counts in self._class_booked)
+                capacity = sum(self._class_capacity.values())
+            else:
+                booked = sum(counts.get(seat_type, 0)
+                             for counts in self._class_booked)
+                capacity = self._class_capacity.get(seat_type, 0)
+        elif seat_type is None:
+            keys = [(route, seat) for seat in self._class_capacity]
+            booked = sum(self._booked.get(key, 0) for key in keys)
+            capacity = sum(self._capacity.get(key, 0) for key in keys)
+        else:
+            booked = self._booked.get((route, seat_type), 0)
+            capacity = self._capacity.get((route, seat_type), 0)
+        return booked / capacity if capacity else 0.0
+
+    def load_factors(self) -> Dict[str, float]:
+        """ Returns the load factor of every seat class, over all routes. """
+
+        return {seat_type: self.load_factor(seat_type)
+                for seat_type in self._class_capacity}
+
+    def count_segments(self) -> int:
+        """ Returns the number of flight segments in these rollups. """
+
+        return sum(self._departures.values())
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'doctest', 'datetime', 'heapq',
+            'threading', 'flight', '__future__'
+        ],
+        'max-attributes': 11
+    })
@@ -2,16 +2,19 @@
 import math
 import os
 import threading
-import time
 from tkinter import *
-from typing import List, Tuple, Any, Union, Callable
+from typing import Dict, List, Optional, Tuple, Any, Union, Callable
 
 import pygame
 
 from customer import Customer
+from dataset import LazySegments
 from filter import CustomerFilter, DateFilter, DurationFilter
 from filter import LocationFilter, ResetFilter, TripFilter
 from flight import FlightSegment
+from heatmap import Heatmap
+from timeline import Timeline, moment_of
+import instrument
 
 """ ======================== Module Description ================================
 
@@ -27,7 +30,16 @@ from flight import FlightSegment
 """
 
 LINE_COLOUR = (0, 64, 125)
+PLANE_COLOUR = (200, 30, 30)
 WHITE = (255, 255, 255)
+GREY = (125, 125, 125)
+
+# Frames drawn per second during timeline playback
+FPS = 60
+# Minutes of the schedule played back per second, at first
+PLAYBACK_SPEED = 30
+# Minutes skipped by each scrub of the timeline
+SCRUB_MINUTES = 60
 
 # Map's Top-Left Coordinates (long, lat)
 MAP_MIN = (-180.0, 90.0)
@@ -53,12 +65,26 @@ class Visualizer:
     #   on the PyGame window.
     # _map: the Map object responsible for converting between longitude/latitude
     #   coordinates and the pixels of the visualization window.
+    # _heat: whether the segments are drawn as a density heatmap, rather
+    #   than line by line.
+    # _timeline: the Timeline of the segments being played back, or None if
+    #   the segments are drawn all at once.
+    # _minute: the minute of the schedule being played back.
+    # _speed: the minutes of the schedule played back per second; 0 if paused.
+    # _clock: keeps playback to FPS frames per second.
+    # _font: the font of the sidebar.
     r: Tk
     _ui_screen: pygame.Surface
     _screen: pygame.Surface
     _mouse_down: bool
     _map: 'Map'
     _quit: bool
+    _heat: bool
+    _timeline: Optional[Timeline]
+    _minute: float
+    _speed: float
+    _clock: pygame.time.Clock
+    _font: pygame.font.Font
 
     def __init__(self) -> None:
         """ Initialize this visualizer. """
@@ -74,7 +100,7 @@ class Visualizer:
                                                   pygame.DOUBLEBUF)
 
         # Add the text along the side, displaying the command keys for filters
-        self._ui_screen.fill((125, 125, 125))
+        self._ui_screen.fill(GREY)
         font = pygame.font.SysFont(None, 25)
         self._ui_screen.blit(font.render("FILTER KEYBINDS", True, WHITE),
                              (SCREEN_SIZE[0] + 10, 50))
@@ -89,6 +115,17 @@ class Visualizer:
         self._ui_screen.blit(font.render("Y: Date", True, WHITE),
                              (SCREEN_SIZE[0] + 10, 300))
 
+        self._ui_screen.blit(font.render("H: Heatmap", True, WHITE),
+                             (SCREEN_SIZE[0] + 10, 325))
+        self._ui_screen.blit(font.render("P: Play Timeline", True, WHITE),
+                             (SCREEN_SIZE[0] + 10, 350))
+        self._ui_screen.blit(font.render("Space: Pause", True, WHITE),
+                             (SCREEN_SIZE[0] + 10, 375))
+        self._ui_screen.blit(font.render("Left/Right: Scrub", True, WHITE),
+                             (SCREEN_SIZE[0] + 10, 400))
+        self._ui_screen.blit(font.render("Up/Down: Speed", True, WHITE),
+                             (SCREEN_SIZE[0] + 10, 425))
+
         self._ui_screen.blit(font.render("S: Summary of Trip", True, WHITE),
                              (SCREEN_SIZE[0] + 10, 500))
 
@@ -101,23 +138,81 @@ class Visualizer:
         self._screen.fill(WHITE)
         self._mouse_down = False
         self._map = Map(SCREEN_SIZE)
+        self._heat = False
+        self._timeline = None
+        self._minute = 0
+        self._speed = PLAYBACK_SPEED
+        self._clock = pygame.time.Clock()
+        self._font = font
 
         # Initial render
         self.draw([])
         self._quit = False
 
     def draw(self, long_lats: List[FlightSegment]) -> None:
-        """ Render the <long_lats> to the screen. """
+        """ Render the <long_lats> to the screen, or, while the timeline is
+            played back, the next frame of it.
+        """
+        if self._timeline is not None:
+            self._draw_frame()
+            return
 
-        # Draw the background map onto the screen
-        self._screen.fill(WHITE)
-        self._screen.blit(self._map.get_current_view(), (0, 0))
+        with instrument.span("render"):
+            # Draw the background map onto the screen
+            self._screen.fill(WHITE)
+            self._screen.blit(self._map.get_current_view(), (0, 0))
 
-        # Add all of the objects onto the screen
-        self._map.render_objects(long_lats, self._screen)
+            # Add all of the objects onto the screen
+            if self._heat:
+                self._map.render_heatmap(long_lats, self._screen)
+            else:
+                self._map.render_objects(long_lats, self._screen)
 
-        # Show the new image
-        pygame.display.flip()
+            # Show the new image
+            pygame.display.flip()
+
+    def play(self, drawables: List[FlightSegment]) -> None:
+        """ Starts playing back the timeline of the <drawables>, from the
+            first departure, or stops if it is already playing.
+
+            The timeline is built once, here, so each frame only looks up the
+            segments in the air at its minute.
+        """
+        if self._timeline is not None:
+            self._timeline = None
+            return
+        if isinstance(drawables, LazySegments):
+            drawables = drawables.loaded()
+        self._timeline = Timeline(drawables)
+        self._minute = self._timeline.start
+        self._speed = PLAYBACK_SPEED
+
+    def scrub(self, minutes: float) -> None:
+        """ Moves the timeline played back by <minutes>, forward or back. """
+        if self._timeline is not None:
+            self._minute = min(max(self._minute + minutes,
+                                   self._timeline.start), self._timeline.end)
+
+    def _draw_frame(self) -> None:
+        """ Advances the timeline by the time since the last frame, waiting
+            to keep to FPS frames per second, and renders the segments in the
+            air at its minute, with a dot where each plane is.
+        """
+        elapsed = self._clock.tick(FPS) / 1000
+        self.scrub(elapsed * self._speed)
+        with instrument.span("render.frame"):
+            active = self._timeline.seek(int(self._minute))
+            self._screen.fill(WHITE)
+            self._screen.blit(self._map.get_current_view(), (0, 0))
+            self._map.render_objects(active, self._screen)
+            self._map.render_positions(active, self._timeline, self._screen)
+
+            self._ui_screen.fill(GREY, ((SCREEN_SIZE[0], 450), (200, 40)))
+            label = "{:%Y-%m-%d %H:%M}  ({})".format(
+                moment_of(self._timeline.now()), len(active))
+            self._ui_screen.blit(self._font.render(label, True, WHITE),
+                                 (SCREEN_SIZE[0] + 10, 460))
+            pygame.display.flip()
 
     def has_quit(self) -> bool:
         """ Returns True if the program has received the quit command. """
@@ -156,6 +251,21 @@ class Visualizer:
                     num_threads = 1
                 elif event.unicode.lower() == "q":
                     self._quit = True
+                elif event.unicode.lower() == "h":
+                    self._heat = not self._heat
+                    self._map.clear_heatmap()
+                elif event.unicode.lower() == "p":
+                    self.play(drawables)
+                elif event.key == pygame.K_SPACE:
+                    self._speed = 0 if self._speed else PLAYBACK_SPEED
+                elif event.key == pygame.K_LEFT:
+                    self.scrub(-SCRUB_MINUTES)
+                elif event.key == pygame.K_RIGHT:
+                    self.scrub(SCRUB_MINUTES)
+                elif event.key == pygame.K_UP:
+                    self._speed = (self._speed or PLAYBACK_SPEED / 2) * 2
+                elif event.key == pygame.K_DOWN:
+                    self._speed /= 2
 
                 if f is not None:
                     def result_wrapper(fun: Callable[[List[Customer],
@@ -177,39 +287,51 @@ class Visualizer:
                         """ A wrapper for the application of filters with
                             threading
                         """
-                        chunk_sz_flights = math.ceil(
-                            (len(flight_data) + num_threads - 1) / num_threads)
-                        print("Num_threads:", num_threads)
-                        print("Chunk_flights:", chunk_sz_flights)
-                        threads = []
-                        results = []
-                        for i in range(num_threads):
-                            res = []
-                            results.append(res)
-                            t = threading.Thread(
-                                target=result_wrapper,
-                                args=(f.apply, customers_lst,
-                                      flight_data[i * chunk_sz_flights:
-                                                  (i + 1) * chunk_sz_flights],
-                                      filter_string.upper(), res))
-                            t.daemon = True
-                            t.start()
-                            threads.append(t)
-                            # f.apply(customers_lst, flight_data,
-                            #         filter_string.upper())
-                        # Wait to finish
-                        for t in threads:
-                            t.join()
-
-                        # Now reconstruct the data
-                        new_data = []
-                        for res in results:
-                            new_data.extend(res[0])
+                        with instrument.span("filter." + type(f).__name__):
+                            # Slicing a LazySegments loads every trip; the
+                            # filter is given it whole, so only those it
+                            # selects are loaded.
+                            if isinstance(flight_data, LazySegments):
+                                return f.apply(customers_lst, flight_data,
+                                               filter_string.upper())
+                            chunk_sz_flights = math.ceil(
+                                (len(flight_data) + num_threads - 1)
+                                / num_threads)
+                            threads = []
+                            results = []
+                            for i in range(num_threads):
+                                res = []
+                                results.append(res)
+                                t = threading.Thread(
+                                    target=result_wrapper,
+                                    args=(f.apply, customers_lst,
+                                          flight_data[
+                                              i * chunk_sz_flights:
+                                              (i + 1) * chunk_sz_flights],
+                                          filter_string.upper(), res))
+                                t.daemon = True
+                                t.start()
+                                threads.append(t)
+                                # f.apply(customers_lst, flight_data,
+                                #         filter_string.upper())
+                            # Wait to finish
+                            for t in threads:
+                                t.join()
+
+                            # Now reconstruct the data
+                            new_data = []
+                            for res in results:
+                                new_data.extend(res[0])
                         return new_data
 
                     new_drawables = self.entry_window(str(f), customers,
                                                       drawables,
                                                       threading_wrapper)
+                    self._map.clear_heatmap()
+                    # Play back what the filter left, from its start
+                    if self._timeline is not None:
+                        self._timeline = None
+                        self.play(new_drawables)
 
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
@@ -248,15 +370,12 @@ class Visualizer:
             el.grid(row=0, column=1)
 
         def callback_wrapper(input_string: str) -> None:
-            """ A wrapper to call the callback function on the <input_string>
-            and print the time taken for the function to execute.
+            """ A wrapper to call the callback function on the <input_string>.
+            The time it takes is recorded by its instrument span.
             """
             nonlocal new_drawables
             nonlocal m
-            t1 = time.time()
             new_drawables = callback(customers, drawables, input_string.upper())
-            t2 = time.time()
-            print("Time elapsed:  " + str(t2 - t1))
             m.destroy()
 
         Button(m, text="Apply Filter",
@@ -287,23 +406,27 @@ class Visualizer:
             exists = False
             if all_customers:
                 for cus in all_customers:
-                    for tp in cus.get_trips():
-                        if tp.get_reservation_id() == input_string:
-                            exists = True
-                            print("-------------------------------------------")
-                            print("Summary of Trip (ID: {}):".
-                                  format(input_string))
-                            print("-------------------------------------------")
-                            print("The itinerary for this trip is: {}.".
-                                  format(tp.get_flight_segments()))
-                            print("The cost of this trip is: ${:.2f}.".
-                                  format(cus.get_cost_of_trip(tp)))
-                            print("The total trip time is: {}-minutes.".
-                                  format(tp.get_total_trip_time))
-                            print("The time in-flight is: {}-minutes.".
-                                  format(tp.get_in_flight_time()))
-                            print("-------------------------------------------")
-                            print("\n")
+                    # A lazy customer only builds their trips if they
+                    # hold this reservation.
+                    tp = cus.get_trip(input_string)
+                    if tp is not None:
+                        exists = True
+                        print("-------------------------------------------")
+                        print("Summary of Trip (ID: {}):".
+                              format(input_string))
+                        print("-------------------------------------------")
+                        print("The itinerary for this trip is: {}.".
+                              format(tp.get_flight_segments()))
+                        print("The cost of this trip is: ${:.2f}.".
+                              format(cus.get_cost_of_trip(tp)))
+                        print("The total trip time is: {}-minutes.".
+                              format(tp.get_total_trip_time()))
+                        print("The time in-flight is: {}-minutes.".
+                              format(tp.get_in_flight_time()))
+                        print("The layover time is: {}-minutes.".
+                              format(tp.get_layover_time()))
+                        print("-------------------------------------------")
+                        print("\n")
                 if not exists:
                     print("This Trip (ID: {}) does not exist in your dataset!"
                           .format(input_string))
@@ -339,6 +462,13 @@ class Map:
     #    offset on y axis
     # _zoom:
     #    map zoom level
+    # _projected:
+    #    the screen points of each arc drawn at the current pan and zoom,
+    #    indexed by the id of the (shared) arc; cleared on pan or zoom.
+    # _heatmap:
+    #    the heatmap of the segments drawn, at the current pan and zoom, or
+    #    None if it is to be built again; cleared on pan or zoom, and when
+    #    the segments drawn change.
     image: pygame.image
     min_coords: Tuple[float, float]
     max_coords: Tuple[float, float]
@@ -346,6 +476,9 @@ class Map:
     _x_offset: int
     _y_offset: int
     _zoom: int
+    _projected: Dict[int, Tuple[Tuple[Tuple[float, float], ...],
+                                List[Tuple[int, int]]]]
+    _heatmap: Optional[pygame.Surface]
 
     def __init__(self, screen_dims: Tuple[int, int]) -> None:
         """ Initialize this map for the screen dimensions <screen_dims>. """
@@ -357,15 +490,64 @@ class Map:
         self._y_offset = 0
         self._zoom = 1
         self.screensize = screen_dims
+        self._projected = {}
+        self._heatmap = None
 
     def render_objects(self, drawables: List[FlightSegment],
                        screen: pygame.Surface) -> None:
-        """ Render the <drawables> onto the <screen>. """
+        """ Render the <drawables> onto the <screen>, each as the
+            great-circle arc of its route.
+
+            Segments on the same route share one arc, which is only projected
+            to screen coordinates once per pan or zoom.
+        """
         for drw in drawables:
-            long_lat_position = drw.get_long_lat()
-            pygame.draw.aaline(screen, LINE_COLOUR,
-                               self._long_lat_to_screen(long_lat_position[0]),
-                               self._long_lat_to_screen(long_lat_position[1]))
+            pygame.draw.aalines(screen, LINE_COLOUR, False,
+                                self._project(drw.get_arc()))
+
+    def render_heatmap(self, drawables: List[FlightSegment],
+                       screen: pygame.Surface) -> None:
+        """ Render the <drawables> onto the <screen> as a density heatmap of
+            their arcs.
+
+            The heatmap is rasterized into one surface the first time it is
+            rendered after a pan, zoom or change of segments (see
+            clear_heatmap); every other frame only blits that surface.
+        """
+        if self._heatmap is None:
+            with instrument.span("render.heatmap"):
+                heat = Heatmap(self.screensize)
+                heat.accumulate(drawables, self._project)
+                self._heatmap = pygame.image.frombuffer(
+                    heat.to_rgba(), self.screensize, "RGBA")
+        screen.blit(self._heatmap, (0, 0))
+
+    def clear_heatmap(self) -> None:
+        """ Has the heatmap built again when it is next rendered, as the
+            segments drawn have changed.
+        """
+        self._heatmap = None
+
+    def render_positions(self, drawables: List[FlightSegment],
+                         timeline: Timeline, screen: pygame.Surface) -> None:
+        """ Render a dot onto the <screen> where each of the <drawables> is
+            along its arc, at the current minute of the <timeline>.
+        """
+        for drw in drawables:
+            points = self._project(drw.get_arc())
+            pygame.draw.circle(screen, PLANE_COLOUR, points[round(
+                timeline.progress(drw) * (len(points) - 1))], 2)
+
+    def _project(self, arc: Tuple[Tuple[float, float], ...]) \
+            -> List[Tuple[int, int]]:
+        """ Returns the screen points of the <arc>, projecting it only if it
+            has not been since the last pan or zoom.
+        """
+        entry = self._projected.get(id(arc))
+        if entry is None or entry[0] is not arc:
+            entry = (arc, [self._long_lat_to_screen(p) for p in arc])
+            self._projected[id(arc)] = entry
+        return entry[1]
 
     def _long_lat_to_screen(self, location: Tuple[float, float]) \
             -> Tuple[int, int]:
@@ -413,6 +595,8 @@ class Map:
 
         self._x_offset = min(raw_width - zoom_width, max(0, self._x_offset))
         self._y_offset = min(raw_height - zoom_height, max(0, self._y_offset))
+        self._projected = {}
+        self._heatmap = None
 
     def get_current_view(self) -> pygame.Surface:
         """ Get the sub-image to display to screen from the map. """
@@ -433,8 +617,9 @@ if __name__ == '__main__':
         'allowed-import-modules': [
             'doctest', 'python_ta', 'typing',
             'tkinter', 'os', 'pygame',
-            'threading', 'math', 'time',
-            'customer', 'flight', 'filter', 'typing'
+            'threading', 'math',
+            'customer', 'flight', 'filter', 'typing', 'instrument',
+            'dataset', 'timeline', 'heatmap'
         ],
         'allowed-io': [
             'entry_window', 'callback_wrapper', 'threading_wrapper',